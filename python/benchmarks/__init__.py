@@ -0,0 +1,7 @@
+#!/usr/bin/env python3
+
+# NOTE: kept here so the CLI can offer the choices without importing the benchmarks
+BENCHMARK_NAMES = ("job", "spawn", "files", "logger", "parallel", "startup")
+
+# Allowed relative slowdown before a metric is flagged as a regression
+DEFAULT_THRESHOLD = 0.1
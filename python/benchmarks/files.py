@@ -0,0 +1,177 @@
+#!/usr/bin/env python3
+
+"""Local and remote files operations throughput on generated trees
+
+Remote paths run through a local ssh shim, no network or remote host is needed
+
+Run from the python directory:
+    python -m benchmarks.files [--files N] [--large-mb N]
+"""
+
+import argparse
+import json
+import logging
+import os
+import shutil
+import tempfile
+
+from zipfile import ZipFile
+
+from typing import Any
+from typing import Dict
+
+from libs import files
+from libs.capabilities import which
+from libs.logger import create_logger
+
+from benchmarks.utils import generate_tree
+from benchmarks.utils import rate
+from benchmarks.utils import ssh_shim
+
+_MIB = 1024 * 1024
+
+
+def _zip_tree(root: str, archive: str):
+    with ZipFile(archive, "w") as zf:
+        for dirpath, _, filenames in os.walk(root):
+            for filename in filenames:
+                path = os.path.join(dirpath, filename)
+                zf.write(path, os.path.relpath(path, root))
+
+
+def _text_tree(root: str, count: int):
+    """Tree of 4KiB text files, the generated trees are binary and search skips them"""
+    lines = "".join(f"line {i} of a generated text file\n" for i in range(128))[:4096]
+    for i in range(count):
+        dirname = os.path.join(root, f"d{i // 100:04d}")
+        if i % 100 == 0:
+            os.makedirs(dirname, exist_ok=True)
+        with open(os.path.join(dirname, f"f{i:06d}.txt"), "w") as data:
+            data.write(lines)
+
+
+def _fresh_dir(path: str):
+    shutil.rmtree(path, ignore_errors=True)
+    os.makedirs(path)
+
+
+def _remote(workdir: str, flat: str, small_zip: str, count: int, repeat: int) -> Dict[str, float]:
+    """Measure the remote code paths against the local ssh shim"""
+    results: Dict[str, float] = {}
+    ssh = os.environ.get("CLI_SSH")
+    os.environ["CLI_SSH"] = ssh_shim(workdir)
+    try:
+        results["remote_get_files_per_sec"] = rate(
+            count, lambda: files.get_files(flat, remote_host="localhost"), repeat
+        )
+
+        remote_dir = os.path.join(workdir, "remote_mkdir")
+        results["remote_disk_usage_per_sec"] = rate(1, lambda: files.disk_usage(flat, remote_host="localhost"), repeat)
+
+        results["remote_mkdir_per_sec"] = rate(
+            1,
+            lambda: files.mkdir(remote_dir, force=True, remote_host="localhost"),
+            repeat,
+            setup=lambda: shutil.rmtree(remote_dir, ignore_errors=True),
+        )
+
+        if which("unzip") is not None:
+            dest = os.path.join(workdir, "remote_extract")
+            results["remote_extract_files_per_sec"] = rate(
+                count,
+                lambda: files.extract(small_zip, dest, remote_host="localhost"),
+                repeat,
+                setup=lambda: _fresh_dir(dest),
+            )
+    finally:
+        if ssh is None:
+            del os.environ["CLI_SSH"]
+        else:
+            os.environ["CLI_SSH"] = ssh
+    return results
+
+
+def run(count: int = 2000, large_mb: int = 64, remote: bool = True, repeat: int = 3) -> Dict[str, Any]:
+    """Measure copy/remove/extract/get_files/disk_usage/search throughput
+
+    Args:
+        count (int): number of small (4KiB) files
+        large_mb (int): MiB of each of the 4 large files
+        remote (bool): measure the remote paths with a local ssh shim
+        repeat (int): measurements of each metric, the best one is reported
+
+    Returns:
+        Dict with the throughput of each metric
+    """
+    results: Dict[str, Any] = {}
+    workdir = tempfile.mkdtemp(prefix="cli_bench_")
+    try:
+        small = os.path.join(workdir, "small")
+        large = os.path.join(workdir, "large")
+        flat = os.path.join(workdir, "flat")
+        generate_tree(small, count, 4096)
+        large_bytes = generate_tree(large, 4, large_mb * _MIB, seed=1)
+        generate_tree(flat, count, 0, per_dir=count)
+        flat = os.path.join(flat, "d0000")
+
+        small_copy = os.path.join(workdir, "small_copy")
+        large_copy = os.path.join(workdir, "large_copy")
+        results["copy_small_files_per_sec"] = rate(
+            count,
+            lambda: files.copy(small, small_copy),
+            repeat,
+            setup=lambda: shutil.rmtree(small_copy, ignore_errors=True),
+        )
+        results["copy_large_mb_per_sec"] = rate(
+            large_bytes / _MIB,
+            lambda: files.copy(large, large_copy),
+            repeat,
+            setup=lambda: shutil.rmtree(large_copy, ignore_errors=True),
+        )
+
+        removed = os.path.join(workdir, "removed")
+        results["remove_small_files_per_sec"] = rate(
+            count,
+            lambda: files.remove(removed),
+            repeat,
+            setup=lambda: shutil.copytree(small, removed),
+        )
+
+        small_zip = os.path.join(workdir, "small.zip")
+        _zip_tree(small, small_zip)
+        extracted = os.path.join(workdir, "extracted")
+        results["extract_small_files_per_sec"] = rate(
+            count,
+            lambda: files.extract(small_zip, extracted),
+            repeat,
+            setup=lambda: shutil.rmtree(extracted, ignore_errors=True),
+        )
+
+        results["get_files_per_sec"] = rate(count, lambda: files.get_files(flat), repeat)
+        results["disk_usage_files_per_sec"] = rate(count, lambda: files.disk_usage(small), repeat)
+
+        text = os.path.join(workdir, "text")
+        _text_tree(text, count)
+        results["search_files_per_sec"] = rate(count, lambda: list(files.search(text, r"line 1\d of")), repeat)
+
+        if remote:
+            results.update(_remote(workdir, flat, small_zip, count, repeat))
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Files operations throughput benchmark")
+    parser.add_argument("--files", type=int, default=2000, help="Number of small files")
+    parser.add_argument("--large-mb", type=int, default=64, help="MiB of each large file")
+    parser.add_argument("--no-remote", dest="remote", action="store_false", help="Skip the remote paths")
+    args = parser.parse_args()
+
+    create_logger(stdout_level=logging.WARNING, filename=None)
+    print(json.dumps(run(args.files, args.large_mb, args.remote), indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,51 @@
+#!/usr/bin/env python3
+
+"""Job output and spawn throughput
+
+Run from the python directory:
+    python -m benchmarks.job [--count N] [--lines N]
+"""
+
+import argparse
+import json
+import logging
+
+from typing import Any
+from typing import Dict
+
+from libs.logger import create_logger
+from libs.shell import Job
+
+from benchmarks.utils import rate
+
+
+def run(count: int = 200, lines: int = 100000, repeat: int = 3) -> Dict[str, Any]:
+    """Measure the lines read per second of a chatty job and the jobs spawned per second
+
+    Args:
+        count (int): number of jobs spawned
+        lines (int): number of lines printed by the chatty job
+        repeat (int): measurements of each metric, the best one is reported
+
+    Returns:
+        Dict with the throughput of each metric
+    """
+    chatty = ["seq", str(lines)]
+    return {
+        "lines_per_sec": rate(lines, lambda: Job(chatty).execute(), repeat),
+        "spawns_per_sec": rate(count, lambda: [Job(["true"]).execute() for _ in range(count)], repeat),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Job throughput benchmark")
+    parser.add_argument("--count", type=int, default=200, help="Jobs spawned")
+    parser.add_argument("--lines", type=int, default=100000, help="Lines printed by the chatty job")
+    args = parser.parse_args()
+
+    create_logger(stdout_level=logging.WARNING, filename=None)
+    print(json.dumps(run(args.count, args.lines), indent=2))
+
+
+if __name__ == "__main__":
+    main()
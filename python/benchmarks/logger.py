@@ -0,0 +1,73 @@
+#!/usr/bin/env python3
+
+"""Logger records throughput with and without a file handler
+
+Run from the python directory:
+    python -m benchmarks.logger [--records N]
+"""
+
+import argparse
+import json
+import logging
+import os
+import shutil
+import tempfile
+
+from contextlib import redirect_stdout
+
+from typing import Any
+from typing import Dict
+from typing import Optional
+
+from libs.logger import create_logger
+
+from benchmarks.utils import rate
+
+
+def _records_per_sec(name: str, records: int, filename: Optional[str], repeat: int) -> float:
+    with open(os.devnull, "w") as devnull, redirect_stdout(devnull):
+        # NOTE: the stdout handler binds sys.stdout when it is created, the records end in devnull
+        logger = create_logger(stdout_level=logging.INFO, file_level=logging.DEBUG, filename=filename, name=name)
+
+        def _log():
+            for i in range(records):
+                logger.info(f"Benchmark record {i}")
+
+        try:
+            return rate(records, _log, repeat)
+        finally:
+            for handler in list(logger.handlers):
+                handler.close()
+                logger.removeHandler(handler)
+
+
+def run(records: int = 50000, repeat: int = 3) -> Dict[str, Any]:
+    """Measure the records logged per second to the console and to the console plus a logfile
+
+    Args:
+        records (int): records logged in each measurement
+        repeat (int): measurements of each metric, the best one is reported
+
+    Returns:
+        Dict with the throughput of each metric
+    """
+    workdir = tempfile.mkdtemp(prefix="cli_bench_")
+    try:
+        return {
+            "records_per_sec": _records_per_sec("bench.stdout", records, None, repeat),
+            "records_file_per_sec": _records_per_sec("bench.file", records, os.path.join(workdir, "bench.log"), repeat),
+        }
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Logger throughput benchmark")
+    parser.add_argument("--records", type=int, default=50000, help="Records logged in each measurement")
+    args = parser.parse_args()
+
+    print(json.dumps(run(args.records), indent=2))
+
+
+if __name__ == "__main__":
+    main()
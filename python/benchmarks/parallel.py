@@ -0,0 +1,76 @@
+#!/usr/bin/env python3
+
+"""run_parallel scaling with the concurrency limit
+
+Run from the python directory:
+    python -m benchmarks.parallel [--tasks N] [--sleep SECONDS]
+"""
+
+import argparse
+import asyncio
+import importlib
+import json
+import logging
+import time
+
+from typing import Any
+from typing import Dict
+from typing import Sequence
+
+from libs.logger import create_logger
+
+from benchmarks.utils import rate
+
+# NOTE: async is a reserved word, the module cannot be imported with the import statement
+_async = importlib.import_module("libs.async")
+
+LIMITS = (1, 2, 4, 8, 16, 32)
+
+
+def run(tasks: int = 64, sleep: float = 0.01, limits: Sequence[int] = LIMITS, repeat: int = 3) -> Dict[str, Any]:
+    """Measure run_parallel throughput of blocking tasks for each concurrency limit and its raw overhead
+
+    Args:
+        tasks (int): blocking tasks executed in each measurement
+        sleep (float): seconds each blocking task waits, emulates a short job
+        limits (Sequence[int]): concurrency limits to measure
+        repeat (int): measurements of each metric, the best one is reported
+
+    Returns:
+        Dict with the throughput of each limit, the efficiency against a perfect scaling and the no-op
+        coroutines per second
+    """
+    results: Dict[str, Any] = {}
+
+    def _blocking():
+        time.sleep(sleep)
+
+    for limit in limits:
+        results[f"limit_{limit}_tasks_per_sec"] = rate(
+            tasks, lambda: asyncio.run(_async.run_parallel(*([_blocking] * tasks), limit=limit)), repeat
+        )
+        # Perfect scaling is limit tasks every sleep seconds
+        results[f"limit_{limit}_efficiency"] = results[f"limit_{limit}_tasks_per_sec"] * sleep / min(limit, tasks)
+
+    async def _noop():
+        pass
+
+    noops = tasks * 100
+    results["noop_tasks_per_sec"] = rate(
+        noops, lambda: asyncio.run(_async.run_parallel(*[_noop() for _ in range(noops)])), repeat
+    )
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="run_parallel scaling benchmark")
+    parser.add_argument("--tasks", type=int, default=64, help="Blocking tasks executed in each measurement")
+    parser.add_argument("--sleep", type=float, default=0.01, help="Seconds each blocking task waits")
+    args = parser.parse_args()
+
+    create_logger(stdout_level=logging.WARNING, filename=None)
+    print(json.dumps(run(args.tasks, args.sleep), indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,104 @@
+#!/usr/bin/env python3
+
+"""Compare Job spawn throughput with and without the spawn server, sequential and from many threads
+
+Run from the python directory:
+    python -m benchmarks.spawn [--count N] [--jobs N] [--heap MB]
+"""
+
+import argparse
+import json
+import logging
+import time
+
+from concurrent.futures import ThreadPoolExecutor
+
+from typing import Any
+from typing import Dict
+from typing import List
+from typing import Sequence
+
+from libs import spawn
+from libs.logger import create_logger
+from libs.shell import Job
+
+
+def spawns_per_sec(cmd: Sequence[str], count: int) -> float:
+    """Execute cmd count times
+
+    Returns:
+        Number of jobs executed per second
+    """
+    start = time.monotonic()
+    for _ in range(count):
+        Job(cmd).execute()
+    return count / (time.monotonic() - start)
+
+
+def concurrent_spawns_per_sec(cmd: Sequence[str], count: int, jobs: int) -> float:
+    """Execute cmd count times from jobs threads, like Scheduler or fleet do
+
+    Returns:
+        Number of jobs executed per second
+    """
+    start = time.monotonic()
+    with ThreadPoolExecutor(max_workers=jobs) as pool:
+        for _ in pool.map(lambda _: Job(cmd).execute(), range(count)):
+            pass
+    return count / (time.monotonic() - start)
+
+
+def _measure(count: int, jobs: int, cmd: Sequence[str], sleep: float) -> Dict[str, float]:
+    return {
+        "spawns_per_sec": spawns_per_sec(cmd, count),
+        "concurrent_spawns_per_sec": concurrent_spawns_per_sec(cmd, count, jobs),
+        # Jobs that outlive the spawn, reaches count/sleep only if they really overlap
+        "overlapped_sleeps_per_sec": concurrent_spawns_per_sec(["sleep", str(sleep)], jobs * 2, jobs),
+    }
+
+
+def run(count: int = 500, jobs: int = 8, heap: int = 0, cmd: Sequence[str] = ("true",)) -> Dict[str, Any]:
+    """Measure spawns/sec using subprocess and the spawn server
+
+    Args:
+        count (int): number of jobs to execute in each mode
+        jobs (int): threads executing jobs at the same time in the concurrent measurements
+        heap (int): MiB of memory allocated in the parent before measuring, emulates a large process
+        cmd (Sequence[str]): command to spawn
+
+    Returns:
+        Dict with the spawns/sec of each mode
+    """
+    sleep = 0.2
+    server = spawn.start_spawn_server()
+    # NOTE: the ballast is allocated after forking the server, like a long running process would
+    ballast: List[bytes] = [bytes(1024 * 1024) for _ in range(heap)]
+    try:
+        spawned = _measure(count, jobs, cmd, sleep)
+    finally:
+        spawn.stop_spawn_server()
+    direct = _measure(count, jobs, cmd, sleep)
+    del ballast, server
+
+    results: Dict[str, Any] = {"cmd": list(cmd), "count": count, "jobs": jobs, "heap_mb": heap}
+    for metric in direct:
+        results[f"popen_{metric}"] = direct[metric]
+        results[f"server_{metric}"] = spawned[metric]
+    results["speedup"] = spawned["spawns_per_sec"] / direct["spawns_per_sec"]
+    results["concurrent_speedup"] = spawned["concurrent_spawns_per_sec"] / direct["concurrent_spawns_per_sec"]
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Job spawn throughput benchmark")
+    parser.add_argument("--count", type=int, default=500, help="Jobs executed in each mode")
+    parser.add_argument("--jobs", type=int, default=8, help="Threads executing jobs concurrently")
+    parser.add_argument("--heap", type=int, default=0, help="MiB allocated in the parent process")
+    args = parser.parse_args()
+
+    create_logger(stdout_level=logging.WARNING, filename=None)
+    print(json.dumps(run(args.count, args.jobs, args.heap), indent=2))
+
+
+if __name__ == "__main__":
+    main()
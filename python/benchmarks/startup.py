@@ -0,0 +1,118 @@
+#!/usr/bin/env python3
+
+"""cli.py startup time and import budget
+
+The import time is measured with -X importtime, minus what the bare interpreter imports, which makes it
+independent of the machine load. Exits with an error if any command goes over its budget
+
+Run from the python directory:
+    python -m benchmarks.startup [--count N]
+"""
+
+import argparse
+import json
+import logging
+import os
+import subprocess
+import sys
+
+from typing import Any
+from typing import Dict
+from typing import List
+from typing import Sequence
+
+from libs.logger import create_logger
+from libs.logger import get_logger
+
+from benchmarks.utils import rate
+
+CLI = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "cli.py")
+
+COMMANDS: Dict[str, Sequence[str]] = {
+    "version": ["--version"],
+    "help": ["--help"],
+}
+
+# Milliseconds of imports allowed for each command on top of the interpreter ones
+BUDGETS: Dict[str, float] = {
+    "version": 20.0,
+    "help": 45.0,
+}
+
+
+def _import_ms(args: Sequence[str]) -> float:
+    """Total import time of the top level imports reported by -X importtime"""
+    output = subprocess.run(
+        [sys.executable, "-X", "importtime"] + list(args),
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.PIPE,
+        universal_newlines=True,
+        check=True,
+    ).stderr
+    total = 0
+    for line in output.splitlines():
+        if not line.startswith("import time:"):
+            continue
+        _, cumulative, name = line[len("import time:") :].split("|")
+        # Nested imports are indented and already counted in the cumulative time of their parent
+        if not name[1:].startswith(" ") and cumulative.strip().isdigit():
+            total += int(cumulative)
+    return total / 1000
+
+
+def run(count: int = 20, repeat: int = 3) -> Dict[str, Any]:
+    """Measure the startups per second and the import time of each command
+
+    Args:
+        count (int): cli.py executions in each measurement
+        repeat (int): measurements of each metric, the best one is reported
+
+    Returns:
+        Dict with the throughput and import time of each command
+    """
+    baseline = min(_import_ms(["-c", "pass"]) for _ in range(repeat))
+    results: Dict[str, Any] = {}
+    for name, args in COMMANDS.items():
+        cmd = [sys.executable, CLI] + list(args)
+
+        def _start():
+            for _ in range(count):
+                subprocess.run(cmd, stdout=subprocess.DEVNULL, check=True)
+
+        results[f"{name}_starts_per_sec"] = rate(count, _start, repeat)
+        results[f"{name}_import_ms"] = min(_import_ms([CLI] + list(args)) for _ in range(repeat)) - baseline
+    return results
+
+
+def check(results: Dict[str, Any]) -> List[str]:
+    """Compare the import times against their budgets
+
+    Args:
+        results (Dict[str, Any]): output of run
+
+    Returns:
+        Commands over their budget
+    """
+    log = get_logger("Main")
+    over = []
+    for name, budget in BUDGETS.items():
+        spent = results.get(f"{name}_import_ms")
+        if spent is not None and spent > budget:
+            log.error(f"cli.py {' '.join(COMMANDS[name])} imports take {spent:.1f}ms, budget is {budget:.1f}ms")
+            over.append(name)
+    return over
+
+
+def main():
+    parser = argparse.ArgumentParser(description="cli.py startup benchmark and import budget check")
+    parser.add_argument("--count", type=int, default=20, help="cli.py executions in each measurement")
+    args = parser.parse_args()
+
+    create_logger(stdout_level=logging.WARNING, filename=None)
+    results = run(args.count)
+    print(json.dumps(results, indent=2))
+    return 1 if check(results) else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,181 @@
+#!/usr/bin/env python3
+
+"""Run all the benchmarks, store the results as JSON and compare them against a previous run
+
+Run from the python directory:
+    python -m benchmarks.suite [--quick] [--only NAME ...] [--output FILE] [--compare BASELINE]
+
+or through the CLI:
+    ./cli.py bench [--quick] [--only NAME ...] [--output FILE] [--compare BASELINE]
+"""
+
+import argparse
+import json
+import logging
+import os
+import platform
+import sys
+import time
+
+from typing import Any
+from typing import Callable
+from typing import Dict
+from typing import List
+from typing import Optional
+from typing import Sequence
+from typing import Tuple
+
+from libs.constants import VERSION
+from libs.logger import create_logger
+from libs.logger import get_logger
+
+from benchmarks import DEFAULT_THRESHOLD
+from benchmarks import files
+from benchmarks import job
+from benchmarks import logger
+from benchmarks import parallel
+from benchmarks import spawn
+from benchmarks import startup
+
+BENCHMARKS: Dict[str, Callable[..., Dict[str, Any]]] = {
+    "job": job.run,
+    "spawn": spawn.run,
+    "files": files.run,
+    "logger": logger.run,
+    "parallel": parallel.run,
+    "startup": startup.run,
+}
+
+# Smaller workloads for CI smoke runs, the numbers are noisier but still comparable between quick runs
+QUICK: Dict[str, Dict[str, Any]] = {
+    "job": {"count": 50, "lines": 20000},
+    "spawn": {"count": 100},
+    "files": {"count": 200, "large_mb": 8},
+    "logger": {"records": 10000},
+    "parallel": {"tasks": 16},
+    "startup": {"count": 5},
+}
+
+# Only throughput metrics are compared, all of them are better when higher
+_METRIC_SUFFIX = "_per_sec"
+
+
+def run(names: Optional[Sequence[str]] = None, quick: bool = False) -> Dict[str, Any]:
+    """Run the requested benchmarks
+
+    Args:
+        names (Optional[Sequence[str]]): benchmarks to run, defaults to all of them
+        quick (bool): use the smaller workloads
+
+    Returns:
+        Dict with the run metadata and the results of each benchmark
+    """
+    log = get_logger("Main")
+    names = list(BENCHMARKS.keys()) if not names else names
+    results: Dict[str, Any] = {}
+    for name in names:
+        if name not in BENCHMARKS:
+            raise Exception(f"Unknown benchmark {name}, available: {', '.join(BENCHMARKS.keys())}")
+        log.info(f"Running {name} benchmark")
+        start = time.monotonic()
+        results[name] = BENCHMARKS[name](**(QUICK[name] if quick else {}))
+        log.debug(f"{name} benchmark took {time.monotonic() - start:.1f}s")
+
+    return {
+        "meta": {
+            "version": VERSION,
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpus": os.cpu_count(),
+            "quick": quick,
+            "date": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        },
+        "results": results,
+    }
+
+
+def compare(
+    baseline: Dict[str, Any],
+    current: Dict[str, Any],
+    threshold: float = DEFAULT_THRESHOLD,
+) -> List[Tuple[str, float, float]]:
+    """Find the metrics that got slower than the baseline
+
+    Args:
+        baseline (Dict[str, Any]): previous run
+        current (Dict[str, Any]): new run
+        threshold (float): allowed relative slowdown, 0.1 means 10% less throughput
+
+    Returns:
+        List of the regressed metrics as (benchmark.metric, baseline, current)
+    """
+    regressions = []
+    for name, metrics in current["results"].items():
+        previous = baseline["results"].get(name, {})
+        for metric, value in metrics.items():
+            old = previous.get(metric)
+            if not metric.endswith(_METRIC_SUFFIX) or not isinstance(old, (int, float)) or old <= 0:
+                continue
+            if value < old * (1 - threshold):
+                regressions.append((f"{name}.{metric}", old, value))
+    return regressions
+
+
+def report(
+    results: Dict[str, Any],
+    output: Optional[str] = None,
+    baseline: Optional[str] = None,
+    threshold: float = DEFAULT_THRESHOLD,
+) -> bool:
+    """Write the results and flag the regressions against a baseline
+
+    Args:
+        results (Dict[str, Any]): output of run
+        output (Optional[str]): JSON file to store the results, defaults to stdout
+        baseline (Optional[str]): JSON file of a previous run
+        threshold (float): allowed relative slowdown
+
+    Returns:
+        True if there are no regressions and the startup is within budget, False otherwise
+    """
+    log = get_logger("Main")
+    within_budget = "startup" not in results["results"] or not startup.check(results["results"]["startup"])
+    if output is None:
+        print(json.dumps(results, indent=2))
+    else:
+        with open(output, "w") as data:
+            json.dump(results, data, indent=2)
+        log.info(f"Results written to {output}")
+
+    if baseline is None:
+        return within_budget
+
+    with open(baseline) as data:
+        previous = json.load(data)
+
+    if previous.get("meta", {}).get("quick") != results["meta"]["quick"]:
+        log.warning("Comparing a quick run against a full run, the numbers are not comparable")
+
+    regressions = compare(previous, results, threshold)
+    for metric, old, new in regressions:
+        log.error(f"Regression in {metric}: {old:.1f} -> {new:.1f} ({(new - old) / old:+.1%})")
+    if not regressions:
+        log.info(f"No regressions over {threshold:.0%} against {baseline}")
+    return within_budget and not regressions
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Benchmark suite")
+    parser.add_argument("--only", nargs="+", choices=list(BENCHMARKS.keys()), help="Benchmarks to run")
+    parser.add_argument("--quick", action="store_true", help="Use smaller workloads")
+    parser.add_argument("--output", type=str, default=None, help="JSON file to store the results")
+    parser.add_argument("--compare", type=str, default=None, help="JSON results of a previous run")
+    parser.add_argument("--threshold", type=float, default=DEFAULT_THRESHOLD, help="Allowed relative slowdown")
+    args = parser.parse_args(argv)
+
+    create_logger(stdout_level=logging.INFO, filename=None)
+    return 0 if report(run(args.only, args.quick), args.output, args.compare, args.threshold) else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,94 @@
+#!/usr/bin/env python3
+
+"""Shared helpers of the benchmarks"""
+
+import os
+import random
+import stat
+import time
+
+from typing import Any
+from typing import Callable
+from typing import Optional
+
+_SHIM = """#!/bin/sh
+# Local ssh shim for the benchmarks: drop the ssh options/host and run the remote command locally
+for last; do :; done
+exec sh -c "$last"
+"""
+
+
+def rate(
+    count: float,
+    function: Callable[[], Any],
+    repeat: int = 3,
+    setup: Optional[Callable[[], Any]] = None,
+) -> float:
+    """Run function repeat times and report the best throughput
+
+    The best run is the one with less noise from the rest of the machine, which makes the numbers
+    comparable between runs
+
+    Args:
+        count (float): units of work done by each call of function
+        function (Callable[[], Any]): function to measure
+        repeat (int): number of measurements
+        setup (Optional[Callable[[], Any]]): untimed function called before each measurement
+
+    Returns:
+        Best units per second of all the runs
+    """
+    best = 0.0
+    for _ in range(max(repeat, 1)):
+        if setup is not None:
+            setup()
+        start = time.perf_counter()
+        function()
+        elapsed = time.perf_counter() - start
+        best = max(best, count / elapsed if elapsed > 0 else float("inf"))
+    return best
+
+
+def generate_tree(root: str, files: int, size: int, seed: int = 0, per_dir: int = 100) -> int:
+    """Generate a reproducible tree of files
+
+    Args:
+        root (str): directory to create the files in
+        files (int): number of files
+        size (int): bytes of each file
+        seed (int): random seed of the files content
+        per_dir (int): max number of files in each subdirectory
+
+    Returns:
+        Total number of bytes written
+    """
+    generator = random.Random(seed)
+    # NOTE: a single random block repeated keeps the generation cheap while avoiding sparse/zero pages
+    block = bytes(generator.getrandbits(8) for _ in range(min(size, 64 * 1024)))
+    for i in range(files):
+        dirname = os.path.join(root, f"d{i // per_dir:04d}")
+        if i % per_dir == 0:
+            os.makedirs(dirname, exist_ok=True)
+        with open(os.path.join(dirname, f"f{i:06d}.bin"), "wb") as data:
+            remaining = size
+            while remaining > 0:
+                chunk = block[:remaining]
+                data.write(chunk)
+                remaining -= len(chunk)
+    return files * size
+
+
+def ssh_shim(dirname: str) -> str:
+    """Write a local ssh shim, remote paths are measured without network or a real host
+
+    Args:
+        dirname (str): directory to write the shim in
+
+    Returns:
+        Path of the shim executable
+    """
+    shim = os.path.join(dirname, "ssh")
+    with open(shim, "w") as data:
+        data.write(_SHIM)
+    os.chmod(shim, os.stat(shim).st_mode | stat.S_IXUSR)
+    return shim
@@ -26,35 +26,44 @@ Description: TODO
          .`       github.com/mike325/       `/
 """
 
+# NOTE: Only the bare minimum is imported at load time, the tool is called in tight shell loops.
+#       Everything else is imported by the function that needs it, --version does not even load argparse
+
 # from datetime import datetime
-import argparse
-import logging
+# import argparse
+# import logging
 import os
 
 # import subprocess
-# import sys
+import sys
+
 # import re
 # import shutil
 
 # from typing import Dict
 from typing import Optional
+from typing import List
+from typing import Tuple
+from typing import TextIO
+from typing import TYPE_CHECKING
 
-# from typing import List
 # from typing import Sequence
-# from typing import TextIO
+
 # from typing import Any
 # from typing import Union
 # from typing import cast
 # from dataclasses import dataclass, field
 
-from libs.logger import create_logger
-from libs.logger import str_to_logging
-
 from libs.constants import HEADER
 from libs.constants import AUTHOR
 from libs.constants import VERSION
+from libs.constants import DAEMON_SOCKET
+from libs.constants import SPAWN_SERVER_ENV
 
-_log: logging.Logger
+if TYPE_CHECKING:
+    import logging
+
+_log: "logging.Logger"
 # _SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
 _SCRIPTNAME = os.path.basename(__file__)
 _log_file: Optional[str] = os.path.splitext(_SCRIPTNAME)[0] + ".log"
@@ -64,13 +73,20 @@ _log_file: Optional[str] = os.path.splitext(_SCRIPTNAME)[0] + ".log"
 # _home = os.environ['USERPROFILE' if _is_windows else 'HOME']
 
 
-def _parseArgs():
+def _parseArgs(argv: Optional[List[str]] = None):
     """Parse CLI arguments
 
+    Args:
+        argv: arguments to parse, defaults to sys.argv
+
     Returns
         argparse.ArgumentParser class instance
 
     """
+    import argparse
+
+    from benchmarks import BENCHMARK_NAMES
+    from benchmarks import DEFAULT_THRESHOLD
 
     class NegateAction(argparse.Action):
         def __call__(self, parser, ns, values, option):
@@ -103,8 +119,6 @@ def _parseArgs():
 
     parser.add_argument(
         "--log",
-        "--nolog",
-        "--no-log",
         dest="logfile",
         action=ChangeLogFile,
         default=_log_file,
@@ -113,6 +127,16 @@ def _parseArgs():
         help="Log filename or disable log file",
     )
 
+    # NOTE: Kept apart from --log so they do not swallow the subcommand as a filename
+    parser.add_argument(
+        "--nolog",
+        "--no-log",
+        dest="logfile",
+        action=ChangeLogFile,
+        nargs=0,
+        help="Disable log file",
+    )
+
     parser.add_argument(
         "--version",
         dest="show_version",
@@ -154,7 +178,232 @@ def _parseArgs():
         help="File logger verbosity",
     )
 
-    return parser.parse_args()
+    parser.add_argument(
+        "--profile",
+        dest="profile",
+        action="store_true",
+        default=False,
+        help="Profile the run, writes pstats and collapsed stacks next to the log file",
+    )
+
+    parser.add_argument(
+        "--trace-malloc",
+        dest="trace_malloc",
+        action="store_true",
+        default=False,
+        help="Trace memory allocations, writes the peak and top allocations next to the log file",
+    )
+
+    subparsers = parser.add_subparsers(dest="command")
+
+    run_parser = subparsers.add_parser("run", help="Execute a manifest of commands and files operations")
+    run_parser.add_argument(
+        "-m",
+        "--manifest",
+        dest="manifest",
+        required=True,
+        type=str,
+        help="JSON/YAML manifest with the entries to execute",
+    )
+    run_parser.add_argument(
+        "-j",
+        "--jobs",
+        dest="jobs",
+        default=os.cpu_count() or 1,
+        type=int,
+        help="Max number of entries running at the same time",
+    )
+    run_parser.add_argument(
+        "--logs-dir",
+        dest="logs_dir",
+        default=None,
+        type=str,
+        help="Directory of the per entry logs, defaults to <manifest>_logs",
+    )
+
+    bench_parser = subparsers.add_parser("bench", help="Run the benchmark suite and flag regressions")
+    bench_parser.add_argument(
+        "--only",
+        dest="only",
+        nargs="+",
+        choices=BENCHMARK_NAMES,
+        default=None,
+        help="Benchmarks to run, defaults to all of them",
+    )
+    bench_parser.add_argument(
+        "--quick",
+        dest="quick",
+        action="store_true",
+        default=False,
+        help="Use smaller workloads",
+    )
+    bench_parser.add_argument(
+        "-o",
+        "--output",
+        dest="output",
+        default=None,
+        type=str,
+        help="JSON file to store the results, defaults to stdout",
+    )
+    bench_parser.add_argument(
+        "--compare",
+        dest="baseline",
+        default=None,
+        type=str,
+        help="JSON results of a previous run, exit with error if any metric regressed",
+    )
+    bench_parser.add_argument(
+        "--threshold",
+        dest="threshold",
+        default=DEFAULT_THRESHOLD,
+        type=float,
+        help="Allowed relative slowdown before flagging a regression",
+    )
+
+    daemon_parser = subparsers.add_parser(
+        "daemon",
+        help="Stay resident in a UNIX socket serving client requests with warm loggers, caches and connections",
+    )
+    daemon_parser.add_argument(
+        "--socket",
+        dest="socket",
+        default=DAEMON_SOCKET,
+        type=str,
+        help="UNIX socket to listen, defaults to $CLI_DAEMON_SOCKET or the cache dir",
+    )
+    daemon_parser.add_argument(
+        "--stop",
+        dest="stop",
+        action="store_true",
+        default=False,
+        help="Stop the running daemon",
+    )
+
+    client_parser = subparsers.add_parser(
+        "client",
+        help="Forward the command to a running daemon, runs it locally if there is no daemon",
+    )
+    client_parser.add_argument(
+        "--socket",
+        dest="socket",
+        default=DAEMON_SOCKET,
+        type=str,
+        help="UNIX socket of the daemon, defaults to $CLI_DAEMON_SOCKET or the cache dir",
+    )
+    client_parser.add_argument(
+        "argv",
+        nargs=argparse.REMAINDER,
+        help="Command line to forward, e.g. client run -m manifest.yaml",
+    )
+
+    argv = sys.argv[1:] if argv is None else argv
+    if "client" not in argv:
+        return parser.parse_args(argv)
+
+    # NOTE: REMAINDER does not collect arguments starting with "-", split the forwarded command line ourselves,
+    #       the global options before "client" are forwarded too
+    client = argv.index("client")
+    index = client + 1
+    if argv[index : index + 1] == ["--socket"]:
+        index += 2
+    elif argv[index : index + 1] and argv[index].startswith("--socket="):
+        index += 1
+    args = parser.parse_args(argv[:index])
+    args.argv = argv[:client] + argv[index:]
+    return args
+
+
+def _levels(args) -> Tuple[int, int]:
+    """Get the console and file logging levels requested in the CLI arguments
+
+    Returns
+        tuple with the stdout and the file logging levels
+
+    """
+    from libs.logger import str_to_logging
+
+    stdout_level = args.stdout_logging if not args.verbose else "debug"
+    file_level = args.file_logging if not args.verbose else "debug"
+
+    stdout_level = stdout_level if not args.quiet else 0
+    file_level = file_level if not args.quiet else 0
+
+    return str_to_logging(stdout_level), str_to_logging(file_level)
+
+
+def _profile_output(args):
+    """Write the profiling files next to the log file"""
+    from libs.profiling import set_output
+
+    if args.logfile is None:
+        set_output(None)
+    else:
+        logfile = os.path.abspath(args.logfile)
+        set_output(os.path.dirname(logfile), os.path.splitext(os.path.basename(logfile))[0])
+
+
+def _execute(args) -> int:
+    """Execute the requested command
+
+    Returns
+        exit code, 0 in success any other integer in failure
+
+    """
+    errors = 0
+    try:
+        if args.command == "run":
+            from libs.manifest import load_manifest
+            from libs.manifest import run_manifest
+
+            logs_dir = args.logs_dir
+            if logs_dir is None:
+                logs_dir = os.path.splitext(os.path.basename(args.manifest))[0] + "_logs"
+            errors = 0 if run_manifest(load_manifest(args.manifest), args.jobs, logs_dir) else 1
+        elif args.command == "bench":
+            from benchmarks.suite import report
+            from benchmarks.suite import run as run_benchmarks
+
+            results = run_benchmarks(args.only, args.quick)
+            errors = 0 if report(results, args.output, args.baseline, args.threshold) else 1
+    except (Exception, KeyboardInterrupt) as e:
+        _log.exception(f"Halting due to {str(e.__class__.__name__)} exception")
+        errors = 1
+
+    return errors
+
+
+def _serve_request(argv: List[str], stream: TextIO) -> int:
+    """Run a client request inside the daemon, the console records go back to the client
+
+    The daemon keeps its own logfile, the client logging flags only control the forwarded records
+
+    Returns
+        exit code, 0 in success any other integer in failure
+
+    """
+    from libs.logger import _get_stdout_handler
+    from libs.profiling import profile
+
+    args = _parseArgs(argv)
+
+    if args.show_version:
+        print(f"{HEADER}\nAuthor:   {AUTHOR}\nVersion:  {VERSION}")
+        return 0
+
+    if args.command in ("daemon", "client"):
+        _log.error(f"{args.command} cannot be requested to a running daemon")
+        return 1
+
+    stdout_level, _ = _levels(args)
+    handler = _get_stdout_handler(stdout_level, args.color, stream)
+    _log.addHandler(handler)
+    try:
+        if args.profile or args.trace_malloc:
+            _profile_output(args)
+        with profile(args.profile, args.trace_malloc):
+            return _execute(args)
+    finally:
+        _log.removeHandler(handler)
 
 
 def main():
@@ -166,38 +415,85 @@ def main():
     """
     global _log
 
+    if sys.argv[1:] == ["--version"]:
+        print(f"{HEADER}\nAuthor:   {AUTHOR}\nVersion:  {VERSION}")
+        return 0
+
     args = _parseArgs()
 
+    no_daemon = None
+    if args.command == "client":
+        from libs.daemon import request
+        from libs.daemon import DaemonBusy
+        from libs.daemon import DaemonDisconnected
+
+        try:
+            return request(args.argv, args.socket)
+        except (ConnectionRefusedError, FileNotFoundError, DaemonBusy) as e:
+            # Fallback to a regular local run so cron/CI hooks keep working without a daemon
+            no_daemon = e
+            args = _parseArgs(args.argv)
+        except DaemonDisconnected as e:
+            # NOTE: the daemon may have run part of the request already, running it again is not safe
+            print(str(e), file=sys.stderr)
+            return 1
+
     if args.show_version:
         print(f"{HEADER}\nAuthor:   {AUTHOR}\nVersion:  {VERSION}")
         return 0
 
-    stdout_level = args.stdout_logging if not args.verbose else "debug"
-    file_level = args.file_logging if not args.verbose else "debug"
+    if args.command == "daemon" and args.stop:
+        from libs.daemon import stop
+        from libs.daemon import DaemonDisconnected
 
-    stdout_level = stdout_level if not args.quiet else 0
-    file_level = file_level if not args.quiet else 0
+        try:
+            return stop(args.socket)
+        except (OSError, DaemonDisconnected) as e:
+            print(f"There is no daemon listening in {args.socket}: {e}", file=sys.stderr)
+            return 1
+
+    if os.environ.get(SPAWN_SERVER_ENV) == "1" and os.name != "nt":
+        from libs.spawn import start_spawn_server
+
+        # NOTE: fork the spawn server now, while the process is small and has no threads
+        start_spawn_server()
+
+    from libs.logger import create_logger
+    from libs.profiling import profile
+
+    stdout_level, file_level = _levels(args)
 
     _log = create_logger(
-        stdout_level=str_to_logging(stdout_level),
-        file_level=str_to_logging(file_level),
+        stdout_level=stdout_level,
+        file_level=file_level,
         color=args.color,
         filename=args.logfile,
     )
 
+    if no_daemon is not None:
+        _log.debug(f"Daemon not available ({no_daemon}), running locally")
+
     # _log.debug('This is a DEBUG message')
     # _log.info('This is a INFO message')
     # _log.warning('This is a WARNing message')
     # _log.error('This is a ERROR message')
 
-    errors = 0
-    try:
-        pass
-    except (Exception, KeyboardInterrupt) as e:
-        _log.exception(f"Halting due to {str(e.__class__.__name__)} exception")
-        errors = 1
+    _profile_output(args)
 
-    return errors
+    with profile(args.profile, args.trace_malloc):
+        if args.command == "daemon":
+            from libs.daemon import serve
+            from libs.shell import enable_ssh_pool
+
+            # Reuse ssh connections between requests
+            enable_ssh_pool()
+            try:
+                return serve(_serve_request, args.socket)
+            except Exception as e:
+                _log.error(str(e))
+                return 1
+
+        return _execute(args)
 
 
 if __name__ == "__main__":
@@ -4,26 +4,37 @@
 # import argparse
 import logging
 
-# import os
+import os
+
 # import subprocess
 # import sys
 # import re
 # import shutil
 # import datetime
 import asyncio
+import functools
+
+from concurrent.futures import Executor
+from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import ProcessPoolExecutor
 
 from typing import Awaitable
 
-# from typing import Dict
-# from typing import Optional
-# from typing import List
-# from typing import Sequence
+from typing import Dict
+from typing import Optional
+from typing import List
+from typing import Sequence
+from typing import Callable
+from typing import Iterable
+from typing import AsyncIterable
+from typing import AsyncIterator
+
 # from typing import TextIO
 from typing import Any
+from typing import Union
 
-# from typing import Union
 # from typing import cast
-# # from dataclasses import dataclass, field
+from dataclasses import dataclass, field
 
 # from pathlib import Path
 # from zipfile import ZipFile
@@ -39,16 +50,350 @@ _log: logging.Logger
 # _is_windows = os.name == 'nt'
 # _home = os.environ['USERPROFILE' if _is_windows else 'HOME']
 
-# TODO: Expand this functions to execute threads and processes
+DEFAULT_CONCURRENCY = 32
+
+# Marks the end of the items flowing through a pipeline queue
+_STOP = object()
+
+
+@dataclass
+class Task(object):
+    """Blocking callable to be executed by a TaskRunner
+
+    By default the callable runs in a thread pool, CPU bound functions should set cpu_bound
+    to run in a process pool, in which case function and arguments must be picklable.
+    A timeout stops waiting for the result but cannot interrupt the callable, it keeps
+    running in its pool worker until it returns
+    """
+
+    function: Callable[..., Any]
+    args: Sequence[Any] = ()
+    kwargs: Dict[str, Any] = field(default_factory=dict)
+    cpu_bound: bool = False
+    timeout: Optional[float] = None
+
+
+TaskLike = Union[Awaitable[Any], Task, Callable[[], Any]]
+
+
+class TaskRunner(object):
+    """Run coroutines, blocking and CPU bound callables with a concurrency limit
+
+    Results are returned in the same order the tasks were given, failed, cancelled
+    or timed out tasks return their exception instead of a value
+    """
+
+    def __init__(
+        self,
+        limit: int = DEFAULT_CONCURRENCY,
+        timeout: Optional[float] = None,
+        threads: Optional[int] = None,
+        processes: Optional[int] = None,
+    ):
+        """Create a new task runner
+
+        Args:
+            limit (int): max number of tasks running at the same time
+            timeout (Optional[float]): default per task timeout in seconds, blocking callables that time out
+                keep running in the background since threads/processes cannot be interrupted
+            threads (Optional[int]): size of the thread pool, defaults to limit
+            processes (Optional[int]): size of the process pool, defaults to the number of CPUs
+        """
+        if limit <= 0:
+            raise Exception("Concurrency limit must be greater than 0")
+        self.limit = limit
+        self.timeout = timeout
+        self._threads = threads if threads is not None else limit
+        self._processes = processes if processes is not None else os.cpu_count()
+        self._thread_pool: Optional[Executor] = None
+        self._process_pool: Optional[Executor] = None
+        self._pending: List["asyncio.Future[Any]"] = []
+
+    def _executor(self, cpu_bound: bool) -> Executor:
+        if cpu_bound:
+            if self._process_pool is None:
+                self._process_pool = ProcessPoolExecutor(max_workers=self._processes)
+            return self._process_pool
+        if self._thread_pool is None:
+            self._thread_pool = ThreadPoolExecutor(max_workers=self._threads)
+        return self._thread_pool
+
+    async def _run_task(self, semaphore: asyncio.Semaphore, task: TaskLike) -> Any:
+        try:
+            async with semaphore:
+                timeout = self.timeout
+                awaitable: Awaitable[Any]
+                loop = asyncio.get_event_loop()
+                if isinstance(task, Task):
+                    timeout = task.timeout if task.timeout is not None else timeout
+                    function = functools.partial(task.function, *task.args, **task.kwargs)
+                    awaitable = loop.run_in_executor(self._executor(task.cpu_bound), function)
+                elif callable(task):
+                    awaitable = loop.run_in_executor(self._executor(False), task)
+                else:
+                    awaitable = task
+                return await asyncio.wait_for(awaitable, timeout)
+        except asyncio.CancelledError:
+            # Avoid "never awaited" warnings from coroutines cancelled before they start
+            if asyncio.iscoroutine(task):
+                task.close()
+            raise
+
+    async def run(self, *tasks: TaskLike) -> List[Any]:
+        """Execute the tasks honoring the concurrency limit
+
+        Args:
+            tasks: coroutines/awaitables, Task objects or argument-less callables
+
+        Returns:
+            List with the result or the raised exception of each task in the given order
+        """
+        semaphore = asyncio.Semaphore(self.limit)
+        self._pending = [asyncio.ensure_future(self._run_task(semaphore, task)) for task in tasks]
+        try:
+            return await asyncio.gather(*self._pending, return_exceptions=True)
+        finally:
+            self._pending = []
+
+    def cancel(self) -> int:
+        """Cancel all tasks that have not finished yet
+
+        Blocking callables already running in a pool cannot be interrupted, their results are discarded
+
+        Returns:
+            Number of cancelled tasks
+        """
+        cancelled = 0
+        for task in self._pending:
+            if not task.done() and task.cancel():
+                cancelled += 1
+        _log.debug(f"Cancelled {cancelled} tasks")
+        return cancelled
+
+    def close(self, wait: bool = True):
+        """Shutdown the thread and process pools
+
+        Args:
+            wait (bool): wait for running callables to finish
+        """
+        for pool in (self._thread_pool, self._process_pool):
+            if pool is not None:
+                pool.shutdown(wait=wait)
+        self._thread_pool = None
+        self._process_pool = None
+
+    async def __aenter__(self) -> "TaskRunner":
+        return self
+
+    async def __aexit__(self, *args: Any):
+        self.cancel()
+        # NOTE: waiting here would block the event loop until timed out callables return
+        self.close(wait=False)
+
 
+@dataclass
+class Stage(object):
+    """Step of a Pipeline, function receives one item and returns the item for the next stage
 
-async def run_sequence(*functions: Awaitable[Any]) -> None:
+    Returning None drops the item, coroutine functions are awaited directly while blocking
+    functions run in a thread pool or in a process pool if they are cpu_bound
+    """
+
+    name: str
+    function: Callable[[Any], Any]
+    workers: int = 1
+    maxsize: int = 0
+    cpu_bound: bool = False
+    processed: int = field(init=False, default=0)
+    errors: int = field(init=False, default=0)
+
+
+class Pipeline(object):
+    """Streaming pipeline of stages connected by bounded queues
+
+    Every stage runs its own workers concurrently with the other stages, producers are
+    throttled once the queue of the next stage is full so memory stays constant regardless
+    of the number of items. Items may leave a stage with more than one worker out of order
+    """
+
+    def __init__(self, maxsize: int = 128, threads: Optional[int] = None, processes: Optional[int] = None):
+        """Create an empty pipeline
+
+        Args:
+            maxsize (int): default size of the queue feeding each stage
+            threads (Optional[int]): thread pool size, defaults to the total number of workers
+            processes (Optional[int]): process pool size, defaults to the number of CPUs
+        """
+        self.maxsize = maxsize
+        self.stages: List[Stage] = []
+        self._threads = threads
+        self._processes = processes
+
+    def add_stage(
+        self,
+        name: str,
+        function: Callable[[Any], Any],
+        workers: int = 1,
+        maxsize: Optional[int] = None,
+        cpu_bound: bool = False,
+    ) -> "Pipeline":
+        """Append a new stage at the end of the pipeline
+
+        Args:
+            name (str): stage name used in logs and stats
+            function (Callable[[Any], Any]): coroutine or blocking function applied to each item
+            workers (int): number of items processed concurrently by this stage
+            maxsize (Optional[int]): size of the queue feeding this stage, defaults to the pipeline maxsize
+            cpu_bound (bool): run a blocking function in the process pool
+
+        Returns:
+            The pipeline itself to allow chaining
+        """
+        if workers <= 0:
+            raise Exception("Stage workers must be greater than 0")
+        self.stages.append(
+            Stage(
+                name=name,
+                function=function,
+                workers=workers,
+                maxsize=self.maxsize if maxsize is None else maxsize,
+                cpu_bound=cpu_bound,
+            )
+        )
+        return self
+
+    async def _feed(self, source: Union[Iterable[Any], AsyncIterable[Any]], queue: asyncio.Queue, stops: int):
+        error: Optional[Exception] = None
+        try:
+            if isinstance(source, AsyncIterable):
+                async for item in source:
+                    await queue.put(item)
+            else:
+                # NOTE: sources like directory walks block, pull them from a thread
+                loop = asyncio.get_event_loop()
+                iterator = iter(source)
+                while True:
+                    item = await loop.run_in_executor(None, next, iterator, _STOP)
+                    if item is _STOP:
+                        break
+                    await queue.put(item)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            error = e
+        # Stop the workers even if the source failed, stream() re-raises the error once they are done
+        for _ in range(stops):
+            await queue.put(_STOP)
+        if error is not None:
+            raise error
+
+    async def _work(self, stage: Stage, runner: TaskRunner, inbox: asyncio.Queue, outbox: asyncio.Queue):
+        loop = asyncio.get_event_loop()
+        while True:
+            item = await inbox.get()
+            if item is _STOP:
+                return
+            try:
+                if asyncio.iscoroutinefunction(stage.function):
+                    result = await stage.function(item)
+                else:
+                    executor = runner._executor(stage.cpu_bound)
+                    result = await loop.run_in_executor(executor, stage.function, item)
+            except Exception as e:
+                stage.errors += 1
+                _log.error(f"Stage {stage.name} failed processing {item}: {e}")
+                continue
+            stage.processed += 1
+            if result is not None:
+                await outbox.put(result)
+
+    async def _run_stage(
+        self, stage: Stage, runner: TaskRunner, inbox: asyncio.Queue, outbox: asyncio.Queue, stops: int
+    ):
+        await asyncio.gather(*[self._work(stage, runner, inbox, outbox) for _ in range(stage.workers)])
+        for _ in range(stops):
+            await outbox.put(_STOP)
+
+    async def stream(self, source: Union[Iterable[Any], AsyncIterable[Any]]) -> AsyncIterator[Any]:
+        """Push the source items through all stages
+
+        Args:
+            source: iterable or async iterable producing the items of the first stage
+
+        Yields:
+            Items returned by the last stage
+        """
+        if not self.stages:
+            raise Exception("Cannot run a pipeline without stages")
+
+        for stage in self.stages:
+            stage.processed = stage.errors = 0
+
+        queues: List["asyncio.Queue[Any]"] = [asyncio.Queue(maxsize=stage.maxsize) for stage in self.stages]
+        queues.append(asyncio.Queue(maxsize=self.maxsize))
+        threads = self._threads or sum(s.workers for s in self.stages if not s.cpu_bound) or 1
+        runner = TaskRunner(limit=threads, threads=threads, processes=self._processes)
+
+        tasks = [asyncio.ensure_future(self._feed(source, queues[0], self.stages[0].workers))]
+        for i, stage in enumerate(self.stages):
+            stops = self.stages[i + 1].workers if i + 1 < len(self.stages) else 1
+            tasks.append(asyncio.ensure_future(self._run_stage(stage, runner, queues[i], queues[i + 1], stops)))
+
+        try:
+            while True:
+                item = await queues[-1].get()
+                if item is _STOP:
+                    break
+                yield item
+            # Surface errors raised by the source
+            await tasks[0]
+            await asyncio.gather(*tasks[1:])
+        finally:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            runner.close(wait=False)
+            for stage in self.stages:
+                _log.debug(f"Stage {stage.name}: {stage.processed} processed, {stage.errors} errors")
+
+    async def run(self, source: Union[Iterable[Any], AsyncIterable[Any]]) -> Dict[str, int]:
+        """Run the pipeline discarding the output of the last stage
+
+        Args:
+            source: iterable or async iterable producing the items of the first stage
+
+        Returns:
+            Dict with the number of items processed by each stage
+        """
+        async for _ in self.stream(source):
+            pass
+        return {stage.name: stage.processed for stage in self.stages}
+
+
+async def run_sequence(*functions: Awaitable[Any]) -> List[Any]:
+    results = []
     for function in functions:
-        await function
+        results.append(await function)
+    return results
+
+
+async def run_parallel(*functions: TaskLike, limit: int = DEFAULT_CONCURRENCY) -> List[Any]:
+    """Run awaitables concurrently and collect their results
+
+    Args:
+        functions: coroutines/awaitables, Task objects or argument-less callables
+        limit (int): max number of concurrent tasks, bounds the open sockets/fds of remote checks
 
+    Returns:
+        List with the results in the given order, the first raised exception is propagated
+    """
+    async with TaskRunner(limit=limit) as runner:
+        results = await runner.run(*functions)
 
-async def run_parallel(*functions: Awaitable[Any]) -> None:
-    await asyncio.gather(*functions)
+    for result in results:
+        if isinstance(result, BaseException):
+            raise result
+    return results
 
 
 if __name__ == "__main__":
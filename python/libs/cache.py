@@ -0,0 +1,252 @@
+#!/usr/bin/env python3
+
+# import argparse
+import logging
+import os
+
+# import subprocess
+# import sys
+# import re
+# import shutil
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+
+from typing import Dict
+from typing import Iterable
+from typing import Optional
+from typing import List
+from typing import Sequence
+from typing import Tuple
+
+# from typing import Any
+# from typing import Union
+# from typing import cast
+
+from .constants import CACHE_DIR
+from .logger import get_logger
+
+_log: logging.Logger
+# _SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+# _SCRIPTNAME = os.path.basename(__file__)
+# _log_file: Optional[str] = os.path.splitext(_SCRIPTNAME)[0] + ".log"
+# _verbose = False
+# _is_windows = os.name == 'nt'
+# _home = os.environ['USERPROFILE' if _is_windows else 'HOME']
+
+DEFAULT_CACHE_SIZE = 64 * 1024 * 1024
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS results (
+    key TEXT PRIMARY KEY,
+    rc INTEGER NOT NULL,
+    stdout TEXT NOT NULL,
+    stderr TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    created REAL NOT NULL,
+    used REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS results_used ON results (used);
+"""
+
+# path -> (size, mtime_ns, sha256), avoids re-hashing unchanged inputs within the same run
+_fingerprints: Dict[str, Tuple[int, int, str]] = {}
+
+_default_cache: Optional["JobCache"] = None
+_default_lock = threading.Lock()
+
+
+def fingerprint(filename: str) -> str:
+    """Content hash of a local file
+
+    Args:
+        filename (str): path of the file to hash
+
+    Returns:
+        sha256 hex digest of the content or an empty string if the file cannot be read
+    """
+    try:
+        stat = os.stat(filename)
+    except OSError:
+        return ""
+
+    path = os.path.abspath(filename)
+    known = _fingerprints.get(path)
+    if known is None or known[:2] != (stat.st_size, stat.st_mtime_ns):
+        digest = hashlib.sha256()
+        with open(filename, "rb") as data:
+            for chunk in iter(lambda: data.read(1024 * 1024), b""):
+                digest.update(chunk)
+        known = (stat.st_size, stat.st_mtime_ns, digest.hexdigest())
+        _fingerprints[path] = known
+    return known[2]
+
+
+def forget(filenames: Iterable[str]):
+    """Drop the memoized hashes of the given files
+
+    The size and mtime check misses changes that keep both, e.g. rewrites within the mtime granularity.
+    Feed it the paths reported by files.watch to re-hash exactly the files that changed
+
+    Args:
+        filenames (Iterable[str]): paths of the changed files, deleted directories drop every file under them
+    """
+    for filename in filenames:
+        path = os.path.abspath(filename)
+        if _fingerprints.pop(path, None) is None:
+            prefix = path + os.sep
+            for known in [known for known in _fingerprints if known.startswith(prefix)]:
+                del _fingerprints[known]
+
+
+class JobCache(object):
+    """On-disk LRU cache of Job results
+
+    Entries are evicted by least recent use once the stored output exceeds max_size bytes
+    """
+
+    def __init__(self, path: Optional[str] = None, max_size: int = DEFAULT_CACHE_SIZE, ttl: Optional[float] = None):
+        """Open or create a results cache
+
+        Args:
+            path (Optional[str]): sqlite database file, defaults to jobs.sqlite in the user cache dir
+            max_size (int): max size in bytes of the cached output
+            ttl (Optional[float]): seconds before an entry expires, entries never expire by default
+        """
+        self.path = path if path is not None else os.path.join(CACHE_DIR, "jobs.sqlite")
+        self.max_size = max_size
+        self.ttl = ttl
+        self._lock = threading.Lock()
+
+        if self.path != ":memory:":
+            os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        self._db = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.executescript(_SCHEMA)
+
+    @staticmethod
+    def key(
+        cmd: Sequence[str],
+        cwd: Optional[str] = None,
+        remote_host: Optional[str] = None,
+        env: Sequence[str] = (),
+        inputs: Sequence[str] = (),
+    ) -> str:
+        """Build the cache key of a cmd execution
+
+        Args:
+            cmd (Sequence[str]): command with its arguments
+            cwd (Optional[str]): path where the cmd is execute, local cmds default to CWD
+            remote_host (Optional[str]): host where the cmd is execute
+            env (Sequence[str]): environment variables that change the cmd output
+            inputs (Sequence[str]): local files read by the cmd, their content is part of the key
+
+        Returns:
+            hex digest identifying the execution
+        """
+        data = {
+            "cmd": list(cmd),
+            "cwd": os.path.abspath(cwd or os.getcwd()) if remote_host is None else cwd,
+            "host": remote_host,
+            "env": {var: os.environ.get(var) for var in sorted(env)},
+            "inputs": {filename: fingerprint(filename) for filename in sorted(inputs)},
+        }
+        return hashlib.sha256(json.dumps(data, sort_keys=True).encode()).hexdigest()
+
+    def get(self, key: str) -> Optional[Tuple[int, List[str], List[str]]]:
+        """Look up a cached result
+
+        Args:
+            key (str): key of the execution
+
+        Returns:
+            Tuple with rc, stdout and stderr or None if the key is not cached
+        """
+        now = time.time()
+        with self._lock:
+            row = self._db.execute("SELECT rc, stdout, stderr, created FROM results WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                return None
+            if self.ttl is not None and now - row[3] > self.ttl:
+                self._db.execute("DELETE FROM results WHERE key = ?", (key,))
+                return None
+            self._db.execute("UPDATE results SET used = ? WHERE key = ?", (now, key))
+        return row[0], json.loads(row[1]), json.loads(row[2])
+
+    def put(self, key: str, rc: int, stdout: List[str], stderr: List[str]):
+        """Store a result evicting the least recently used entries if the cache is full
+
+        Args:
+            key (str): key of the execution
+            rc (int): return code of the cmd
+            stdout (List[str]): output lines of the cmd
+            stderr (List[str]): error lines of the cmd
+        """
+        out = json.dumps(stdout)
+        err = json.dumps(stderr)
+        size = len(out) + len(err)
+        if size > self.max_size:
+            _log.debug(f"Not caching {size}B result, bigger than the cache")
+            return
+
+        now = time.time()
+        with self._lock:
+            self._db.execute(
+                "INSERT OR REPLACE INTO results VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (key, rc, out, err, size, now, now),
+            )
+            self._evict()
+
+    def _evict(self):
+        total = self._db.execute("SELECT COALESCE(SUM(size), 0) FROM results").fetchone()[0]
+        if total <= self.max_size:
+            return
+        evicted = 0
+        for key, size in self._db.execute("SELECT key, size FROM results ORDER BY used").fetchall():
+            if total <= self.max_size:
+                break
+            self._db.execute("DELETE FROM results WHERE key = ?", (key,))
+            total -= size
+            evicted += 1
+        _log.debug(f"Evicted {evicted} cached results")
+
+    def clear(self):
+        """Remove all cached results"""
+        with self._lock:
+            self._db.execute("DELETE FROM results")
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+
+def get_job_cache() -> JobCache:
+    """Get the default results cache, creating it on first use
+
+    Returns:
+        JobCache shared by all cacheable jobs
+    """
+    global _default_cache
+    with _default_lock:
+        if _default_cache is None:
+            _default_cache = JobCache()
+        return _default_cache
+
+
+def set_job_cache(cache: Optional[JobCache]):
+    """Replace the default results cache
+
+    Args:
+        cache (Optional[JobCache]): new cache, None to create the default one on next use
+    """
+    global _default_cache
+    with _default_lock:
+        _default_cache = cache
+
+
+if __name__ == "__main__":
+    raise Exception("This library should not be run as a standalone script")
+else:
+    _log = get_logger("Main")
@@ -0,0 +1,193 @@
+#!/usr/bin/env python3
+
+# import argparse
+import logging
+import os
+
+# import subprocess
+# import sys
+# import re
+import shutil
+import json
+import threading
+import time
+
+from typing import Dict
+from typing import Optional
+from typing import List
+from typing import Sequence
+
+# from typing import Any
+# from typing import Union
+# from typing import cast
+
+from dataclasses import dataclass, field, asdict
+
+from .constants import CACHE_DIR
+from .logger import get_logger
+
+_log: logging.Logger
+# _SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+# _SCRIPTNAME = os.path.basename(__file__)
+# _log_file: Optional[str] = os.path.splitext(_SCRIPTNAME)[0] + ".log"
+# _verbose = False
+# _is_windows = os.name == 'nt'
+# _home = os.environ['USERPROFILE' if _is_windows else 'HOME']
+
+# Tools probed in remote hosts to pick transfer and extract strategies
+PROBED_TOOLS = ("rsync", "scp", "zstd", "pigz", "gzip", "xz", "tar", "unzip", "python3")
+DEFAULT_TTL = 24 * 60 * 60
+
+_which_cache: Dict[str, str] = {}
+_which_path: Optional[str] = None
+
+_hosts: Dict[str, "HostCapabilities"] = {}
+_hosts_lock = threading.Lock()
+
+
+@dataclass
+class HostCapabilities(object):
+    """Tools, OS and architecture available in a remote host"""
+
+    host: str
+    os: str = ""
+    arch: str = ""
+    tools: List[str] = field(default_factory=list)
+    probed: float = 0.0
+
+    def has(self, tool: str) -> bool:
+        return tool in self.tools
+
+
+def which(cmd: str) -> Optional[str]:
+    """Cached shutil.which, the cache is dropped whenever PATH changes
+
+    Only the found executables are cached, a tool installed while running is picked up by the next call
+
+    Args:
+        cmd (str): command to look up
+
+    Returns:
+        Full path of the executable or None if it is not in the PATH
+    """
+    global _which_path
+    path = os.environ.get("PATH")
+    if path != _which_path:
+        _which_cache.clear()
+        _which_path = path
+    if cmd in _which_cache:
+        return _which_cache[cmd]
+    found = shutil.which(cmd)
+    if found is not None:
+        _which_cache[cmd] = found
+    return found
+
+
+def _hosts_file() -> str:
+    return os.path.join(CACHE_DIR, "hosts.json")
+
+
+def _load_hosts() -> Dict[str, HostCapabilities]:
+    try:
+        with open(_hosts_file()) as data:
+            return {host: HostCapabilities(**caps) for host, caps in json.load(data).items()}
+    except (OSError, ValueError, TypeError):
+        return {}
+
+
+def _save_hosts(hosts: Dict[str, HostCapabilities]):
+    filename = _hosts_file()
+    try:
+        os.makedirs(os.path.dirname(filename), exist_ok=True)
+        tmp = f"{filename}.{os.getpid()}"
+        with open(tmp, "w") as data:
+            json.dump({host: asdict(caps) for host, caps in hosts.items()}, data, indent=2)
+        os.replace(tmp, filename)
+    except OSError as e:
+        _log.debug(f"Failed to persist host capabilities: {e}")
+
+
+def _probe_cmd(tools: Sequence[str]) -> List[str]:
+    checks = " ".join(tools)
+    return [
+        "uname -s ; uname -m ;",
+        f"for t in {checks} ; do command -v $t >/dev/null 2>&1 && echo tool:$t ; done",
+    ]
+
+
+def _parse_probe(host: str, lines: List[str]) -> HostCapabilities:
+    # NOTE: ssh -t output uses \r\n line endings which leave empty entries behind
+    lines = [line.strip() for line in lines if line.strip()]
+    caps = HostCapabilities(host=host, probed=time.time())
+    if len(lines) >= 2:
+        caps.os, caps.arch = lines[0], lines[1]
+    caps.tools = [line[5:] for line in lines[2:] if line.startswith("tool:")]
+    return caps
+
+
+def probe_host(host: str, ttl: float = DEFAULT_TTL, refresh: bool = False) -> HostCapabilities:
+    """Get the capabilities of a remote host probing it only if the cached entry expired
+
+    All checks run in a single ssh round trip, results are persisted in the user cache dir
+    so later runs can reuse them
+
+    Args:
+        host (str): name/address of the remote host
+        ttl (float): seconds before a cached probe is considered stale
+        refresh (bool): ignore cached results and probe the host again
+
+    Returns:
+        HostCapabilities of the host, empty if the probe failed
+    """
+    # NOTE: shell depends on this module to look up executables
+    from .shell import Job
+
+    now = time.time()
+    with _hosts_lock:
+        if not _hosts:
+            _hosts.update(_load_hosts())
+        caps = _hosts.get(host)
+        if caps is not None and not refresh and now - caps.probed < ttl:
+            return caps
+
+    probe = Job(_probe_cmd(PROBED_TOOLS))
+    probe.execute(remote_host=host, timeout=30.0)
+    if probe.rc != 0:
+        _log.warning(f"Failed to probe {host} capabilities")
+        return HostCapabilities(host=host)
+
+    caps = _parse_probe(host, probe.stdout)
+    _log.debug(f"Host {host}: {caps.os} {caps.arch}, tools: {', '.join(caps.tools)}")
+    with _hosts_lock:
+        # Merge with entries written by other processes since we loaded the file
+        hosts = _load_hosts()
+        hosts.update(_hosts)
+        hosts[host] = caps
+        _hosts.clear()
+        _hosts.update(hosts)
+        _save_hosts(hosts)
+    return caps
+
+
+def preferred_tool(host: str, candidates: Sequence[str], ttl: float = DEFAULT_TTL) -> Optional[str]:
+    """Pick the first tool available both locally and in the remote host
+
+    Args:
+        host (str): name/address of the remote host
+        candidates (Sequence[str]): tools ordered by preference, ex. ("rsync", "scp")
+        ttl (float): seconds before a cached probe is considered stale
+
+    Returns:
+        Name of the chosen tool or None if none of them is available in both ends
+    """
+    caps = probe_host(host, ttl)
+    for tool in candidates:
+        if which(tool) is not None and caps.has(tool):
+            return tool
+    return None
+
+
+if __name__ == "__main__":
+    raise Exception("This library should not be run as a standalone script")
+else:
+    _log = get_logger("Main")
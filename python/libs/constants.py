@@ -1,9 +1,18 @@
 #!/usr/bin/env python3
 
+import os
+
 AUTHOR = "Mike"
 MAIL = "mike325@users.noreply.github.com"
 VERSION = "0.1.0"
 
+CACHE_DIR = os.path.join(os.environ.get("XDG_CACHE_HOME", os.path.join(os.path.expanduser("~"), ".cache")), "cli")
+DAEMON_SOCKET = os.environ.get("CLI_DAEMON_SOCKET", os.path.join(CACHE_DIR, "daemon.sock"))
+# Set to 1 to launch local jobs through the spawn server, see libs.spawn
+SPAWN_SERVER_ENV = "CLI_SPAWN_SERVER"
+# Seconds between stack samples inside Job.execute, sampling is disabled when unset, see libs.profiling
+SAMPLE_ENV = "CLI_SAMPLE_INTERVAL"
+
 HEADER = """
                     -`
     ...            .o+`
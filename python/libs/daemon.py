@@ -0,0 +1,295 @@
+#!/usr/bin/env python3
+
+# import argparse
+import logging
+import os
+
+# import subprocess
+import sys
+
+# import re
+# import shutil
+import json
+import signal
+import socket
+import socketserver
+import threading
+
+from contextlib import redirect_stderr
+from contextlib import redirect_stdout
+
+from typing import Dict
+from typing import List
+from typing import Callable
+from typing import Any
+from typing import TextIO
+from typing import Optional
+from typing import Tuple
+
+# from typing import Union
+from typing import cast
+
+from .constants import DAEMON_SOCKET
+from .logger import get_logger
+
+_log: logging.Logger
+# _SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+# _SCRIPTNAME = os.path.basename(__file__)
+# _log_file: Optional[str] = os.path.splitext(_SCRIPTNAME)[0] + ".log"
+# _verbose = False
+# _is_windows = os.name == 'nt'
+# _home = os.environ['USERPROFILE' if _is_windows else 'HOME']
+
+SOCKET_PATH = DAEMON_SOCKET
+
+Handler = Callable[[List[str], TextIO], int]
+
+
+def _send(sock: socket.socket, message: Any):
+    """Write a single JSON line message to the socket"""
+    sock.sendall(json.dumps(message).encode("utf-8") + b"\n")
+
+
+class _StreamWriter(object):
+    """File like object that forwards everything written to it to the client as "out" messages
+
+    The client may go away mid request (ctrl-c), after the first failed send the output is dropped so the
+    request can finish and the daemon keeps serving
+    """
+
+    def __init__(self, sock: socket.socket):
+        self.sock = sock
+        self.closed = False
+
+    def write(self, text: str) -> int:
+        if text and not self.closed:
+            try:
+                _send(self.sock, {"out": text})
+            except OSError:
+                self.closed = True
+        return len(text)
+
+    def flush(self):
+        pass
+
+    def isatty(self) -> bool:
+        return False
+
+
+class DaemonBusy(OSError):
+    """The daemon is serving another request, the client should run the command itself"""
+
+
+class DaemonDisconnected(Exception):
+    """The connection was lost after the request was sent
+
+    The daemon may have already run part of the request, so the client must not run it again
+    """
+
+
+class _Server(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+    handler: Handler
+    stopping: bool = False
+    # Held while a request runs, see _RequestHandler
+    busy: threading.Lock
+
+
+def _set_environ(env: Dict[str, str]):
+    os.environ.clear()
+    os.environ.update(env)
+
+
+class _RequestHandler(socketserver.StreamRequestHandler):
+    """Serve a single client request in its own thread
+
+    A request changes the cwd, the environment and stdout/stderr of the whole process, so only one runs at a
+    time. Requests that arrive meanwhile are answered as busy right away instead of queueing behind a long
+    run, the client then runs the command itself. Stop requests are always served
+    """
+
+    def handle(self):
+        server = cast(_Server, self.server)
+        try:
+            request = json.loads(self.rfile.readline().decode("utf-8"))
+        except ValueError:
+            _log.error("Dropping malformed daemon request")
+            return
+
+        if request.get("stop", False):
+            _log.info("Daemon stop requested")
+            _send(self.connection, {"rc": 0})
+            server.stopping = True
+            return
+
+        if not server.busy.acquire(blocking=False):
+            _log.debug("Daemon busy, the client runs the request itself")
+            _send(self.connection, {"busy": True})
+            return
+        try:
+            rc, stream = self._run(server, request)
+        finally:
+            server.busy.release()
+
+        if not stream.closed:
+            try:
+                _send(self.connection, {"rc": rc})
+            except OSError:
+                pass
+
+    def _run(self, server: _Server, request: Dict[str, Any]) -> Tuple[int, _StreamWriter]:
+        argv = [str(arg) for arg in request.get("argv", [])]
+        env = request.get("env")
+        cwd = os.getcwd()
+        environ = dict(os.environ)
+        stream = _StreamWriter(self.connection)
+        _log.debug(f"Serving request: {argv}")
+        rc = 1
+        try:
+            os.chdir(request.get("cwd", cwd))
+            if env is not None:
+                _set_environ(env)
+            with redirect_stdout(cast(TextIO, stream)), redirect_stderr(cast(TextIO, stream)):
+                rc = server.handler(argv, cast(TextIO, stream))
+        except SystemExit as e:
+            # argparse errors and --help end with a SystemExit, they must not kill the daemon
+            rc = e.code if isinstance(e.code, int) else 1
+        except Exception as e:
+            _log.exception(f"Request failed with {e.__class__.__name__} exception")
+        finally:
+            os.chdir(cwd)
+            if env is not None:
+                _set_environ(environ)
+        return rc, stream
+
+
+def _running(path: str) -> bool:
+    """Check if there is a daemon already listening in the given socket"""
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.connect(path)
+        return True
+    except OSError:
+        return False
+    finally:
+        sock.close()
+
+
+def serve(handler: Handler, path: str = SOCKET_PATH) -> int:
+    """Keep the process resident serving requests in a UNIX socket
+
+    Everything the process warmed up (loggers, caches, ssh master connections, pools) is kept between
+    requests. The socket is only accessible to the current user since requests run arbitrary commands
+
+    Args:
+        handler: function that runs the request, receives the argv and the stream forwarded to the client
+                 and returns the exit code
+        path: UNIX socket path
+
+    Returns:
+        exit code, 0 in success any other integer in failure
+    """
+    if os.path.exists(path):
+        if _running(path):
+            raise Exception(f"There is already a daemon listening in {path}")
+        os.unlink(path)
+
+    socket_dir = os.path.dirname(os.path.abspath(path))
+    os.makedirs(socket_dir, mode=0o700, exist_ok=True)
+
+    old_umask = os.umask(0o077)
+    try:
+        server = _Server(path, _RequestHandler)
+    finally:
+        os.umask(old_umask)
+    server.handler = handler
+    server.busy = threading.Lock()
+    # Wake up periodically so a SIGTERM can stop the loop between requests
+    server.timeout = 0.5
+
+    def _stop(signum, frame):
+        server.stopping = True
+
+    signal.signal(signal.SIGTERM, _stop)
+
+    _log.info(f"Daemon listening in {path}")
+    try:
+        while not server.stopping:
+            server.handle_request()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        # Let the request in flight finish, it may be in the middle of changing files
+        with server.busy:
+            server.server_close()
+        if os.path.exists(path):
+            os.unlink(path)
+        _log.info("Daemon stopped")
+    return 0
+
+
+def _exchange(message: Any, path: str, output: TextIO) -> int:
+    """Send a message to the daemon and stream the output back until the exit code arrives
+
+    Only a failed connection or a busy daemon raise OSError, once the message is sent any failure, including
+    a closed output stream, raises DaemonDisconnected
+    """
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.connect(path)
+        try:
+            _send(sock, message)
+            for line in sock.makefile("rb"):
+                response = json.loads(line.decode("utf-8"))
+                if "out" in response:
+                    output.write(response["out"])
+                    output.flush()
+                elif "rc" in response:
+                    return int(response["rc"])
+                elif response.get("busy", False):
+                    raise DaemonBusy("Daemon is busy serving another request")
+        except DaemonBusy:
+            raise
+        except (OSError, ValueError) as e:
+            raise DaemonDisconnected(f"Lost the daemon connection: {e}") from e
+    finally:
+        sock.close()
+    raise DaemonDisconnected("Daemon closed the connection without an exit code")
+
+
+def request(argv: List[str], path: str = SOCKET_PATH, output: Optional[TextIO] = None) -> int:
+    """Forward a command line to a running daemon and stream its output back
+
+    The request runs with the cwd and the environment of the caller. Raises OSError if there is no daemon
+    listening, DaemonBusy if it is serving another request and DaemonDisconnected if the connection is lost
+    after the request was sent
+
+    Args:
+        argv: command line arguments, without the program name
+        path: UNIX socket path
+        output: stream to write the forwarded output, defaults to stdout
+
+    Returns:
+        exit code of the request
+    """
+    return _exchange(
+        {"argv": argv, "cwd": os.getcwd(), "env": dict(os.environ)}, path, output if output is not None else sys.stdout
+    )
+
+
+def stop(path: str = SOCKET_PATH) -> int:
+    """Ask a running daemon to stop
+
+    Args:
+        path: UNIX socket path
+
+    Returns:
+        exit code, 0 in success any other integer in failure
+    """
+    return _exchange({"stop": True}, path, sys.stdout)
+
+
+if __name__ == "__main__":
+    raise Exception("This library should not be run as a standalone script")
+else:
+    _log = get_logger("Main")
@@ -5,27 +5,45 @@ import logging
 import os
 
 # import subprocess
-# import sys
+import sys
 import re
 import shutil
+import fnmatch
+import shlex
+import select
+import struct
+import time
 
-# from typing import Dict
+from typing import Dict
 from typing import Optional
 from typing import List
+from typing import Iterator
+from typing import Sequence
+from typing import Tuple
+from typing import TYPE_CHECKING
 
-# from typing import Sequence
 # from typing import TextIO
 # from typing import Any
-# from typing import Union
-# from typing import cast
+from typing import Union
+from typing import Pattern
+from typing import Match
+
+from typing import cast
+
 # from dataclasses import dataclass, field
 
+from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import FIRST_COMPLETED
+from concurrent.futures import wait
+
 from pathlib import Path
-from zipfile import ZipFile
-from glob import glob
 
 from .logger import get_logger
-from .shell import Job
+from .lists import clear_list
+from .policy import RetryPolicy
+
+if TYPE_CHECKING:
+    import threading
 
 _log: logging.Logger
 # _SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
@@ -35,8 +53,45 @@ _log: logging.Logger
 # _is_windows = os.name == 'nt'
 # _home = os.environ['USERPROFILE' if _is_windows else 'HOME']
 
+# Read-only checks are safe to retry after a deadline and to hedge against slow connections
+READ_POLICY = RetryPolicy(attempts=3, timeout=30.0, hedge=True)
+# Changes are only retried if ssh fails to connect, transfers can take arbitrarily long
+WRITE_POLICY = RetryPolicy(attempts=3, timeout=None)
+
 _remote_regex = re.compile(r"^((([a-zA-Z]\w*)@)?([1-9]\d{0,2}\.\d{1,3}\.\d{1,3}\.\d{1,3}|[a-zA-Z]\w*(\.\w+)*)):(.+)")
 
+# Kinds of change reported by watch
+CREATED = "created"
+MODIFIED = "modified"
+DELETED = "deleted"
+
+# inotify(7) flags
+_IN_MODIFY = 0x00000002
+_IN_ATTRIB = 0x00000004
+_IN_CLOSE_WRITE = 0x00000008
+_IN_MOVED_FROM = 0x00000040
+_IN_MOVED_TO = 0x00000080
+_IN_CREATE = 0x00000100
+_IN_DELETE = 0x00000200
+_IN_Q_OVERFLOW = 0x00004000
+_IN_IGNORED = 0x00008000
+_IN_ONLYDIR = 0x01000000
+_IN_DONT_FOLLOW = 0x02000000
+_IN_EXCL_UNLINK = 0x04000000
+_IN_ISDIR = 0x40000000
+_IN_CHANGES = _IN_MODIFY | _IN_ATTRIB | _IN_CLOSE_WRITE | _IN_MOVED_FROM | _IN_MOVED_TO | _IN_CREATE | _IN_DELETE
+_IN_MASK = _IN_CHANGES | _IN_ONLYDIR | _IN_DONT_FOLLOW | _IN_EXCL_UNLINK
+# struct inotify_event header: wd, mask, cookie, len, followed by the NUL padded name
+_IN_EVENT = struct.Struct("iIII")
+
+# Seconds between checks of the stop event while the tree is idle
+_WATCH_TICK = 0.5
+
+# Files scanned by each search task, amortizes the cost of sending the work to the worker processes
+_SEARCH_CHUNK = 64
+# Files with a NUL byte in this prefix are considered binary and not searched, same heuristic as grep
+_BINARY_PROBE = 8192
+
 
 def executable(cmd: str) -> bool:
     """checks if a cmd is in the PATH and is executable
@@ -47,7 +102,10 @@ def executable(cmd: str) -> bool:
     Returns:
         True if cmd is an executable in the PATH False otherwise
     """
-    return shutil.which(cmd) is not None
+    # NOTE: capabilities loads json and dataclasses, it is only needed by the remote paths
+    from .capabilities import which
+
+    return which(cmd) is not None
 
 
 def isfile(filename: str, remote_host: Optional[str] = None) -> bool:
@@ -72,8 +130,7 @@ def isfile(filename: str, remote_host: Optional[str] = None) -> bool:
         remote_host = remote_match.group(1)
         filename = remote_match.group(6)
 
-    remote_check = Job(["test", "-f", filename])
-    remote_check.execute(remote_host=remote_host)
+    remote_check = READ_POLICY.execute(["test", "-f", filename], remote_host=remote_host, idempotent=True)
     return remote_check.rc == 0
 
 
@@ -98,8 +155,7 @@ def isdir(dirname: str, remote_host: Optional[str] = None) -> bool:
         remote_host = remote_match.group(1)
         dirname = remote_match.group(6)
 
-    remote_check = Job(["test", "-d", dirname])
-    remote_check.execute(remote_host=remote_host)
+    remote_check = READ_POLICY.execute(["test", "-d", dirname], remote_host=remote_host, idempotent=True)
     return remote_check.rc == 0
 
 
@@ -124,11 +180,33 @@ def exists(filename: str, remote_host: Optional[str] = None) -> bool:
         remote_host = remote_match.group(1)
         filename = remote_match.group(6)
 
-    remote_check = Job(["test", "-e", filename])
-    remote_check.execute(remote_host=remote_host)
+    remote_check = READ_POLICY.execute(["test", "-e", filename], remote_host=remote_host, idempotent=True)
     return remote_check.rc == 0
 
 
+def _transfer_cmd(src: str, dest: str, src_match: Optional[Match[str]], dest_match: Optional[Match[str]]) -> List[str]:
+    """Build the command that copies src to dest when at least one of them is remote
+
+    rsync is preferred when both ends have it, it only sends what changed in the files that already exist
+    in dest. scp is the fallback and the only option between two remote hosts
+    """
+    from .capabilities import preferred_tool
+
+    remote = src_match if src_match is not None else dest_match
+    if (src_match is None or dest_match is None) and remote is not None:
+        if preferred_tool(remote.group(1), ("rsync",)) is not None:
+            # NOTE: shell imports this module indirectly, load it on demand
+            from .shell import SSH_OPTIONS
+            from .shell import ssh_executable
+
+            ssh = [ssh_executable()] + SSH_OPTIONS
+            return ["rsync", "-a", "-e", " ".join(shlex.quote(arg) for arg in ssh), src, dest]
+
+    if not executable("scp"):
+        raise Exception("Missing scp, cannot move from/to remote hosts")
+    return ["scp", "-r", src, dest]
+
+
 def remove(
     src: str,
     force: bool = False,
@@ -164,8 +242,7 @@ def remove(
     src = src_match.group(6)
 
     args = "-rf" if force else "-r"
-    remote_check = Job(["rm", args, src])
-    remote_check.execute(remote_host=remote_host)
+    remote_check = WRITE_POLICY.execute(["rm", args, src], remote_host=remote_host)
     return remote_check.rc == 0
 
 
@@ -201,11 +278,7 @@ def move(
             return False
         return True
 
-    if not executable("scp"):
-        raise Exception("Missing scp, cannot move from/to remote hosts")
-
-    remote_check = Job(["scp", "-r", src, dest])
-    remote_check.execute()
+    remote_check = WRITE_POLICY.execute(_transfer_cmd(src, dest, src_match, dest_match))
     if remote_check.rc == 0:
         return remove(src)
     return False
@@ -240,11 +313,7 @@ def rename(
         src_path.rename(dest)
         return True
 
-    if not executable("scp"):
-        raise Exception("Missing scp, cannot move from/to remote hosts")
-
-    remote_check = Job(["scp", "-r", src, dest])
-    remote_check.execute()
+    remote_check = WRITE_POLICY.execute(_transfer_cmd(src, dest, src_match, dest_match))
     if remote_check.rc == 0:
         return remove(src)
     return False
@@ -286,11 +355,7 @@ def copy(
 
         return True
 
-    if not executable("scp"):
-        raise Exception("Missing scp, cannot move from/to remote hosts")
-
-    remote_check = Job(["scp", "-r", src, dest])
-    remote_check.execute()
+    remote_check = WRITE_POLICY.execute(_transfer_cmd(src, dest, src_match, dest_match))
     return remote_check.rc == 0
 
 
@@ -333,8 +398,7 @@ def mkdir(dirname: str, force: bool = False, remote_host: Optional[str] = None):
         cmd.append("-p")
     cmd.append(dirname)
 
-    remote_check = Job(cmd)
-    remote_check.execute(remote_host=remote_host)
+    remote_check = WRITE_POLICY.execute(cmd, remote_host=remote_host)
     return remote_check.rc == 0
 
 
@@ -356,8 +420,12 @@ def extract(archive: str, dest: Optional[str] = None, remote_host: Optional[str]
             return False
         dest = os.getcwd() if dest is None else dest
 
+        # NOTE: zipfile is slow to import and rarely used, load it on demand
+        from zipfile import ZipFile
+
         with ZipFile(archive) as zf:
             zf.extractall(dest)
+        return True
 
     if remote_host is not None and archive_match is not None:
         raise Exception("Cannot pass both dirname with a remote host and remote_host arg")
@@ -366,20 +434,53 @@ def extract(archive: str, dest: Optional[str] = None, remote_host: Optional[str]
         remote_host = archive_match.group(1)
         archive = archive_match.group(6)
 
-    remote_check = Job(["unzip", "-o", archive, "-d", "." if dest is None else dest])
-    remote_check.execute(remote_host=remote_host, cwd="." if dest is None else dest)
+    cmd = ["unzip", "-o", archive, "-d", "." if dest is None else dest]
+    from .capabilities import probe_host
+
+    caps = probe_host(cast(str, remote_host))
+    if caps.tools and not caps.has("unzip"):
+        if not caps.has("python3"):
+            _log.error(f"Cannot extract {archive}, {remote_host} has neither unzip nor python3")
+            return False
+        cmd = ["python3", "-m", "zipfile", "-e", archive, "." if dest is None else dest]
+    remote_check = WRITE_POLICY.execute(
+        cmd,
+        remote_host=remote_host,
+        cwd="." if dest is None else dest,
+    )
     return remote_check.rc == 0
 
 
+def _remote_list(dirname: str, glob_pattern: str, remote_host: Optional[str], kind: Optional[str] = None) -> List[str]:
+    dir_match = _remote_regex.match(dirname)
+    if remote_host is not None and dir_match is not None:
+        raise Exception("Cannot pass both dirname with a remote host and remote_host arg")
+
+    if dir_match is not None:
+        remote_host = dir_match.group(1)
+        dirname = dir_match.group(6)
+
+    cmd = ["find", dirname, "-mindepth", "1", "-maxdepth", "1", "-name", shlex.quote(glob_pattern)]
+    if kind is not None:
+        cmd += ["-type", kind]
+    remote_list = READ_POLICY.execute(cmd, remote_host=remote_host, idempotent=True)
+    if remote_list.rc != 0:
+        return []
+    # NOTE: ssh -t output uses \r\n line endings which leave empty entries behind
+    return clear_list(remote_list.stdout)
+
+
 def list_content(dirname: str, glob_pattern: str = "*", remote_host: Optional[str] = None) -> List[str]:
     dir_match = _remote_regex.match(dirname)
     if not dir_match and not remote_host:
         if not isdir(dirname):
             return []
+        from glob import glob
+
         files = glob(os.path.join(dirname, glob_pattern))
         return files
 
-    raise Exception("Not implemented")
+    return _remote_list(dirname, glob_pattern, remote_host)
 
 
 def get_files(
@@ -392,7 +493,7 @@ def get_files(
         files = list_content(dirname, glob_pattern, remote_host)
         return [i for i in files if isfile(i)]
 
-    raise Exception("Not implemented")
+    return _remote_list(dirname, glob_pattern, remote_host, "f")
 
 
 def get_dirs(dirname: str, glob_pattern: str = "*", remote_host: Optional[str] = None) -> List[str]:
@@ -401,7 +502,485 @@ def get_dirs(dirname: str, glob_pattern: str = "*", remote_host: Optional[str] =
         dirs = list_content(dirname, glob_pattern, remote_host)
         return [i for i in dirs if isdir(i)]
 
-    raise Exception("Not implemented")
+    return _remote_list(dirname, glob_pattern, remote_host, "d")
+
+
+def walk(dirname: str, glob_pattern: str = "*") -> Iterator[str]:
+    """Lazily walk a local directory tree yielding the files that match glob_pattern
+
+    Args:
+        dirname (str): root of the tree to walk
+        glob_pattern (str): pattern matched against the basename of each file
+
+    Returns:
+        Iterator with the path of each matching file, memory use does not grow with the tree size
+    """
+    pending = [dirname]
+    while pending:
+        try:
+            with os.scandir(pending.pop()) as entries:
+                for entry in entries:
+                    if entry.is_dir(follow_symlinks=False):
+                        pending.append(entry.path)
+                    elif entry.is_file() and fnmatch.fnmatch(entry.name, glob_pattern):
+                        yield entry.path
+        except OSError as e:
+            _log.debug(f"Skipping unreadable directory: {e}")
+
+
+# (path, kind, is_dir)
+_Event = Tuple[str, str, bool]
+
+
+class _Inotify(object):
+    """Recursive inotify watcher, one watch descriptor per directory"""
+
+    def __init__(self, dirname: str):
+        # NOTE: ctypes is only needed here, load it on demand
+        import ctypes
+
+        self._ctypes = ctypes
+        # NOTE: CDLL(None) resolves the symbols of the already loaded libc, find_library would fork ldconfig
+        self._libc = ctypes.CDLL(None, use_errno=True)
+        self.fd = self._libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self.fd < 0:
+            errno = ctypes.get_errno()
+            raise OSError(errno, f"inotify_init1 failed: {os.strerror(errno)}")
+        self.root = os.path.abspath(dirname)
+        self._dirs: Dict[int, str] = {}
+        try:
+            self._add_tree(self.root, None)
+        except OSError:
+            self.close()
+            raise
+
+    @property
+    def alive(self) -> bool:
+        return bool(self._dirs)
+
+    def _add_tree(self, root: str, events: Optional[List[_Event]]):
+        """Watch root and its subdirectories, the files already there are reported as created if events is given"""
+        pending = [root]
+        while pending:
+            dirname = pending.pop()
+            wd = self._libc.inotify_add_watch(self.fd, os.fsencode(dirname), _IN_MASK)
+            if wd < 0:
+                errno = self._ctypes.get_errno()
+                if errno == 28:  # ENOSPC, out of fs.inotify.max_user_watches
+                    raise OSError(errno, "Out of inotify watches, raise fs.inotify.max_user_watches")
+                _log.debug(f"Cannot watch {dirname}: {os.strerror(errno)}")
+                continue
+            self._dirs[wd] = dirname
+            try:
+                with os.scandir(dirname) as entries:
+                    for entry in entries:
+                        if entry.is_dir(follow_symlinks=False):
+                            pending.append(entry.path)
+                        elif events is not None:
+                            events.append((entry.path, CREATED, False))
+            except OSError as e:
+                _log.debug(f"Skipping unreadable directory: {e}")
+
+    def _remove_tree(self, root: str):
+        prefix = root + os.sep
+        for wd, dirname in list(self._dirs.items()):
+            if dirname == root or dirname.startswith(prefix):
+                self._libc.inotify_rm_watch(self.fd, wd)
+                del self._dirs[wd]
+
+    def read(self, timeout: float) -> List[_Event]:
+        """Wait up to timeout seconds for changes"""
+        ready, _, _ = select.select([self.fd], [], [], timeout)
+        if not ready:
+            return []
+        try:
+            data = os.read(self.fd, 64 * 1024)
+        except BlockingIOError:
+            return []
+
+        events: List[_Event] = []
+        offset = 0
+        while offset < len(data):
+            wd, mask, _, length = _IN_EVENT.unpack_from(data, offset)
+            offset += _IN_EVENT.size
+            name = data[offset : offset + length].rstrip(b"\0")
+            offset += length
+
+            if mask & _IN_Q_OVERFLOW:
+                # NOTE: events were dropped, report every file so the consumers resync the whole tree
+                _log.warning(f"inotify queue overflow, rescanning {self.root}")
+                events.extend((filename, MODIFIED, False) for filename in walk(self.root))
+                continue
+
+            dirname = self._dirs.get(wd)
+            if mask & _IN_IGNORED:
+                self._dirs.pop(wd, None)
+                continue
+            if dirname is None:
+                continue
+
+            path = os.path.join(dirname, os.fsdecode(name)) if name else dirname
+            if mask & _IN_ISDIR:
+                if mask & (_IN_CREATE | _IN_MOVED_TO):
+                    # NOTE: files may land in the new directory before its watch is added
+                    self._add_tree(path, events)
+                elif mask & (_IN_DELETE | _IN_MOVED_FROM):
+                    self._remove_tree(path)
+                    events.append((path, DELETED, True))
+            elif mask & (_IN_CREATE | _IN_MOVED_TO):
+                events.append((path, CREATED, False))
+            elif mask & (_IN_DELETE | _IN_MOVED_FROM):
+                events.append((path, DELETED, False))
+            elif mask & (_IN_MODIFY | _IN_CLOSE_WRITE | _IN_ATTRIB):
+                events.append((path, MODIFIED, False))
+        return events
+
+    def close(self):
+        if self.fd >= 0:
+            os.close(self.fd)
+            self.fd = -1
+
+
+class _Poller(object):
+    """Portable watcher, diffs the (mtime, size) of every file between scans"""
+
+    def __init__(self, dirname: str, interval: float):
+        self.root = os.path.abspath(dirname)
+        self.interval = interval
+        self.alive = True
+        self._snapshot = self._scan()
+        self._next = time.monotonic() + interval
+
+    def _scan(self) -> Dict[str, Tuple[int, int]]:
+        snapshot = {}
+        for filename in walk(self.root):
+            try:
+                stat = os.stat(filename, follow_symlinks=False)
+            except OSError:
+                continue
+            snapshot[filename] = (stat.st_mtime_ns, stat.st_size)
+        return snapshot
+
+    def read(self, timeout: float) -> List[_Event]:
+        """Wait up to timeout seconds for the next scan"""
+        delay = self._next - time.monotonic()
+        if delay > timeout:
+            time.sleep(timeout)
+            return []
+        time.sleep(max(delay, 0))
+        self._next = time.monotonic() + self.interval
+
+        snapshot = self._scan()
+        previous = self._snapshot
+        self._snapshot = snapshot
+        events: List[_Event] = [(path, DELETED, False) for path in previous.keys() - snapshot.keys()]
+        for path, stamp in snapshot.items():
+            old = previous.get(path)
+            if old is None:
+                events.append((path, CREATED, False))
+            elif old != stamp:
+                events.append((path, MODIFIED, False))
+        return events
+
+    def close(self):
+        self.alive = False
+
+
+def _coalesce(changes: Dict[str, str], path: str, kind: str):
+    previous = changes.get(path)
+    if previous == CREATED and kind == DELETED:
+        del changes[path]
+    elif previous == CREATED:
+        return
+    elif previous == DELETED and kind == CREATED:
+        changes[path] = MODIFIED
+    else:
+        changes[path] = kind
+
+
+def watch(
+    dirname: str,
+    patterns: Sequence[str] = ("*",),
+    debounce: float = 0.2,
+    interval: float = 2.0,
+    stop: Optional["threading.Event"] = None,
+    polling: bool = False,
+) -> Iterator[Dict[str, str]]:
+    """Watch a local directory tree and yield batches of the files that changed
+
+    Uses inotify on Linux and falls back to rescanning the tree every interval seconds elsewhere or when
+    inotify is unavailable. Bursts of events are debounced and coalesced per path, e.g. a file created,
+    written and deleted within the same batch is not reported at all. Deleted or moved out directories
+    are reported once as deleted regardless of the patterns, consumers must drop everything under them.
+    The changes can be fed to sync to update a copy of the tree and to cache.forget to re-hash the files
+
+    Args:
+        dirname (str): root of the tree to watch
+        patterns (Sequence[str]): patterns matched against the basename of each changed file
+        debounce (float): seconds without events before a batch is yielded
+        interval (float): seconds between scans of the polling fallback
+        stop (Optional[threading.Event]): stops the watch once set, closing the generator works too
+        polling (bool): use the polling fallback even if inotify is available
+
+    Returns:
+        Iterator of {path: created|modified|deleted} batches, the paths are absolute
+    """
+    inotify: Optional[_Inotify] = None
+    if not polling and sys.platform.startswith("linux"):
+        try:
+            inotify = _Inotify(dirname)
+        except (OSError, AttributeError) as e:
+            _log.debug(f"inotify unavailable, polling {dirname} every {interval}s: {e}")
+    watcher: Union[_Inotify, _Poller] = inotify if inotify is not None else _Poller(dirname, interval)
+
+    # NOTE: a constant stream of events must not postpone the batch forever
+    max_delay = max(1.0, debounce * 10)
+    changes: Dict[str, str] = {}
+    first = 0.0
+    try:
+        while watcher.alive and (stop is None or not stop.is_set()):
+            events = watcher.read(min(debounce, _WATCH_TICK) if changes else _WATCH_TICK)
+            for path, kind, is_dir in events:
+                name = os.path.basename(path)
+                if is_dir or any(fnmatch.fnmatch(name, pattern) for pattern in patterns):
+                    if not changes:
+                        first = time.monotonic()
+                    _coalesce(changes, path, kind)
+            if changes and (not events or time.monotonic() - first >= max_delay):
+                yield changes
+                changes = {}
+        if changes:
+            yield changes
+    finally:
+        watcher.close()
+
+
+def sync(changes: Dict[str, str], src: str, dest: str) -> bool:
+    """Replicate a batch of changes from watch into a copy of the tree
+
+    Only the changed files are copied or removed, the rest of dest is not touched
+
+    Args:
+        changes (Dict[str, str]): batch yielded by watch
+        src (str): root of the watched tree
+        dest (str): root of the copy, accepts unix/windows paths and <remote_host>:<Path> syntax
+
+    Returns:
+        True if every change was replicated, False otherwise
+    """
+    src = os.path.abspath(src)
+    success = True
+    parents = set()
+    for path, kind in sorted(changes.items()):
+        relative = os.path.relpath(path, src)
+        if relative == os.curdir or relative.startswith(os.pardir + os.sep):
+            _log.warning(f"Skipping {path}, it is outside of {src}")
+            continue
+        target = os.path.join(dest, relative)
+
+        if kind == DELETED:
+            success = remove(target, force=True) and success
+            continue
+        if not os.path.isfile(path):
+            # NOTE: deleted again after the batch was yielded, the next batch reports it
+            _log.debug(f"Skipping {path}, it is no longer a file")
+            continue
+
+        parent = os.path.dirname(target)
+        if parent not in parents:
+            parents.add(parent)
+            success = mkdir(parent, force=True) and success
+        success = copy(path, target, force=True) and success
+    return success
+
+
+def _scan_usage(dirname: str, apparent: bool) -> Tuple[int, List[str], List[Tuple[int, int, int]]]:
+    """Sum the sizes of the entries of a directory
+
+    Returns:
+        Size of the entries with a single link, subdirectories and (st_dev, st_ino, size) of the hardlinked files
+    """
+    total = 0
+    subdirs: List[str] = []
+    linked: List[Tuple[int, int, int]] = []
+    try:
+        with os.scandir(dirname) as entries:
+            for entry in entries:
+                try:
+                    stat = entry.stat(follow_symlinks=False)
+                except OSError:
+                    continue
+                size = stat.st_size if apparent else stat.st_blocks * 512
+                if entry.is_dir(follow_symlinks=False):
+                    subdirs.append(entry.path)
+                    total += size
+                elif stat.st_nlink > 1:
+                    linked.append((stat.st_dev, stat.st_ino, size))
+                else:
+                    total += size
+    except OSError as e:
+        _log.debug(f"Skipping unreadable directory: {e}")
+    return total, subdirs, linked
+
+
+def disk_usage(
+    dirname: str,
+    remote_host: Optional[str] = None,
+    apparent: bool = False,
+    workers: Optional[int] = None,
+) -> Optional[int]:
+    """Disk space used by a directory tree, like du -s
+
+    Local trees are walked by a pool of threads, one directory per task, the stat calls release the GIL.
+    Files with several hardlinks are counted once. Remote trees are measured by du in the remote host
+
+    Args:
+        dirname (str): root of the tree, accepts unix/windows paths and <remote_host>:<Path> syntax
+        remote_host (Optional[str]): name/address of the remote host if the check is not perform locally
+        apparent (bool): sum the file sizes instead of the allocated blocks
+        workers (Optional[int]): number of threads walking the tree
+
+    Returns:
+        Used bytes or None if dirname is not a readable directory
+    """
+    dir_match = _remote_regex.match(dirname)
+    if not dir_match and not remote_host:
+        try:
+            stat = os.stat(dirname)
+        except OSError:
+            return None
+        if not os.path.isdir(dirname):
+            return None
+
+        total = stat.st_size if apparent else stat.st_blocks * 512
+        inodes = set()
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            pending = {pool.submit(_scan_usage, dirname, apparent)}
+            while pending:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    size, subdirs, linked = future.result()
+                    total += size
+                    pending.update(pool.submit(_scan_usage, subdir, apparent) for subdir in subdirs)
+                    for dev, ino, size in linked:
+                        if (dev, ino) not in inodes:
+                            inodes.add((dev, ino))
+                            total += size
+        return total
+
+    if remote_host is not None and dir_match is not None:
+        raise Exception("Cannot pass both dirname with a remote host and remote_host arg")
+
+    if dir_match is not None:
+        remote_host = dir_match.group(1)
+        dirname = dir_match.group(6)
+
+    cmd = ["du", "-s", "-B1"]
+    if apparent:
+        cmd.append("--apparent-size")
+    cmd.append(dirname)
+    remote_usage = READ_POLICY.execute(cmd, remote_host=remote_host, idempotent=True)
+    output = clear_list(remote_usage.stdout)
+    if remote_usage.rc != 0 or not output:
+        return None
+    return int(output[0].split()[0])
+
+
+def _search_files(filenames: List[str], pattern: Pattern[bytes]) -> List[Tuple[str, int, str]]:
+    """Scan a chunk of files in a worker process, reports the first match of each line"""
+    # NOTE: mmap is only needed here, load it on demand
+    import mmap
+
+    matches = []
+    for filename in filenames:
+        try:
+            with open(filename, "rb") as data:
+                size = os.fstat(data.fileno()).st_size
+                if size == 0:
+                    continue
+                with mmap.mmap(data.fileno(), 0, access=mmap.ACCESS_READ) as content:
+                    if content.find(b"\0", 0, _BINARY_PROBE) != -1:
+                        continue
+                    lineno = 1
+                    counted = 0
+                    pos = 0
+                    while pos <= size:
+                        match = pattern.search(content, pos)
+                        if match is None:
+                            break
+                        start = content.rfind(b"\n", 0, match.start()) + 1
+                        end = content.find(b"\n", match.start())
+                        end = size if end == -1 else end
+                        if match.end() > end:
+                            # NOTE: \s or \n may run into the next lines, only matches within the line count
+                            match = pattern.search(content, start, end)
+                        if match is not None:
+                            lineno += content[counted:start].count(b"\n")
+                            counted = start
+                            line = content[start:end].rstrip(b"\r").decode(errors="replace")
+                            matches.append((filename, lineno, line))
+                        pos = end + 1
+        except (OSError, ValueError) as e:
+            _log.debug(f"Skipping unreadable file: {e}")
+    return matches
+
+
+def search(
+    dirname: str,
+    regex: Union[str, Pattern[str]],
+    glob_pattern: str = "*",
+    workers: Optional[int] = None,
+) -> Iterator[Tuple[str, int, str]]:
+    """Search a regex in the files of a local directory tree, like grep -rn
+
+    The files are memory mapped and scanned in chunks by a pool of processes, the regex engine holds the GIL.
+    The regex is matched line by line with ^ and $ anchored to each line, matches never span more than one
+    line since patterns like whitespace classes cannot match the line break, binary files are skipped.
+    The matches are streamed as soon as each chunk is done and only a few chunks are in flight, the memory
+    use does not grow with the tree size. The order of the matches between chunks is not deterministic
+
+    Args:
+        dirname (str): root of the tree to search
+        regex (Union[str, Pattern[str]]): regular expression to search
+        glob_pattern (str): pattern matched against the basename of each file
+        workers (Optional[int]): number of processes scanning files, defaults to the number of CPUs
+
+    Returns:
+        Iterator of (path, line number, line) of each matching line
+    """
+    # NOTE: multiprocessing is slow to import, load it on demand
+    from concurrent.futures import ProcessPoolExecutor
+
+    if isinstance(regex, str):
+        pattern = re.compile(regex.encode(), re.MULTILINE)
+    else:
+        pattern = re.compile(regex.pattern.encode(), (regex.flags & ~re.UNICODE) | re.MULTILINE)
+
+    workers = (os.cpu_count() or 1) if workers is None else workers
+    pool = ProcessPoolExecutor(max_workers=workers)
+    pending = set()
+    try:
+        chunk: List[str] = []
+        for filename in walk(dirname, glob_pattern):
+            chunk.append(filename)
+            if len(chunk) < _SEARCH_CHUNK:
+                continue
+            pending.add(pool.submit(_search_files, chunk, pattern))
+            chunk = []
+            if len(pending) >= workers * 2:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    yield from future.result()
+        if chunk:
+            pending.add(pool.submit(_search_files, chunk, pattern))
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                yield from future.result()
+    finally:
+        for future in pending:
+            future.cancel()
+        pool.shutdown()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,163 @@
+#!/usr/bin/env python3
+
+# import argparse
+import logging
+
+# import os
+# import subprocess
+# import sys
+# import re
+# import shutil
+import statistics
+
+from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import as_completed
+from dataclasses import dataclass, field, replace
+
+from typing import Dict
+from typing import Optional
+from typing import List
+from typing import Sequence
+from typing import Any
+
+# from typing import Union
+# from typing import cast
+
+from .logger import get_logger
+from .shell import Job
+from .shell import ssh_pool_options
+
+_log: logging.Logger
+# _SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+# _SCRIPTNAME = os.path.basename(__file__)
+# _log_file: Optional[str] = os.path.splitext(_SCRIPTNAME)[0] + ".log"
+# _verbose = False
+# _is_windows = os.name == 'nt'
+# _home = os.environ['USERPROFILE' if _is_windows else 'HOME']
+
+# Hosts slower than the median by this many median absolute deviations, and at least twice
+# as slow as the median, are outliers
+OUTLIER_FACTOR = 3.0
+
+
+@dataclass
+class HostResult(object):
+    """Outcome of a job in a single host"""
+
+    host: str
+    rc: int
+    duration: float
+    stdout: List[str] = field(repr=False, default_factory=list)
+    stderr: List[str] = field(repr=False, default_factory=list)
+    timed_out: bool = False
+    error: Optional[str] = None
+
+
+def _run_on_host(job: Job, host: str, cwd: Optional[str], timeout: Optional[float], background: bool) -> HostResult:
+    host_job = replace(job, label=host)
+    try:
+        host_job.execute(background=background, cwd=cwd, remote_host=host, timeout=timeout)
+    except Exception as e:
+        _log.error(f"[{host}] Failed to execute {job.cmd}: {e}")
+        return HostResult(host=host, rc=-1, duration=0.0, error=str(e))
+    return HostResult(
+        host=host,
+        rc=host_job.rc,
+        duration=host_job.wall_time,
+        stdout=host_job.stdout,
+        stderr=host_job.stderr,
+        timed_out=host_job.timed_out,
+    )
+
+
+def run_on_hosts(
+    job: Job,
+    hosts: Sequence[str],
+    concurrency: int = 32,
+    cwd: Optional[str] = None,
+    timeout: Optional[float] = None,
+    background: bool = True,
+    pool: bool = True,
+) -> Dict[str, HostResult]:
+    """Run the same job in many remote hosts concurrently
+
+    The output of each host is logged as it arrives prefixed with the hostname
+
+    Args:
+        job (Job): job to execute, it is copied for each host
+        hosts (Sequence[str]): name/address of the remote hosts
+        concurrency (int): max number of hosts running the job at the same time
+        cwd (Optional[str]): remote path where the job is execute
+        timeout (Optional[float]): seconds to wait before killing the job in a host
+        background (bool): log stdout as debug instead of info messages
+        pool (bool): reuse ssh connections to each host through multiplexing
+
+    Returns:
+        Dict with the result of each host in the given order
+    """
+    if concurrency <= 0:
+        raise Exception("Concurrency must be greater than 0")
+
+    # NOTE: the multiplexing only applies to the copies of this job, other threads keep their ssh options
+    if pool:
+        job = replace(job, ssh_options=list(job.ssh_options or ()) + ssh_pool_options())
+
+    unique_hosts = list(dict.fromkeys(hosts))
+    results: Dict[str, HostResult] = {}
+    with ThreadPoolExecutor(max_workers=min(concurrency, max(len(unique_hosts), 1))) as executor:
+        futures = {executor.submit(_run_on_host, job, host, cwd, timeout, background): host for host in unique_hosts}
+        for done, future in enumerate(as_completed(futures), 1):
+            result = future.result()
+            results[result.host] = result
+            _log.debug(f"[{done}/{len(futures)}] {result.host} finished with {result.rc} in {result.duration:.3f}s")
+
+    return {host: results[host] for host in unique_hosts}
+
+
+def summarize(results: Dict[str, HostResult]) -> Dict[str, Any]:
+    """Summarize the results of run_on_hosts logging failures and outliers
+
+    Args:
+        results (Dict[str, HostResult]): results of each host
+
+    Returns:
+        Dict with the number of hosts, failed and outlier hosts and duration percentiles
+    """
+    durations = sorted(r.duration for r in results.values() if r.error is None)
+    failed = [host for host, r in results.items() if r.rc != 0]
+    outliers: List[str] = []
+
+    summary: Dict[str, Any] = {
+        "hosts": len(results),
+        "succeeded": len(results) - len(failed),
+        "failed": failed,
+        "outliers": outliers,
+    }
+
+    if durations:
+        median = statistics.median(durations)
+        mad = statistics.median(abs(d - median) for d in durations)
+        # NOTE: with MAD 0 (every other host took the same time) the 2 * median floor still applies
+        threshold = max(median + OUTLIER_FACTOR * mad, 2 * median)
+        outliers += [host for host, r in results.items() if r.error is None and r.duration > threshold]
+        summary.update(
+            {
+                "p50": median,
+                "p95": durations[min(int(len(durations) * 0.95), len(durations) - 1)],
+                "max": durations[-1],
+            }
+        )
+
+    _log.info(f"{summary['succeeded']}/{summary['hosts']} hosts succeeded")
+    for host in failed:
+        reason = results[host].error or ("timed out" if results[host].timed_out else f"rc {results[host].rc}")
+        _log.error(f"[{host}] failed: {reason}")
+    for host in outliers:
+        _log.warning(f"[{host}] slow host: {results[host].duration:.3f}s, median {summary['p50']:.3f}s")
+    return summary
+
+
+if __name__ == "__main__":
+    raise Exception("This library should not be run as a standalone script")
+else:
+    _log = get_logger("Main")
@@ -1,26 +1,186 @@
 #!/usr/bin/env python3
 
+import os
 import re
-from typing import List, Any
+import sys
+import heapq
+
+from itertools import chain
+from typing import List, Any, Iterable, Iterator, Set, IO, Callable, Optional
+
+# Estimated bytes of items kept in memory before uniq/sorted_stream switch to disk
+DEFAULT_MEMORY_LIMIT = 256 * 1024 * 1024
+_PARTITIONS = 256
+
+_empty_str = re.compile(r"^\s*$")
 
 
 def clear_list(str_list: List[str]) -> List[str]:
     tmp = []
-    empty_str = re.compile(r"^\s*$")
     for i in str_list:
-        if i and not empty_str.match(i):
+        if i and not _empty_str.match(i):
             tmp.append(i)
     return tmp
 
 
-def uniq_list(duplicates: List[Any]) -> List[Any]:
-    return list(set(duplicates))
+def _write_records(stream: IO[bytes], records: Iterable[Any]):
+    # NOTE: pickle is only needed once the data spills to disk, load it on demand
+    import pickle
+
+    pickler = pickle.Pickler(stream, protocol=pickle.HIGHEST_PROTOCOL)
+    for record in records:
+        pickler.dump(record)
+        # NOTE: the memo keeps every dumped object alive, spill files must not grow the heap
+        pickler.clear_memo()
+
+
+def _read_records(filename: str) -> Iterator[Any]:
+    import pickle
+
+    with open(filename, "rb") as stream:
+        unpickler = pickle.Unpickler(stream)
+        while True:
+            try:
+                yield unpickler.load()
+            except EOFError:
+                return
+
+
+def _uniq_external(seen: Set[Any], iterator: Iterator[Any]) -> Iterator[Any]:
+    """Deduplicate the rest of the input on disk
+
+    Items are hash partitioned into temporary files so each partition can be deduplicated in
+    memory on its own, the already yielded items are spilled as well to filter them out. First-seen
+    order is restored by merging the partitions on the position of each item in the input
+    """
+    import pickle
+    import tempfile
+
+    with tempfile.TemporaryDirectory(prefix="uniq") as tmp:
+        names = [os.path.join(tmp, str(i)) for i in range(_PARTITIONS)]
+        streams = [open(name, "wb") for name in names]
+        try:
+            picklers = [pickle.Pickler(stream, protocol=pickle.HIGHEST_PROTOCOL) for stream in streams]
+            for item in seen:
+                picklers[hash(item) % _PARTITIONS].dump((-1, item))
+            seen.clear()
+            for index, item in enumerate(iterator):
+                pickler = picklers[hash(item) % _PARTITIONS]
+                pickler.dump((index, item))
+                pickler.clear_memo()
+        finally:
+            for stream in streams:
+                stream.close()
+
+        for name in names:
+            first = {}
+            for index, item in _read_records(name):
+                if item not in first:
+                    first[item] = index
+            survivors = sorted((index, item) for item, index in first.items() if index >= 0)
+            del first
+            with open(name, "wb") as stream:
+                _write_records(stream, survivors)
+
+        for _, item in heapq.merge(*[_read_records(name) for name in names]):
+            yield item
+
+
+def uniq(*iterables: Iterable[Any], memory_limit: int = DEFAULT_MEMORY_LIMIT) -> Iterator[Any]:
+    """Lazily drop duplicated items keeping the first-seen order
+
+    Items are yielded as soon as they are read until the distinct items exceed memory_limit,
+    the rest of the input is then deduplicated on disk and yielded once it has been consumed
+
+    Args:
+        iterables: one or more iterables of hashable items, picklable if they may go to disk
+        memory_limit (int): estimated bytes of distinct items to keep in memory
+
+    Returns:
+        Iterator over the distinct items of all iterables in first-seen order
+    """
+    seen: Set[Any] = set()
+    used = 0
+    iterator = chain.from_iterable(iterables)
+    for item in iterator:
+        if item in seen:
+            continue
+        seen.add(item)
+        yield item
+        used += sys.getsizeof(item)
+        if used > memory_limit:
+            yield from _uniq_external(seen, iterator)
+            return
+
+
+def uniq_list(duplicates: Iterable[Any]) -> List[Any]:
+    return list(uniq(duplicates))
+
+
+def merge_uniq(*iterables: Iterable[Any]) -> List[Any]:
+    return list(uniq(*iterables))
+
+
+def sorted_stream(
+    iterable: Iterable[Any],
+    key: Optional[Callable[[Any], Any]] = None,
+    reverse: bool = False,
+    memory_limit: int = DEFAULT_MEMORY_LIMIT,
+) -> Iterator[Any]:
+    """Sort inputs bigger than the available memory
+
+    Sorted runs of up to memory_limit bytes are spilled to temporary files and k-way merged,
+    the sort is stable like sorted()
+
+    Args:
+        iterable (Iterable[Any]): items to sort, picklable if they may go to disk
+        key (Optional[Callable[[Any], Any]]): function to extract the comparison key of each item
+        reverse (bool): sort in descending order
+        memory_limit (int): estimated bytes of items to keep in memory
+
+    Returns:
+        Iterator over the sorted items
+    """
+    import tempfile
+
+    with tempfile.TemporaryDirectory(prefix="sort") as tmp:
+        runs: List[str] = []
+        run: List[Any] = []
+        used = 0
+        for item in iterable:
+            run.append(item)
+            used += sys.getsizeof(item)
+            if used > memory_limit:
+                run.sort(key=key, reverse=reverse)
+                runs.append(os.path.join(tmp, str(len(runs))))
+                with open(runs[-1], "wb") as stream:
+                    _write_records(stream, run)
+                run = []
+                used = 0
+
+        run.sort(key=key, reverse=reverse)
+        if not runs:
+            yield from run
+            return
+        yield from heapq.merge(*[_read_records(name) for name in runs], run, key=key, reverse=reverse)
+
+
+def merge_sorted(
+    *iterables: Iterable[Any],
+    key: Optional[Callable[[Any], Any]] = None,
+    reverse: bool = False,
+) -> Iterator[Any]:
+    """Lazily merge already sorted iterables, ex. the sorted output of Jobs in many hosts
 
+    Args:
+        iterables: sorted iterables to combine
+        key (Optional[Callable[[Any], Any]]): function to extract the comparison key of each item
+        reverse (bool): the iterables are sorted in descending order
 
-def merge_uniq(src: List[Any], dest: List[Any]) -> List[Any]:
-    tmp_src = set(src)
-    tmp_dest = set(dest)
-    return list(tmp_src.union(tmp_dest))
+    Returns:
+        Iterator over all items in sorted order
+    """
+    return heapq.merge(*iterables, key=key, reverse=reverse)
 
 
 if __name__ == "__main__":
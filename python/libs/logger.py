@@ -12,7 +12,7 @@ import sys
 
 # from typing import List
 # from typing import Sequence
-# from typing import TextIO
+from typing import TextIO
 from typing import Any
 from typing import Dict
 from typing import Optional
@@ -27,58 +27,66 @@ from .constants import VERSION
 
 # from dataclasses import dataclass, field
 
+
+class PrimitiveFormatter(logging.Formatter):
+    """Logging colored formatter, adapted from https://stackoverflow.com/a/56944256/3638629"""
+
+    def __init__(self, fmt, log_colors=None):
+        super().__init__()
+        self.fmt = fmt
+
+        colors = {
+            "grey": "\x1b[38;21m",
+            "green": "\x1b[32m",
+            "magenta": "\x1b[35m",
+            "purple": "\x1b[35m",
+            "blue": "\x1b[38;5;39m",
+            "yellow": "\x1b[38;5;226m",
+            "red": "\x1b[38;5;196m",
+            "bold_red": "\x1b[31;1m",
+            "reset": "\x1b[0m",
+        }
+
+        if log_colors is None:
+            log_colors = {}
+
+        log_colors["DEBUG"] = log_colors["DEBUG"] if "DEBUG" in log_colors else "magenta"
+        log_colors["INFO"] = log_colors["INFO"] if "INFO" in log_colors else "green"
+        log_colors["WARNING"] = log_colors["WARNING"] if "WARNING" in log_colors else "yellow"
+        log_colors["ERROR"] = log_colors["ERROR"] if "ERROR" in log_colors else "red"
+        log_colors["CRITICAL"] = log_colors["CRITICAL"] if "CRITICAL" in log_colors else "bold_red"
+
+        self.FORMATS = {
+            logging.DEBUG: colors[log_colors["DEBUG"]] + self.fmt + colors["reset"],
+            logging.INFO: colors[log_colors["INFO"]] + self.fmt + colors["reset"],
+            logging.WARNING: colors[log_colors["WARNING"]] + self.fmt + colors["reset"],
+            logging.ERROR: colors[log_colors["ERROR"]] + self.fmt + colors["reset"],
+            logging.CRITICAL: colors[log_colors["CRITICAL"]] + self.fmt + colors["reset"],
+        }
+
+    def format(self, record):
+        log_fmt = self.FORMATS.get(record.levelno)
+        formatter = logging.Formatter(log_fmt)
+        return formatter.format(record)
+
+
 ColorFormatter: Any = None
 Formatter: Any = None
 
-try:
-    from colorlog import ColoredFormatter
-
-    Formatter = ColoredFormatter
-    ColorFormatter = ColoredFormatter
-except ImportError:
-
-    class PrimitiveFormatter(logging.Formatter):
-        """Logging colored formatter, adapted from https://stackoverflow.com/a/56944256/3638629"""
-
-        def __init__(self, fmt, log_colors=None):
-            super().__init__()
-            self.fmt = fmt
-
-            colors = {
-                "grey": "\x1b[38;21m",
-                "green": "\x1b[32m",
-                "magenta": "\x1b[35m",
-                "purple": "\x1b[35m",
-                "blue": "\x1b[38;5;39m",
-                "yellow": "\x1b[38;5;226m",
-                "red": "\x1b[38;5;196m",
-                "bold_red": "\x1b[31;1m",
-                "reset": "\x1b[0m",
-            }
-
-            if log_colors is None:
-                log_colors = {}
-
-            log_colors["DEBUG"] = log_colors["DEBUG"] if "DEBUG" in log_colors else "magenta"
-            log_colors["INFO"] = log_colors["INFO"] if "INFO" in log_colors else "green"
-            log_colors["WARNING"] = log_colors["WARNING"] if "WARNING" in log_colors else "yellow"
-            log_colors["ERROR"] = log_colors["ERROR"] if "ERROR" in log_colors else "red"
-            log_colors["CRITICAL"] = log_colors["CRITICAL"] if "CRITICAL" in log_colors else "bold_red"
-
-            self.FORMATS = {
-                logging.DEBUG: colors[log_colors["DEBUG"]] + self.fmt + colors["reset"],
-                logging.INFO: colors[log_colors["INFO"]] + self.fmt + colors["reset"],
-                logging.WARNING: colors[log_colors["WARNING"]] + self.fmt + colors["reset"],
-                logging.ERROR: colors[log_colors["ERROR"]] + self.fmt + colors["reset"],
-                logging.CRITICAL: colors[log_colors["CRITICAL"]] + self.fmt + colors["reset"],
-            }
-
-        def format(self, record):
-            log_fmt = self.FORMATS.get(record.levelno)
-            formatter = logging.Formatter(log_fmt)
-            return formatter.format(record)
-
-    Formatter = PrimitiveFormatter
+
+def _load_formatters():
+    """Resolve the console formatter, colorlog is only imported when the first console handler is created"""
+    global ColorFormatter, Formatter
+    if Formatter is not None:
+        return
+
+    try:
+        from colorlog import ColoredFormatter
+
+        Formatter = ColoredFormatter
+        ColorFormatter = ColoredFormatter
+    except ImportError:
+        Formatter = PrimitiveFormatter
 
 
 # _SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
@@ -90,20 +98,22 @@ except ImportError:
 _loggers: Dict[str, logging.Logger] = {}
 
 
-def _get_stdout_handler(level: int, color: bool = True):
+def _get_stdout_handler(level: int, color: bool = True, stream: Optional[TextIO] = None):
     """Create a new stdout handler
 
     Args:
         level (int): handler internal logging level
         color (bool): Control if colors should be output to the stdout stream
+        stream (Optional[TextIO]): stream to write the records, defaults to stdout
 
     Returns:
         logging handler
     """
     # This means both 0 and 100 silence all output
     level = 100 if level == 0 else level
+    _load_formatters()
     has_color = ColorFormatter is not None and color
-    stdout_handler = logging.StreamHandler(sys.stdout)
+    stdout_handler = logging.StreamHandler(stream if stream is not None else sys.stdout)
     stdout_handler.setLevel(level)
     logformat = "{color}%(levelname)-8s | %(message)s"
     logformat = logformat.format(
@@ -124,6 +134,24 @@ def _get_stdout_handler(level: int, color: bool = True):
     return stdout_handler
 
 
+class _LogfileHandler(logging.FileHandler):
+    """File handler that opens the logfile and writes the banner with the first record
+
+    Runs that never log anything to the file (e.g. --help) do not touch the disk
+    """
+
+    def __init__(self, filename: str):
+        super().__init__(filename=filename, delay=True)
+
+    def _open(self):
+        stream = super()._open()
+        stream.write(HEADER)
+        stream.write(f"\nDate: {datetime.today()}")
+        stream.write(f"\nAuthor:   {AUTHOR}")
+        stream.write(f"\nVersion:   {VERSION}\n")
+        return stream
+
+
 def _get_logfile_handler(level: int, logfile: str = "dummy.log"):
     """Create a new file handler
 
@@ -134,13 +162,7 @@ def _get_logfile_handler(level: int, logfile: str = "dummy.log"):
     Returns:
         logging handler
     """
-    with open(logfile, "a") as log:
-        log.write(HEADER)
-        log.write(f"\nDate: {datetime.today()}")
-        log.write(f"\nAuthor:   {AUTHOR}")
-        log.write(f"\nVersion:   {VERSION}\n")
-
-    file_handler = logging.FileHandler(filename=logfile)
+    file_handler = _LogfileHandler(filename=logfile)
     file_handler.setLevel(level)
     file_format = logging.Formatter("%(levelname)-8s | %(filename)s: [%(funcName)s] - %(message)s")
     file_handler.setFormatter(file_format)
@@ -225,7 +247,8 @@ def create_logger(
         add_logfile = True
     elif has_file_hanlder:
         h_level = handlers[1].level
-        h_name = handlers[1].stream.name  # type: ignore
+        # NOTE: the logfile stream is only opened with the first record, use the filename instead
+        h_name = handlers[1].baseFilename  # type: ignore
         if h_level != file_level or os.path.basename(h_name) != filename:
             add_logfile = True
 
@@ -0,0 +1,287 @@
+#!/usr/bin/env python3
+
+# import argparse
+import logging
+import os
+
+# import subprocess
+# import sys
+# import re
+# import shutil
+import functools
+import inspect
+import json
+import shlex
+import threading
+import time
+
+from typing import Dict
+from typing import Optional
+from typing import List
+from typing import Sequence
+from typing import Any
+from typing import Callable
+
+# from typing import Union
+# from typing import cast
+
+from dataclasses import dataclass, field
+
+from . import files
+from .logger import get_logger
+from .scheduler import Scheduler
+from .scheduler import SKIPPED
+from .shell import Job
+
+try:
+    import yaml
+except ImportError:
+    yaml = None
+
+_log: logging.Logger
+# _SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+# _SCRIPTNAME = os.path.basename(__file__)
+# _log_file: Optional[str] = os.path.splitext(_SCRIPTNAME)[0] + ".log"
+# _verbose = False
+# _is_windows = os.name == 'nt'
+# _home = os.environ['USERPROFILE' if _is_windows else 'HOME']
+
+OPERATIONS: Dict[str, Callable[..., bool]] = {
+    "copy": files.copy,
+    "move": files.move,
+    "rename": files.rename,
+    "remove": files.remove,
+    "extract": files.extract,
+    "mkdir": files.mkdir,
+}
+
+_CMD_KEYS = ("name", "cmd", "remote_host", "cwd", "timeout", "deps")
+_OP_KEYS = ("name", "op", "remote_host", "deps")
+# Path argument of the ops without a remote_host parameter that accept the <remote_host>:<path> syntax
+_REMOTE_PATHS = {"remove": "src"}
+
+
+@dataclass
+class Entry(object):
+    """Unit of work of a manifest, either a cmd or a files operation"""
+
+    name: str
+    cmd: Optional[Sequence[str]] = None
+    op: Optional[str] = None
+    args: Dict[str, Any] = field(default_factory=dict)
+    remote_host: Optional[str] = None
+    cwd: Optional[str] = None
+    timeout: Optional[float] = None
+    # Names of the entries that must succeed before this one runs
+    deps: Sequence[str] = ()
+    skipped: bool = field(init=False, default=False)
+    rc: int = field(init=False, default=-1)
+    duration: float = field(init=False, default=0.0)
+    output: List[str] = field(init=False, repr=False, default_factory=list)
+
+    def execute(self) -> int:
+        """Run the entry saving its return code, duration and output
+
+        Returns:
+            0 on success any other integer on failure
+        """
+        start = time.monotonic()
+        try:
+            if self.cmd is not None:
+                job = Job(self.cmd, label=self.name)
+                job.execute(cwd=self.cwd, remote_host=self.remote_host, timeout=self.timeout)
+                self.rc = job.rc
+                self.output = [f"$ {' '.join(shlex.quote(arg) for arg in self.cmd)}"]
+                self.output += job.stdout
+                self.output += [f"stderr: {line}" for line in job.stderr]
+            else:
+                self.rc = 0 if OPERATIONS[str(self.op)](**self.args) else 1
+                self.output = [f"{self.op} {self.args}"]
+        except Exception as e:
+            _log.error(f"[{self.name}] {e.__class__.__name__}: {e}")
+            self.rc = 1
+            self.output.append(f"{e.__class__.__name__}: {e}")
+        self.duration = time.monotonic() - start
+        return self.rc
+
+
+def _parse_entry(index: int, data: Dict[str, Any]) -> Entry:
+    if not isinstance(data, dict):
+        raise Exception(f"Manifest entry {index} must be a mapping")
+
+    name = str(data.get("name", f"entry{index}"))
+    cmd = data.get("cmd")
+    op = data.get("op")
+    if (cmd is None) == (op is None):
+        raise Exception(f"Manifest entry {name} must define either cmd or op")
+    if op is not None and op not in OPERATIONS:
+        raise Exception(f"Manifest entry {name} has unknown op {op}, valid ops: {', '.join(OPERATIONS)}")
+
+    deps = data.get("deps", [])
+    deps = [deps] if isinstance(deps, str) else deps
+    if not isinstance(deps, list) or not all(isinstance(dep, str) for dep in deps):
+        raise Exception(f"Manifest entry {name} deps must be an entry name or a list of names")
+
+    if cmd is not None:
+        unknown = sorted(set(data) - set(_CMD_KEYS))
+        if unknown:
+            raise Exception(f"Manifest entry {name} has unknown keys: {', '.join(unknown)}")
+        return Entry(
+            name=name,
+            cmd=shlex.split(cmd) if isinstance(cmd, str) else cmd,
+            remote_host=data.get("remote_host"),
+            cwd=data.get("cwd"),
+            timeout=data.get("timeout"),
+            deps=deps,
+        )
+
+    signature = inspect.signature(OPERATIONS[str(op)])
+    args = {k: v for k, v in data.items() if k not in _OP_KEYS}
+    unknown = sorted(set(args) - set(signature.parameters))
+    if unknown:
+        raise Exception(f"Manifest entry {name} has arguments not supported by {op}: {', '.join(unknown)}")
+
+    remote_host = data.get("remote_host")
+    if remote_host is not None:
+        if "remote_host" in signature.parameters:
+            args["remote_host"] = remote_host
+        elif op in _REMOTE_PATHS and _REMOTE_PATHS[op] in args:
+            args[_REMOTE_PATHS[op]] = f"{remote_host}:{args[_REMOTE_PATHS[op]]}"
+        else:
+            raise Exception(
+                f"Manifest entry {name}: {op} does not take remote_host, use <remote_host>:<path> in its paths"
+            )
+
+    try:
+        signature.bind(**args)
+    except TypeError as e:
+        raise Exception(f"Manifest entry {name} has invalid arguments for {op}: {e}")
+    return Entry(name=name, op=op, args=args, remote_host=remote_host, deps=deps)
+
+
+def load_manifest(filename: str) -> List[Entry]:
+    """Parse a manifest file
+
+    The manifest is a list of entries, or a mapping with a "jobs" list, in JSON or YAML (requires PyYAML).
+    Each entry has a name and either a cmd (string or list, optionally with remote_host, cwd and timeout)
+    or an op (copy, move, rename, remove, extract, mkdir) with the arguments of the files function.
+    Ops take remote_host if their files function does, copy, move and rename use <remote_host>:<path>
+    paths instead. Entries run concurrently unless they list the names of the entries they wait for in
+    deps, e.g. a copy into a directory created by a mkdir entry. Unknown keys are rejected
+
+    Args:
+        filename (str): path of the manifest
+
+    Returns:
+        List of entries in the manifest
+    """
+    with open(filename) as data:
+        if filename.endswith((".yaml", ".yml")):
+            if yaml is None:
+                raise Exception("Missing PyYAML, cannot read YAML manifests, use JSON instead")
+            content = yaml.safe_load(data)
+        else:
+            content = json.load(data)
+
+    if isinstance(content, dict):
+        content = content.get("jobs", [])
+    if not isinstance(content, list):
+        raise Exception(f"Invalid manifest {filename}, expected a list of jobs")
+
+    entries = [_parse_entry(i, entry) for i, entry in enumerate(content)]
+    names = [entry.name for entry in entries]
+    duplicated = sorted({name for name in names if names.count(name) > 1})
+    if duplicated:
+        raise Exception(f"Duplicated manifest entries: {', '.join(duplicated)}")
+    for entry in entries:
+        unknown = sorted(set(entry.deps) - set(names))
+        if unknown:
+            raise Exception(f"Manifest entry {entry.name} depends on unknown entries: {', '.join(unknown)}")
+    return entries
+
+
+def _write_log(entry: Entry, logs_dir: str):
+    filename = os.path.join(logs_dir, f"{entry.name.replace(os.sep, '_')}.log")
+    with open(filename, "w") as log:
+        log.write(f"Name:     {entry.name}\n")
+        log.write(f"Rc:       {entry.rc}\n")
+        log.write(f"Duration: {entry.duration:.3f}s\n\n")
+        log.write("\n".join(entry.output))
+        log.write("\n")
+
+
+def report(entries: Sequence[Entry], elapsed: float) -> List[str]:
+    """Timing report of a manifest run, slowest entries first
+
+    Args:
+        entries (Sequence[Entry]): executed entries
+        elapsed (float): wall time of the whole run
+
+    Returns:
+        List of report lines
+    """
+    width = max((len(entry.name) for entry in entries), default=0)
+    lines = []
+    for entry in sorted(entries, key=lambda e: e.duration, reverse=True):
+        status = "skipped" if entry.skipped else "ok" if entry.rc == 0 else f"rc {entry.rc}"
+        lines.append(f"{entry.name:<{width}} | {status:<7} | {entry.duration:8.3f}s")
+    busy = sum(entry.duration for entry in entries)
+    lines.append(f"Wall time {elapsed:.3f}s, job time {busy:.3f}s, parallelism {busy / max(elapsed, 1e-9):.2f}x")
+    return lines
+
+
+def run_manifest(entries: Sequence[Entry], jobs: int = 4, logs_dir: Optional[str] = None) -> bool:
+    """Run the entries of a manifest concurrently, entries start once all their deps succeeded
+
+    Entries whose deps failed are skipped and count as failed
+
+    Args:
+        entries (Sequence[Entry]): entries to execute
+        jobs (int): max number of entries running at the same time
+        logs_dir (Optional[str]): directory for the per entry logs, disabled if None
+
+    Returns:
+        True if all entries succeeded, False otherwise
+    """
+    if jobs <= 0:
+        raise Exception("Jobs must be greater than 0")
+    if logs_dir is not None:
+        os.makedirs(logs_dir, exist_ok=True)
+
+    total = len(entries)
+    progress = {"done": 0, "failed": 0}
+    lock = threading.Lock()
+    start = time.monotonic()
+    _log.info(f"Running {total} entries with {jobs} jobs")
+
+    def _execute(entry: Entry) -> int:
+        rc = entry.execute()
+        if logs_dir is not None:
+            _write_log(entry, logs_dir)
+        with lock:
+            progress["done"] += 1
+            progress["failed"] += rc != 0
+            done, failed = progress["done"], progress["failed"]
+        status = "done" if rc == 0 else f"failed ({rc})"
+        _log.info(
+            f"[{done}/{total}] {entry.name} {status} in {entry.duration:.3f}s, "
+            f"{total - done} pending, {failed} failed, {time.monotonic() - start:.1f}s elapsed"
+        )
+        return rc
+
+    scheduler = Scheduler(workers=jobs)
+    for entry in entries:
+        scheduler.add(entry.name, functools.partial(_execute, entry), deps=entry.deps, remote_host=entry.remote_host)
+    success = scheduler.run(report=False)
+
+    for entry in entries:
+        entry.skipped = scheduler.nodes[entry.name].status == SKIPPED
+    for line in report(entries, time.monotonic() - start):
+        _log.info(line)
+    return success
+
+
+if __name__ == "__main__":
+    raise Exception("This library should not be run as a standalone script")
+else:
+    _log = get_logger("Main")
@@ -0,0 +1,189 @@
+#!/usr/bin/env python3
+
+# import argparse
+import logging
+
+# import os
+# import subprocess
+# import sys
+# import re
+# import shutil
+import random
+import time
+
+from collections import deque
+from concurrent.futures import Future
+from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import FIRST_COMPLETED
+from concurrent.futures import wait
+
+# from typing import Dict
+from typing import Optional
+from typing import List
+from typing import Sequence
+from typing import Deque
+from typing import TYPE_CHECKING
+
+# from typing import Any
+# from typing import Union
+# from typing import cast
+
+from dataclasses import dataclass, field
+
+from .logger import get_logger
+
+if TYPE_CHECKING:
+    from .shell import Job
+
+_log: logging.Logger
+# _SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+# _SCRIPTNAME = os.path.basename(__file__)
+# _log_file: Optional[str] = os.path.splitext(_SCRIPTNAME)[0] + ".log"
+# _verbose = False
+# _is_windows = os.name == 'nt'
+# _home = os.environ['USERPROFILE' if _is_windows else 'HOME']
+
+# ssh exits with 255 when the connection itself fails
+SSH_ERROR = 255
+
+# Number of latency samples needed before hedging uses the observed quantile
+_MIN_SAMPLES = 20
+
+
+def _job(cmd: Sequence[str]) -> "Job":
+    # NOTE: shell is only imported with the first remote call, local files operations never pay for it
+    from .shell import Job as ShellJob
+
+    return ShellJob(cmd)
+
+
+@dataclass
+class RetryPolicy(object):
+    """Deadline, retry and hedging rules for remote Job executions
+
+    Attempts are retried with exponential backoff and jitter when ssh fails to connect, idempotent
+    commands are also retried after hitting the per attempt deadline and, if hedge is set, a second
+    attempt is launched once the first one takes longer than the observed latency quantile
+    """
+
+    attempts: int = 3
+    timeout: Optional[float] = 30.0
+    backoff: float = 0.5
+    max_backoff: float = 10.0
+    jitter: float = 1.0
+    hedge: bool = False
+    hedge_delay: float = 1.0
+    hedge_quantile: float = 0.95
+    retry_codes: Sequence[int] = (SSH_ERROR,)
+    latencies: Deque[float] = field(init=False, repr=False, default_factory=lambda: deque(maxlen=512))
+
+    def delay(self, attempt: int) -> float:
+        """Backoff before retrying
+
+        Args:
+            attempt (int): number of the attempt that just failed, starting at 0
+
+        Returns:
+            Seconds to sleep, exponential on the attempt and randomized by the jitter ratio
+        """
+        backoff = min(self.max_backoff, self.backoff * (2.0**attempt))
+        return backoff - random.uniform(0, backoff * self.jitter)
+
+    def hedge_after(self) -> float:
+        """Seconds to wait for the first attempt before launching a hedged one
+
+        Returns:
+            The hedge_quantile of the recorded latencies or hedge_delay if there are not enough samples
+        """
+        if len(self.latencies) < _MIN_SAMPLES:
+            return self.hedge_delay
+        samples = sorted(self.latencies)
+        index = min(int(len(samples) * self.hedge_quantile), len(samples) - 1)
+        return samples[index]
+
+    def retryable(self, job: "Job", idempotent: bool) -> bool:
+        """Check if the result of an attempt should be retried
+
+        Args:
+            job (Job): executed job
+            idempotent (bool): the command can be safely executed more than once
+
+        Returns:
+            True if the attempt failed in a way this policy retries
+        """
+        if job.rc in self.retry_codes:
+            return True
+        # NOTE: Killed jobs may have done part of their work, only retry them if it's safe
+        return idempotent and job.timed_out
+
+    def _attempt(self, job: "Job", remote_host: Optional[str], cwd: Optional[str]) -> "Job":
+        job.execute(cwd=cwd, remote_host=remote_host, timeout=self.timeout)
+        if not job.timed_out and not job.cancelled:
+            self.latencies.append(job.wall_time)
+        return job
+
+    def _hedged_attempt(self, cmd: Sequence[str], remote_host: Optional[str], cwd: Optional[str]) -> "Job":
+        pool = ThreadPoolExecutor(max_workers=2)
+        jobs = [_job(cmd)]
+        attempts: List["Future[Job]"] = []
+        try:
+            attempts.append(pool.submit(self._attempt, jobs[0], remote_host, cwd))
+            done, _ = wait(attempts, timeout=self.hedge_after())
+            if not done:
+                _log.debug(f"Hedging slow command {cmd} on {remote_host}")
+                jobs.append(_job(cmd))
+                attempts.append(pool.submit(self._attempt, jobs[1], remote_host, cwd))
+
+            pending = set(attempts)
+            job = attempts[0]
+            while pending:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for finished in done:
+                    job = finished
+                    if not self.retryable(finished.result(), True):
+                        return finished.result()
+            return job.result()
+        finally:
+            for loser, attempt in zip(jobs, attempts):
+                if not attempt.done():
+                    loser.cancel()
+            pool.shutdown(wait=False)
+
+    def execute(
+        self,
+        cmd: Sequence[str],
+        remote_host: Optional[str] = None,
+        cwd: Optional[str] = None,
+        idempotent: bool = False,
+    ) -> "Job":
+        """Execute a cmd following the policy
+
+        Args:
+            cmd (Sequence[str]): command with its arguments
+            remote_host (Optional[str]): execute the command remotly using ssh
+            cwd (Optional[str]): path where the cmd is execute
+            idempotent (bool): the command is read-only and can be retried after timeouts or hedged
+
+        Returns:
+            Job of the last attempt
+        """
+        job: "Job"
+        for attempt in range(max(self.attempts, 1)):
+            if self.hedge and idempotent:
+                job = self._hedged_attempt(cmd, remote_host, cwd)
+            else:
+                job = self._attempt(_job(cmd), remote_host, cwd)
+
+            if not self.retryable(job, idempotent) or attempt + 1 >= self.attempts:
+                break
+
+            delay = self.delay(attempt)
+            _log.warning(f"Attempt {attempt + 1} of {cmd} failed with {job.rc}, retrying in {delay:.2f}s")
+            time.sleep(delay)
+        return job
+
+
+if __name__ == "__main__":
+    raise Exception("This library should not be run as a standalone script")
+else:
+    _log = get_logger("Main")
@@ -0,0 +1,261 @@
+#!/usr/bin/env python3
+
+# import argparse
+import logging
+import os
+
+# import subprocess
+import sys
+
+# import re
+# import shutil
+import atexit
+import threading
+import time
+
+from collections import Counter
+from contextlib import contextmanager
+
+# from typing import Dict
+from typing import Optional
+from typing import Iterator
+from typing import TYPE_CHECKING
+
+# from typing import List
+# from typing import Union
+# from typing import cast
+
+from .constants import SAMPLE_ENV
+from .logger import get_logger
+
+if TYPE_CHECKING:
+    import cProfile
+
+_log: logging.Logger
+# _SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+# _SCRIPTNAME = os.path.basename(__file__)
+# _log_file: Optional[str] = os.path.splitext(_SCRIPTNAME)[0] + ".log"
+# _verbose = False
+# _is_windows = os.name == 'nt'
+# _home = os.environ['USERPROFILE' if _is_windows else 'HOME']
+
+MALLOC_TOP = 25
+MALLOC_FRAMES = 10
+
+_SAMPLER_THREAD = "StackSampler"
+
+_output_prefix: Optional[str] = None
+_sampler: Optional["StackSampler"] = None
+_sampling = 0
+_sampling_lock = threading.Lock()
+
+
+def set_output(dirname: Optional[str], name: str = "cli"):
+    """Set where the profiling files are written, they are named <name>.<date>.<pid>.<kind>
+
+    Args:
+        dirname (Optional[str]): directory of the files, defaults to CWD
+        name (str): prefix of the files
+    """
+    global _output_prefix
+    dirname = os.getcwd() if not dirname else dirname
+    _output_prefix = os.path.join(dirname, f"{name}.{time.strftime('%Y%m%d-%H%M%S')}.{os.getpid()}")
+
+
+def output_path(kind: str) -> str:
+    """Get the path of a profiling file
+
+    Args:
+        kind (str): extension of the file, e.g. pstats
+
+    Returns:
+        Full path of the file
+    """
+    if _output_prefix is None:
+        set_output(None)
+    return f"{_output_prefix}.{kind}"
+
+
+class StackSampler(object):
+    """Statistical profiler, periodically records the python stack of every thread
+
+    The stacks are written in the collapsed format (frame;frame;frame count) used by flamegraph.pl,
+    speedscope and similar tools. Unlike cProfile the overhead does not depend on the number of calls
+    """
+
+    def __init__(self, interval: float = 0.01):
+        self.interval = interval
+        self.stacks: Counter = Counter()
+        self.samples = 0
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    @staticmethod
+    def _fold(frame) -> str:
+        stack = []
+        while frame is not None:
+            code = frame.f_code
+            stack.append(f"{os.path.basename(code.co_filename)}:{code.co_name}")
+            frame = frame.f_back
+        return ";".join(reversed(stack))
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            names = {thread.ident: thread.name for thread in threading.enumerate()}
+            for ident, frame in sys._current_frames().items():
+                name = names.get(ident, str(ident))
+                # Skip this and any other sampler thread
+                if name != _SAMPLER_THREAD:
+                    self.stacks[f"{name};{self._fold(frame)}"] += 1
+            self.samples += 1
+
+    def start(self):
+        if self._thread is not None:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name=_SAMPLER_THREAD, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        if self._thread is None:
+            return
+        self._stop.set()
+        self._thread.join()
+        self._thread = None
+
+    def write(self, filename: str):
+        """Write the collapsed stacks
+
+        Args:
+            filename (str): path of the collapsed stacks file
+        """
+        with open(filename, "w") as data:
+            for stack, count in self.stacks.most_common():
+                data.write(f"{stack} {count}\n")
+
+
+def _sample_interval() -> Optional[float]:
+    interval = os.environ.get(SAMPLE_ENV)
+    if not interval:
+        return None
+    try:
+        return float(interval)
+    except ValueError:
+        _log.warning(f"Ignoring invalid {SAMPLE_ENV}={interval}")
+        return None
+
+
+def _write_samples():
+    if _sampler is None or _sampler.samples == 0:
+        return
+    filename = output_path("samples.collapsed")
+    _sampler.write(filename)
+    _log.info(f"{_sampler.samples} stack samples written to {filename}")
+
+
+@contextmanager
+def sampling() -> Iterator[None]:
+    """Sample the python stacks while the block runs if CLI_SAMPLE_INTERVAL is set
+
+    All the blocks share the same sampler, the samples are written at exit next to the profiling files.
+    Nothing is done when the env var is unset
+    """
+    global _sampler, _sampling
+
+    interval = _sample_interval()
+    if interval is None:
+        yield
+        return
+
+    with _sampling_lock:
+        if _sampler is None:
+            _sampler = StackSampler(interval)
+            atexit.register(_write_samples)
+        _sampling += 1
+        _sampler.start()
+    try:
+        yield
+    finally:
+        with _sampling_lock:
+            _sampling -= 1
+            if _sampling == 0:
+                _sampler.stop()
+
+
+def _write_profile(profiler: "cProfile.Profile", sampler: StackSampler):
+    import io
+    import pstats
+
+    profiler.dump_stats(output_path("pstats"))
+    sampler.write(output_path("collapsed"))
+
+    summary = io.StringIO()
+    pstats.Stats(profiler, stream=summary).sort_stats("cumulative").print_stats(20)
+    _log.debug(summary.getvalue())
+    _log.info(f"Profile written to {output_path('pstats')} and {output_path('collapsed')}")
+
+
+def _write_malloc():
+    import tracemalloc
+
+    snapshot = tracemalloc.take_snapshot()
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    snapshot = snapshot.filter_traces(
+        (
+            tracemalloc.Filter(False, tracemalloc.__file__),
+            tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+        )
+    )
+    filename = output_path("malloc.txt")
+    with open(filename, "w") as data:
+        data.write(f"Peak: {peak}B\nCurrent: {current}B\n\nTop {MALLOC_TOP} allocations by line:\n")
+        for stat in snapshot.statistics("lineno")[:MALLOC_TOP]:
+            data.write(f"{stat}\n")
+        data.write(f"\nTop {MALLOC_TOP} allocations by traceback:\n")
+        for stat in snapshot.statistics("traceback")[:MALLOC_TOP]:
+            data.write(f"\n{stat}\n")
+            for line in stat.traceback.format():
+                data.write(f"{line}\n")
+    _log.info(f"Peak traced memory {peak / 1024 / 1024:.1f}MiB, allocations written to {filename}")
+
+
+@contextmanager
+def profile(cpu: bool = False, malloc: bool = False) -> Iterator[None]:
+    """Profile the block
+
+    Args:
+        cpu (bool): run the block under cProfile and a stack sampler, writes .pstats and .collapsed files
+        malloc (bool): trace the allocations with tracemalloc, writes the peak and top allocations to .malloc.txt
+    """
+    # NOTE: the profilers are imported on demand, Job.execute imports this module in every run
+    profiler: Optional["cProfile.Profile"] = None
+    sampler = StackSampler()
+    if malloc:
+        import tracemalloc
+
+        tracemalloc.start(MALLOC_FRAMES)
+    if cpu:
+        import cProfile
+
+        profiler = cProfile.Profile()
+        sampler.start()
+        profiler.enable()
+    try:
+        yield
+    finally:
+        if profiler is not None:
+            profiler.disable()
+            sampler.stop()
+        # NOTE: snapshot the allocations before the profile report allocates its own
+        if malloc:
+            _write_malloc()
+        if profiler is not None:
+            _write_profile(profiler, sampler)
+
+
+if __name__ == "__main__":
+    raise Exception("This library should not be run as a standalone script")
+else:
+    _log = get_logger("Main")
@@ -0,0 +1,260 @@
+#!/usr/bin/env python3
+
+# import argparse
+import logging
+import os
+
+# import subprocess
+# import sys
+# import re
+# import shutil
+import heapq
+import time
+
+from concurrent.futures import Future
+from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import FIRST_COMPLETED
+from concurrent.futures import wait
+
+from typing import Dict
+from typing import Optional
+from typing import List
+from typing import Sequence
+from typing import Tuple
+from typing import Callable
+from typing import Union
+
+# from typing import Any
+# from typing import cast
+
+from dataclasses import dataclass, field
+
+from .logger import get_logger
+from .shell import Job
+
+_log: logging.Logger
+# _SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+# _SCRIPTNAME = os.path.basename(__file__)
+# _log_file: Optional[str] = os.path.splitext(_SCRIPTNAME)[0] + ".log"
+# _verbose = False
+# _is_windows = os.name == 'nt'
+# _home = os.environ['USERPROFILE' if _is_windows else 'HOME']
+
+PENDING = "pending"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+SKIPPED = "skipped"
+
+
+@dataclass
+class Node(object):
+    """Job of the graph with its dependencies and execution settings"""
+
+    name: str
+    job: Union[Job, Callable[[], int]]
+    deps: Sequence[str] = ()
+    remote_host: Optional[str] = None
+    cwd: Optional[str] = None
+    timeout: Optional[float] = None
+    # Expected duration in seconds, used to weight the critical path
+    estimate: float = 1.0
+    status: str = field(init=False, default=PENDING)
+    priority: float = field(init=False, default=0.0)
+    start: float = field(init=False, default=0.0)
+    end: float = field(init=False, default=0.0)
+
+    @property
+    def duration(self) -> float:
+        return self.end - self.start if self.end else 0.0
+
+
+class Scheduler(object):
+    """Run a graph of Jobs with as much parallelism as the dependencies allow
+
+    Ready jobs with the longest remaining path to the end of the graph run first, failed jobs
+    skip every job that depends on them
+    """
+
+    def __init__(self, workers: Optional[int] = None, per_host: int = 4):
+        """Create an empty graph
+
+        Args:
+            workers (Optional[int]): max jobs running at the same time, defaults to the number of CPUs
+            per_host (int): max jobs running at the same time in each remote host
+        """
+        if workers is not None and workers < 1:
+            raise ValueError(f"workers must be at least 1, got {workers}")
+        if per_host < 1:
+            raise ValueError(f"per_host must be at least 1, got {per_host}")
+        self.workers = workers if workers is not None else (os.cpu_count() or 1)
+        self.per_host = per_host
+        self.nodes: Dict[str, Node] = {}
+        self._children: Dict[str, List[str]] = {}
+
+    def add(
+        self,
+        name: str,
+        job: Union[Job, Callable[[], int]],
+        deps: Sequence[str] = (),
+        remote_host: Optional[str] = None,
+        cwd: Optional[str] = None,
+        timeout: Optional[float] = None,
+        estimate: float = 1.0,
+    ) -> Node:
+        """Add a new job to the graph
+
+        Args:
+            name (str): unique name of the node
+            job (Union[Job, Callable[[], int]]): job to execute, or a function that returns an exit code.
+                Functions do not receive cwd, remote_host nor timeout, remote_host still counts for per_host
+            deps (Sequence[str]): names of the nodes that must succeed before this one runs
+            remote_host (Optional[str]): execute the job remotly using ssh
+            cwd (Optional[str]): path where the job is execute
+            timeout (Optional[float]): seconds to wait before killing the job
+            estimate (float): expected duration of the job in seconds
+
+        Returns:
+            The new node
+        """
+        if name in self.nodes:
+            raise Exception(f"Duplicated node {name}")
+        node = Node(name, job, tuple(deps), remote_host, cwd, timeout, estimate)
+        self.nodes[name] = node
+        return node
+
+    def _prepare(self) -> List[str]:
+        """Validate the graph and compute the critical path priorities
+
+        Returns:
+            Node names in topological order
+        """
+        self._children = {name: [] for name in self.nodes}
+        indegree = {name: len(node.deps) for name, node in self.nodes.items()}
+        for name, node in self.nodes.items():
+            for dep in node.deps:
+                if dep not in self.nodes:
+                    raise Exception(f"Node {name} depends on unknown node {dep}")
+                self._children[dep].append(name)
+
+        order = [name for name, degree in indegree.items() if degree == 0]
+        for name in order:
+            for child in self._children[name]:
+                indegree[child] -= 1
+                if indegree[child] == 0:
+                    order.append(child)
+
+        if len(order) != len(self.nodes):
+            cycle = sorted(name for name, degree in indegree.items() if degree > 0)
+            raise Exception(f"Dependency cycle between: {', '.join(cycle)}")
+
+        for name in reversed(order):
+            node = self.nodes[name]
+            node.priority = node.estimate + max((self.nodes[c].priority for c in self._children[name]), default=0.0)
+            node.status = PENDING
+            node.start = node.end = 0.0
+        return order
+
+    def _skip(self, name: str):
+        for child in self._children[name]:
+            node = self.nodes[child]
+            if node.status == PENDING:
+                node.status = SKIPPED
+                _log.warning(f"Skipping {child}, dependency {name} failed")
+                self._skip(child)
+
+    def _execute(self, node: Node) -> int:
+        node.start = time.monotonic()
+        try:
+            if isinstance(node.job, Job):
+                return node.job.execute(cwd=node.cwd, remote_host=node.remote_host, timeout=node.timeout)
+            return node.job()
+        finally:
+            node.end = time.monotonic()
+
+    def run(self, report: bool = True) -> bool:
+        """Execute the graph
+
+        Args:
+            report (bool): log the timings of every node once the graph finishes
+
+        Returns:
+            True if all jobs succeeded, False otherwise
+        """
+        self._prepare()
+        missing = {name: len(node.deps) for name, node in self.nodes.items()}
+        ready: List[Tuple[float, str]] = [(-node.priority, name) for name, node in self.nodes.items() if not node.deps]
+        heapq.heapify(ready)
+
+        host_load: Dict[str, int] = {}
+        running: Dict["Future[int]", Node] = {}
+        started = time.monotonic()
+
+        with ThreadPoolExecutor(max_workers=self.workers) as pool:
+            while ready or running:
+                blocked = []
+                while ready and len(running) < self.workers:
+                    item = heapq.heappop(ready)
+                    node = self.nodes[item[1]]
+                    host = node.remote_host
+                    if host is not None and host_load.get(host, 0) >= self.per_host:
+                        blocked.append(item)
+                        continue
+                    if host is not None:
+                        host_load[host] = host_load.get(host, 0) + 1
+                    node.status = RUNNING
+                    running[pool.submit(self._execute, node)] = node
+                for item in blocked:
+                    heapq.heappush(ready, item)
+
+                done, _ = wait(list(running), return_when=FIRST_COMPLETED)
+                for future in done:
+                    node = running.pop(future)
+                    if node.remote_host is not None:
+                        host_load[node.remote_host] -= 1
+
+                    try:
+                        rc = future.result()
+                    except Exception as e:
+                        _log.error(f"Node {node.name} raised {e.__class__.__name__}: {e}")
+                        rc = -1
+
+                    if rc != 0:
+                        node.status = FAILED
+                        _log.error(f"Node {node.name} failed with {rc}")
+                        self._skip(node.name)
+                        continue
+
+                    node.status = DONE
+                    _log.debug(f"Node {node.name} finished in {node.duration:.3f}s")
+                    for child in self._children[node.name]:
+                        missing[child] -= 1
+                        if missing[child] == 0 and self.nodes[child].status == PENDING:
+                            heapq.heappush(ready, (-self.nodes[child].priority, child))
+
+        _log.info(f"Graph finished in {time.monotonic() - started:.3f}s")
+        if report:
+            for line in self.report():
+                _log.info(line)
+        return all(node.status == DONE for node in self.nodes.values())
+
+    def report(self) -> List[str]:
+        """Per node timings of the last run
+
+        Returns:
+            List of lines with the status, start offset and duration of each node
+        """
+        nodes = sorted(self.nodes.values(), key=lambda n: (n.start == 0, n.start))
+        origin = min((n.start for n in nodes if n.start), default=0.0)
+        width = max((len(n.name) for n in nodes), default=0)
+        lines = []
+        for node in nodes:
+            offset = node.start - origin if node.start else 0.0
+            lines.append(f"{node.name:<{width}} | {node.status:<7} | +{offset:8.3f}s | {node.duration:8.3f}s")
+        return lines
+
+
+if __name__ == "__main__":
+    raise Exception("This library should not be run as a standalone script")
+else:
+    _log = get_logger("Main")
@@ -3,19 +3,29 @@
 # from datetime import datetime
 # import argparse
 import logging
-
-# import os
+import os
 import subprocess
-
-# import sys
+import sys
 import re
-import shutil
+
+# import shutil
+import selectors
+import signal
+import time
+
+from contextlib import nullcontext
+from functools import partial
 
 # from typing import Dict
 from typing import Optional
 from typing import List
 from typing import Sequence
+from typing import Dict
+from typing import Callable
+from typing import Tuple
 from typing import IO
+from typing import ContextManager
+from typing import TYPE_CHECKING
 
 # from typing import Any
 # from typing import Union
@@ -26,11 +36,29 @@ from dataclasses import dataclass, field
 # from pathlib import Path
 # from zipfile import ZipFile
 
+from .constants import CACHE_DIR
+from .constants import SAMPLE_ENV
+from .constants import SPAWN_SERVER_ENV
 from .logger import get_logger
 
+# NOTE: cache (sqlite3), spawn (pickle) and capabilities (json) are only needed by cacheable jobs, the spawn
+#       server and remote jobs, they are imported on demand to keep importing this module cheap
+if TYPE_CHECKING:
+    from .spawn import SpawnServer
+
 _warn_regex = re.compile(r"(<warn(ing)?>\s*:?|\[warn(ing)?\])", re.IGNORECASE)
 _error_regex = re.compile(r"(<(err(or)?|fail(ed)?)>\s*:?|\[(err(or)?|fail(ed)?)\])", re.IGNORECASE)
 
+# Minimum seconds between /proc/<pid>/io samples of a running job
+_IO_SAMPLE_INTERVAL = 0.1
+_POLL_INTERVAL = 0.05
+# Seconds a stopped job has to exit after SIGTERM before its process group gets SIGKILL
+_KILL_GRACE = 3.0
+
+# ssh executable and extra options used by remote jobs, CLI_SSH allows to replace ssh with a wrapper
+SSH = "ssh"
+SSH_OPTIONS: List[str] = []
+
 _log: logging.Logger
 # _SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
 # _SCRIPTNAME = os.path.basename(__file__)
@@ -40,15 +68,198 @@ _log: logging.Logger
 # _home = os.environ['USERPROFILE' if _is_windows else 'HOME']
 
 
+def _exit_code(status: int) -> int:
+    """Convert a raw wait status into a Popen style return code
+
+    Args:
+        status (int): status returned by os.wait* functions
+
+    Returns:
+        exit code of the process, negative signal number if it was killed
+    """
+    if os.WIFSIGNALED(status):
+        return -os.WTERMSIG(status)
+    return os.WEXITSTATUS(status)
+
+
+def _read_proc_io(pid: int) -> Optional[Dict[str, int]]:
+    """Read the I/O counters of a running process, only available in Linux
+
+    Args:
+        pid (int): process id to inspect
+
+    Returns:
+        Dict with the /proc/<pid>/io counters or None if they cannot be read
+    """
+    try:
+        with open(f"/proc/{pid}/io") as io:
+            counters = {}
+            for line in io:
+                key, value = line.split(":", 1)
+                counters[key] = int(value)
+            return counters
+    except (OSError, ValueError):
+        return None
+
+
+def _read_lines(
+    handlers: Dict[int, Callable[[str], None]],
+    deadline: Optional[float] = None,
+    stop: Optional[Callable[[], bool]] = None,
+    tick: Optional[Callable[[], None]] = None,
+) -> bool:
+    """Multiplex pipes sending each complete line to the handler of its file descriptor
+
+    Args:
+        handlers (Dict[int, Callable[[str], None]]): line handler of each file descriptor to read
+        deadline (Optional[float]): time.monotonic() limit to stop reading
+        stop (Optional[Callable[[], bool]]): stop reading as soon as this returns True
+        tick (Optional[Callable[[], None]]): called periodically while the pipes are open
+
+    Returns:
+        True if reading was interrupted before all pipes were closed, False otherwise
+    """
+    pending: Dict[int, bytes] = {fd: b"" for fd in handlers}
+
+    with selectors.DefaultSelector() as selector:
+        for fd in handlers:
+            selector.register(fd, selectors.EVENT_READ)
+
+        while selector.get_map():
+            for key, _ in selector.select(timeout=_POLL_INTERVAL):
+                fd = key.fd
+                data = os.read(fd, 65536)
+                if not data:
+                    selector.unregister(fd)
+                    if pending[fd]:
+                        handlers[fd](pending[fd].decode(errors="replace"))
+                    continue
+                *lines, pending[fd] = (pending[fd] + data).split(b"\n")
+                for line in lines:
+                    handlers[fd](line.decode(errors="replace"))
+
+            if tick is not None:
+                tick()
+            if deadline is not None and time.monotonic() >= deadline:
+                return True
+            if stop is not None and stop():
+                return True
+    return False
+
+
+def _killpg(pgid: int, signum: int) -> bool:
+    """Send a signal to a process group
+
+    Returns:
+        False if the group no longer exists, True otherwise
+    """
+    try:
+        os.killpg(pgid, signum)
+    except ProcessLookupError:
+        return False
+    return True
+
+
+def ssh_pool_options(persist: int = 60, control_dir: Optional[str] = None) -> List[str]:
+    """ssh options to reuse connections through multiplexing
+
+    The first job to a host opens a master connection that later jobs share, the master is kept
+    alive in the background for persist seconds after the last job finishes
+
+    Args:
+        persist (int): seconds to keep idle master connections open
+        control_dir (Optional[str]): directory of the control sockets, defaults to the user cache dir
+
+    Returns:
+        List of ssh options, see Job.ssh_options
+    """
+    control_dir = control_dir if control_dir is not None else os.path.join(CACHE_DIR, "ssh")
+    os.makedirs(control_dir, mode=0o700, exist_ok=True)
+    return [
+        "-o",
+        "ControlMaster=auto",
+        "-o",
+        f"ControlPath={os.path.join(control_dir, '%C')}",
+        "-o",
+        f"ControlPersist={persist}",
+    ]
+
+
+def enable_ssh_pool(persist: int = 60, control_dir: Optional[str] = None):
+    """Reuse ssh connections across all remote jobs of the process, see ssh_pool_options
+
+    Args:
+        persist (int): seconds to keep idle master connections open
+        control_dir (Optional[str]): directory of the control sockets, defaults to the user cache dir
+    """
+    SSH_OPTIONS[:] = ssh_pool_options(persist, control_dir)
+
+
+def _spawn_server() -> Optional["SpawnServer"]:
+    """Spawn server of the local jobs, spawn is only imported if CLI_SPAWN_SERVER is set or a server was started"""
+    if os.environ.get(SPAWN_SERVER_ENV) != "1" and f"{__package__}.spawn" not in sys.modules:
+        return None
+    from .spawn import get_spawn_server
+
+    return get_spawn_server()
+
+
+def _sampling() -> ContextManager[None]:
+    """Stack sampling of the running job, profiling is only imported if CLI_SAMPLE_INTERVAL is set"""
+    if not os.environ.get(SAMPLE_ENV):
+        return nullcontext()
+    from .profiling import sampling
+
+    return sampling()
+
+
+def ssh_executable() -> str:
+    """ssh executable of the remote jobs
+
+    CLI_SSH is read on every call, daemon requests run with the environment of their client
+
+    Returns:
+        CLI_SSH if set, SSH otherwise
+    """
+    return os.environ.get("CLI_SSH", SSH)
+
+
+def _split_cr(line: str) -> List[str]:
+    return [line] if not line.find("\r") else line.split("\r")
+
+
 @dataclass
 class Job(object):
     """docstring for Job"""
 
     cmd: Sequence[str]
+    # Idempotent commands may reuse the result of a previous execution with the same cmd, cwd,
+    # remote host, cache_env variables and cache_inputs file contents
+    cacheable: bool = False
+    cache_env: Sequence[str] = ()
+    cache_inputs: Sequence[str] = ()
+    # Prefix of the logged output lines, useful to tell apart jobs running concurrently
+    label: Optional[str] = None
+    # Options of the ssh call of remote executions, defaults to the process wide SSH_OPTIONS
+    ssh_options: Optional[Sequence[str]] = None
     stdout: List[str] = field(init=False, repr=False)
     stderr: List[str] = field(init=False, repr=False)
+    # 0 if the last execution was a cache hit
     pid: int = field(init=False)
     rc: int = field(init=False)
+    # Resource accounting of the last execution, CPU and memory usage come from the
+    # rusage of the child, I/O counters are sampled from /proc/<pid>/io while it runs
+    wall_time: float = field(init=False, default=0.0)
+    user_time: float = field(init=False, default=0.0)
+    sys_time: float = field(init=False, default=0.0)
+    max_rss: int = field(init=False, default=0)
+    read_bytes: int = field(init=False, default=0)
+    write_bytes: int = field(init=False, default=0)
+    timed_out: bool = field(init=False, default=False)
+    cancelled: bool = field(init=False, default=False)
+    cached: bool = field(init=False, default=False)
+    # Set by cancel(), kept until the end of the next/running execution so early cancels are not lost
+    _cancel_requested: bool = field(init=False, repr=False, default=False)
 
     # # NOTE: Needed it with python < 3.7
     # def __init__(self, cmd: Sequence[str]):
@@ -86,101 +297,536 @@ class Job(object):
             raise Exception("Size cannot be less than 0")
         return self.stdout[::-1][0:size]
 
+    def stats(self) -> Dict[str, float]:
+        """Resource usage of the last execution
+
+        Returns:
+            Dict with the wall/cpu times in seconds, peak RSS and I/O in bytes
+        """
+        return {
+            "wall_time": self.wall_time,
+            "user_time": self.user_time,
+            "sys_time": self.sys_time,
+            "max_rss": self.max_rss,
+            "read_bytes": self.read_bytes,
+            "write_bytes": self.write_bytes,
+        }
+
+    def _handle_stdout(self, stdout: str, background: bool):
+        if not stdout.strip():
+            return
+
+        msg = stdout if self.label is None else f"[{self.label}] {stdout}"
+        # TODO: to clarify info/warning/error messages may add another step to replace
+        #       the regex match with the process name
+        if _error_regex.search(stdout):
+            self.stderr += _split_cr(stdout)
+            _log.error(msg)
+            return
+
+        if _warn_regex.search(stdout):
+            _log.warning(msg)
+        elif background:
+            _log.debug(msg)
+        else:
+            _log.info(msg)
+        self.stdout += _split_cr(stdout)
+
+    def _handle_stderr(self, stderr: str, background: bool):
+        if not stderr.strip():
+            return
+        self.stderr += _split_cr(stderr)
+        _log.error(stderr if self.label is None else f"[{self.label}] {stderr}")
+
+    def _sample_io(self, pid: int):
+        counters = _read_proc_io(pid)
+        if counters is not None:
+            self.read_bytes = counters.get("read_bytes", self.read_bytes)
+            self.write_bytes = counters.get("write_bytes", self.write_bytes)
+
+    def _reap(self, process: subprocess.Popen, block: bool) -> bool:
+        """Reap the process collecting its rusage
+
+        Args:
+            process (subprocess.Popen): process to reap
+            block (bool): wait until the process exits
+
+        Returns:
+            True if the process was reaped, its return code is stored in process.returncode
+        """
+        if process.returncode is not None:
+            return True
+        if not hasattr(os, "wait4"):
+            if block:
+                process.wait()
+            return process.poll() is not None
+
+        # Last sample before reaping, zombies still expose their final counters
+        self._sample_io(process.pid)
+        try:
+            pid, status, rusage = os.wait4(process.pid, 0 if block else os.WNOHANG)
+        except ChildProcessError:
+            process.wait()
+            return True
+        if pid == 0:
+            return False
+
+        process.returncode = _exit_code(status)
+        self.user_time = rusage.ru_utime
+        self.sys_time = rusage.ru_stime
+        # NOTE: Linux reports ru_maxrss in KiB, macOS in bytes
+        self.max_rss = rusage.ru_maxrss if sys.platform == "darwin" else rusage.ru_maxrss * 1024
+        return True
+
+    def _wait(self, process: subprocess.Popen) -> int:
+        """Block until the process exits
+
+        Args:
+            process (subprocess.Popen): finished or finishing process
+
+        Returns:
+            Return-code integer of the process
+        """
+        self._reap(process, True)
+        return cast(int, process.returncode)
+
+    def _exited(
+        self,
+        process: subprocess.Popen,
+        deadline: Optional[float],
+        stop: Optional[Callable[[], bool]] = None,
+    ) -> bool:
+        """Wait for the process to exit without blocking past the deadline
+
+        Args:
+            process (subprocess.Popen): process to wait for
+            deadline (Optional[float]): time.monotonic() limit to stop waiting
+            stop (Optional[Callable[[], bool]]): stop waiting as soon as this returns True
+
+        Returns:
+            True if the process exited and was reaped, False if the deadline expired or stop returned True
+        """
+        delay = 0.001
+        while not self._reap(process, False):
+            if (deadline is not None and time.monotonic() >= deadline) or (stop is not None and stop()):
+                return False
+            time.sleep(delay)
+            delay = min(delay * 2, _POLL_INTERVAL)
+        return True
+
+    def cancel(self):
+        """Stop the running cmd, can be called from any thread
+
+        The whole process group receives SIGTERM followed by SIGKILL if it does not exit in time,
+        the output read so far is kept. A cancel that arrives before execute starts stops that execution
+        as soon as its cmd is launched, cancelled tells if the last execution was stopped by a cancel
+        """
+        _log.debug(f"Cancelling job: {self.cmd}")
+        self._cancel_requested = True
+
+    def _stream(
+        self,
+        process: subprocess.Popen,
+        background: bool,
+        deadline: Optional[float] = None,
+        cancellable: bool = True,
+    ) -> bool:
+        """Read stdout/stderr line by line until both pipes are closed
+
+        Args:
+            process (subprocess.Popen): running process with piped stdout and stderr
+            background (bool): log stdout as debug instead of info messages
+            deadline (Optional[float]): time.monotonic() limit to stop reading
+            cancellable (bool): stop reading as soon as the job is cancelled
+
+        Returns:
+            True if the deadline expired or the job was cancelled before the pipes were closed
+        """
+        if os.name == "nt":
+            # NOTE: Windows pipes cannot be multiplexed with select
+            try:
+                timeout = None if deadline is None else max(deadline - time.monotonic(), 0)
+                stdout, stderr = process.communicate(timeout=timeout)
+            except subprocess.TimeoutExpired:
+                return True
+            for line in stdout.decode(errors="replace").splitlines():
+                self._handle_stdout(line, background)
+            for line in stderr.decode(errors="replace").splitlines():
+                self._handle_stderr(line, background)
+            return False
+
+        last_sample = [0.0]
+
+        def sample():
+            now = time.monotonic()
+            if now - last_sample[0] >= _IO_SAMPLE_INTERVAL:
+                self._sample_io(process.pid)
+                last_sample[0] = now
+
+        handlers: Dict[int, Callable[[str], None]] = {
+            cast(IO[bytes], process.stdout).fileno(): lambda line: self._handle_stdout(line, background),
+            cast(IO[bytes], process.stderr).fileno(): lambda line: self._handle_stderr(line, background),
+        }
+        return _read_lines(handlers, deadline, (lambda: self._cancel_requested) if cancellable else None, sample)
+
+    def _terminate(self, process: subprocess.Popen, background: bool):
+        """Escalate SIGTERM to SIGKILL across the process group of the job
+
+        Args:
+            process (subprocess.Popen): session leader of the group to stop
+            background (bool): log stdout as debug instead of info messages
+        """
+        if os.name == "nt":
+            process.kill()
+            return
+
+        if not _killpg(process.pid, signal.SIGTERM):
+            return
+
+        # Pipes are closed once every process of the group exits, keep the output written meanwhile
+        grace = time.monotonic() + _KILL_GRACE
+        if self._stream(process, background, grace, cancellable=False) or not self._exited(process, grace):
+            _log.debug(f"Job {process.pid} ignored SIGTERM, sending SIGKILL")
+
+        _killpg(process.pid, signal.SIGKILL)
+
+    def _interrupted(self, timeout: Optional[float]):
+        if self._cancel_requested:
+            self.cancelled = True
+            _log.warning(f"Command cancelled, killing {self.pid}")
+        else:
+            self.timed_out = True
+            _log.error(f"Command timed out after {timeout}s, killing {self.pid}")
+
+    def _popen(
+        self,
+        cmd: Sequence[str],
+        cwd: str,
+        background: bool,
+        deadline: Optional[float],
+        timeout: Optional[float],
+    ):
+        process = subprocess.Popen(
+            cmd,
+            # shell=True,
+            # text=True,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+            # stdin=subprocess.PIPE,
+            cwd=cwd,
+            # bufsize=0,
+            # Own process group so timeouts and cancellation reach the grandchildren too
+            start_new_session=os.name != "nt",
+        )
+
+        self.pid = process.pid
+
+        # NOTE: children may close or redirect their pipes and keep running, the deadline applies until they exit
+        if self._stream(process, background, deadline) or not self._exited(
+            process, deadline, lambda: self._cancel_requested
+        ):
+            self._interrupted(timeout)
+            self._terminate(process, background)
+        self.rc = self._wait(process)
+        cast(IO[bytes], process.stdout).close()
+        cast(IO[bytes], process.stderr).close()
+
+    def _spawn(
+        self,
+        server: "SpawnServer",
+        cmd: Sequence[str],
+        cwd: str,
+        background: bool,
+        deadline: Optional[float],
+        timeout: Optional[float],
+    ):
+        last_sample = [0.0]
+
+        def on_start(pid: int):
+            self.pid = pid
+
+        def stop() -> bool:
+            now = time.monotonic()
+            if now - last_sample[0] >= _IO_SAMPLE_INTERVAL:
+                self._sample_io(self.pid)
+                last_sample[0] = now
+            return self._cancel_requested
+
+        result = server.run(
+            cmd,
+            cwd,
+            on_stdout=lambda line: self._handle_stdout(line, background),
+            on_stderr=lambda line: self._handle_stderr(line, background),
+            on_start=on_start,
+            deadline=deadline,
+            stop=stop,
+            grace=_KILL_GRACE,
+        )
+        if result.interrupted:
+            self._interrupted(timeout)
+        self.rc = _exit_code(result.status)
+        self.user_time = result.user_time
+        self.sys_time = result.sys_time
+        self.max_rss = result.max_rss if sys.platform == "darwin" else result.max_rss * 1024
+
+    def _build_cmd(
+        self,
+        cwd: Optional[str] = None,
+        remote_host: Optional[str] = None,
+        tty: bool = True,
+    ) -> Tuple[Sequence[str], str]:
+        """Build the local command line of the job
+
+        Args:
+            cwd (Optional[str]): path where the cmd is execute, default to CWD
+            remote_host (Optional[str]): wrap the cmd in a ssh call to this host
+            tty (bool): force a remote terminal, must be disabled to pipe data through ssh
+
+        Returns:
+            Tuple with the local command line and the local working directory
+        """
+        if remote_host is None:
+            return self.cmd, "." if cwd is None else cwd
+
+        from .capabilities import which
+
+        ssh = ssh_executable()
+        if which(ssh) is None:
+            raise Exception("Cannot execute the remote command, missing ssh executable")
+
+        cwd = "$HOME" if cwd is None else cwd
+        # Verbose always overrides background output
+
+        cmd = [ssh] + list(SSH_OPTIONS if self.ssh_options is None else self.ssh_options)
+        # if sshkey is not None:
+        #     cmd += ["-i", sshkey]
+        cmd += ["-t" if tty else "-T", remote_host]
+        original_cmd = f"cd {cwd} ; {' '.join(self.cmd)}"
+        # original_cmd = f"{' '.join(self.cmd)}"
+        cmd += [f"{original_cmd}"]
+        return cmd, "."
+
     def execute(
         self,
         background: bool = True,
         cwd: Optional[str] = None,
         remote_host: Optional[str] = None,
         # sshkey: Optional[str] = None,
+        timeout: Optional[float] = None,
     ) -> int:
         """Execute the cmd
 
         Args:
             background (bool): execute as async process
             cwd (Optional[str]): path where the cmd is execute, default to CWD
-            remote_host (Optional[str]): execute the command remotly using ssh
+            remote_host (Optional[str]): execute the command remotly using ssh,
+                                         resource accounting measures the local ssh process
+            timeout (Optional[float]): seconds to wait before killing the cmd and all its children
+
+        Local commands are launched through the spawn server if one is running, see libs.spawn.
+        Set CLI_SAMPLE_INTERVAL to sample the python stacks while the job runs, see libs.profiling
 
         Returns:
             Return-code integer of the cmd
         """
+        try:
+            return self._execute(background, cwd, remote_host, timeout)
+        finally:
+            self._cancel_requested = False
 
-        if remote_host is not None and shutil.which("ssh") is None:
-            raise Exception("Cannot execute the remote command, missing ssh executable")
+    def _execute(
+        self,
+        background: bool,
+        cwd: Optional[str],
+        remote_host: Optional[str],
+        timeout: Optional[float],
+    ) -> int:
+        # NOTE: reset every result of the previous execution, cache hits do not run anything
+        self.pid = 0
+        self.stdout = []
+        self.stderr = []
+        self.timed_out = self.cancelled = self.cached = False
+        self.wall_time = self.user_time = self.sys_time = 0.0
+        self.max_rss = self.read_bytes = self.write_bytes = 0
 
-        cmd: Sequence[str]
-        if remote_host is not None:
-            cwd = "$HOME" if cwd is None else cwd
-            # Verbose always overrides background output
-
-            cmd = ["ssh"]
-            # if sshkey is not None:
-            #     cmd += ["-i", sshkey]
-            cmd += ["-t", remote_host]
-            original_cmd = f"cd {cwd} ; {' '.join(self.cmd)}"
-            # original_cmd = f"{' '.join(self.cmd)}"
-            cmd += [f"{original_cmd}"]
-        else:
-            cmd = self.cmd
-            cwd = "." if cwd is None else cwd
+        cache_key: Optional[str] = None
+        if self.cacheable:
+            from .cache import get_job_cache
+
+            cache_key = get_job_cache().key(self.cmd, cwd, remote_host, self.cache_env, self.cache_inputs)
+            result = get_job_cache().get(cache_key)
+            if result is not None:
+                self.rc, self.stdout, self.stderr = result
+                self.cached = True
+                _log.debug(f"Using cached result of {self.cmd}")
+                return self.rc
+
+        cmd, cwd = self._build_cmd(cwd, remote_host)
 
         _log.debug(f"Executing cmd: {cmd}" + "" if not remote_host else f" {remote_host}")
         _log.debug("Sending job to background" if background else "Running in foreground")
 
-        self.stdout = []
-        self.stderr = []
-
-        process = subprocess.Popen(
-            cmd,
-            # shell=True,
-            # text=True,
-            stdout=subprocess.PIPE,
-            stderr=subprocess.PIPE,
-            # stdin=subprocess.PIPE,
-            cwd=cwd if remote_host is None else ".",
-            # bufsize=0,
+        start = time.monotonic()
+        deadline = None if timeout is None else start + timeout
+        server = _spawn_server() if remote_host is None else None
+        with _sampling():
+            if server is not None and remote_host is None:
+                self._spawn(server, cmd, cwd, background, deadline, timeout)
+            else:
+                self._popen(cmd, cwd, background, deadline, timeout)
+        self.wall_time = time.monotonic() - start
+
+        _log.debug(
+            f"Job {self.pid} stats: wall {self.wall_time:.3f}s, user {self.user_time:.3f}s, "
+            f"sys {self.sys_time:.3f}s, rss {self.max_rss}B, read {self.read_bytes}B, write {self.write_bytes}B"
         )
 
-        self.pid = process.pid
+        # NOTE: Do not cache interrupted jobs or failed ssh connections
+        stopped = self.timed_out or self.cancelled or (remote_host is not None and self.rc == 255)
+        if cache_key is not None and not stopped:
+            from .cache import get_job_cache
+
+            get_job_cache().put(cache_key, self.rc, self.stdout, self.stderr)
 
-        # TODO: Add timeout kill
-        while process.poll() is None:
-            stdout = cast(IO[bytes], process.stdout).readline().decode().replace("\n", "")
-            stderr = cast(IO[bytes], process.stderr).readline().decode().replace("\n", "")
-
-            if stdout.strip():
-                # TODO: to clarify info/warning/error messages may add another step to replace
-                #       the regex match with the process name
-                if _error_regex.search(stdout):
-                    if not stdout.find("\r"):
-                        self.stderr.append(stdout)
-                    else:
-                        self.stderr += stdout.split("\r")
-
-                    _log.error(stdout)
-                else:
-                    if _warn_regex.search(stdout):
-                        _log.warning(stdout)
-                    elif background:
-                        _log.debug(stdout)
-                    else:
-                        _log.info(stdout)
-
-                    if not stdout.find("\r"):
-                        self.stdout.append(stdout)
-                    else:
-                        self.stdout += stdout.split("\r")
-
-            if stderr.strip():
-                if not stderr.find("\r"):
-                    self.stderr.append(stderr)
-                else:
-                    self.stderr += stderr.split("\r")
-                _log.error(stderr)
-
-        self.rc = process.returncode
+        if self.rc != 0:
+            _log.error(("" if self.label is None else f"[{self.label}] ") + f"Command exited with {self.rc}")
+
+        return self.rc
+
+
+@dataclass
+class Pipe(object):
+    """Chain of jobs connected by OS pipes, like cmd1 | cmd2 | cmd3
+
+    Data flows between the processes without passing through python, only the stdout of the last
+    job and the stderr of every job are captured in their Job objects. Stages may run in different
+    remote hosts, each one is wrapped in its own ssh call
+    """
+
+    jobs: Sequence[Job]
+    remote_hosts: Sequence[Optional[str]] = ()
+    # Use the rightmost non-zero return code instead of the last one, like bash's pipefail
+    pipefail: bool = False
+    rc: int = field(init=False)
+    timed_out: bool = field(init=False, default=False)
+    cancelled: bool = field(init=False, default=False)
+    # Same semantics as Job._cancel_requested
+    _cancel_requested: bool = field(init=False, repr=False, default=False)
+
+    @property
+    def stdout(self) -> List[str]:
+        return self.jobs[-1].stdout
+
+    @property
+    def rcs(self) -> List[int]:
+        return [job.rc for job in self.jobs]
+
+    def cancel(self):
+        """Stop all the running jobs, can be called from any thread
+
+        Like Job.cancel, a cancel that arrives before execute starts stops that execution
+        """
+        self._cancel_requested = True
+
+    def _spawn(self, cwd: Optional[str]) -> List[subprocess.Popen]:
+        hosts = list(self.remote_hosts) + [None] * (len(self.jobs) - len(self.remote_hosts))
+        processes: List[subprocess.Popen] = []
+        stdin: Optional[IO[bytes]] = None
+        try:
+            for i, (job, host) in enumerate(zip(self.jobs, hosts)):
+                cmd, local_cwd = job._build_cmd(cwd, host, tty=False)
+                _log.debug(f"Executing pipe stage {i}: {cmd}" + ("" if host is None else f" {host}"))
+                job.stdout = []
+                job.stderr = []
+                job.timed_out = job.cancelled = job.cached = False
+                process = subprocess.Popen(
+                    cmd,
+                    stdin=stdin,
+                    stdout=subprocess.PIPE,
+                    stderr=subprocess.PIPE,
+                    cwd=local_cwd,
+                    start_new_session=os.name != "nt",
+                )
+                # The child holds its own copy, closing ours lets writers get SIGPIPE when readers exit
+                if stdin is not None:
+                    stdin.close()
+                stdin = process.stdout
+                job.pid = process.pid
+                processes.append(process)
+        except Exception:
+            for process in processes:
+                process.kill()
+            raise
+        return processes
+
+    def _terminate(self, processes: List[subprocess.Popen], handlers: Dict[int, Callable[[str], None]]):
+        for process in processes:
+            if os.name == "nt":
+                process.kill()
+            else:
+                _killpg(process.pid, signal.SIGTERM)
+        if os.name != "nt":
+            _read_lines(handlers, time.monotonic() + _KILL_GRACE)
+            for process in processes:
+                _killpg(process.pid, signal.SIGKILL)
+
+    def execute(self, background: bool = True, cwd: Optional[str] = None, timeout: Optional[float] = None) -> int:
+        """Execute all jobs connected by pipes
+
+        Args:
+            background (bool): log stdout as debug instead of info messages
+            cwd (Optional[str]): path where the jobs are execute, default to CWD
+            timeout (Optional[float]): seconds to wait before killing all jobs
+
+        Returns:
+            Return-code integer of the pipe
+        """
+        try:
+            return self._execute(background, cwd, timeout)
+        finally:
+            self._cancel_requested = False
+
+    def _execute(self, background: bool, cwd: Optional[str], timeout: Optional[float]) -> int:
+        if not self.jobs:
+            raise Exception("Cannot execute an empty pipe")
+        if os.name == "nt":
+            raise Exception("Pipes are only supported in POSIX systems")
+
+        self.timed_out = self.cancelled = False
+        start = time.monotonic()
+        processes = self._spawn(cwd)
+
+        last = self.jobs[-1]
+        handlers: Dict[int, Callable[[str], None]] = {
+            cast(IO[bytes], processes[-1].stdout).fileno(): lambda line: last._handle_stdout(line, background)
+        }
+        for job, process in zip(self.jobs, processes):
+            handlers[cast(IO[bytes], process.stderr).fileno()] = partial(job._handle_stderr, background=background)
+
+        deadline = None if timeout is None else start + timeout
+        if _read_lines(handlers, deadline, lambda: self._cancel_requested):
+            if self._cancel_requested:
+                self.cancelled = True
+                _log.warning("Pipe cancelled, killing all jobs")
+            else:
+                self.timed_out = True
+                _log.error(f"Pipe timed out after {timeout}s, killing all jobs")
+            self._terminate(processes, handlers)
+
+        for job, process in zip(self.jobs, processes):
+            job.rc = job._wait(process)
+            job.wall_time = time.monotonic() - start
+            job.timed_out = self.timed_out
+            job.cancelled = self.cancelled
+            cast(IO[bytes], process.stdout).close()
+            cast(IO[bytes], process.stderr).close()
+
+        self.rc = last.rc
+        if self.pipefail:
+            self.rc = next((rc for rc in reversed(self.rcs) if rc != 0), 0)
 
         if self.rc != 0:
-            _log.error(f"Command exited with {self.rc}")
+            _log.error(f"Pipe exited with {self.rc}, stages returned {self.rcs}")
 
         return self.rc
 
@@ -0,0 +1,435 @@
+#!/usr/bin/env python3
+
+# import argparse
+import logging
+import os
+
+# import subprocess
+# import sys
+# import re
+# import shutil
+import itertools
+import pickle
+import queue
+import select
+import signal
+import struct
+import threading
+import time
+
+from typing import Dict
+from typing import Optional
+
+# from typing import List
+from typing import Sequence
+from typing import Callable
+from typing import Any
+from typing import Tuple
+
+# from typing import Union
+from typing import cast
+
+from dataclasses import dataclass
+
+from .constants import SPAWN_SERVER_ENV
+from .logger import get_logger
+
+_log: logging.Logger
+# _SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+# _SCRIPTNAME = os.path.basename(__file__)
+# _log_file: Optional[str] = os.path.splitext(_SCRIPTNAME)[0] + ".log"
+# _verbose = False
+# _is_windows = os.name == 'nt'
+# _home = os.environ['USERPROFILE' if _is_windows else 'HOME']
+
+_HEADER = struct.Struct(">I")
+_POLL_INTERVAL = 0.05
+
+_default_server: Optional["SpawnServer"] = None
+# Jobs run from several threads, only the first one may start the default server
+_default_server_lock = threading.Lock()
+
+
+@dataclass
+class SpawnResult(object):
+    """Exit status and resource usage of a child launched by the spawn server"""
+
+    pid: int
+    status: int
+    user_time: float
+    sys_time: float
+    max_rss: int
+    interrupted: bool
+
+
+def _send(fd: int, message: Tuple[Any, ...]):
+    payload = pickle.dumps(message, protocol=pickle.HIGHEST_PROTOCOL)
+    data = _HEADER.pack(len(payload)) + payload
+    while data:
+        data = data[os.write(fd, data) :]
+
+
+def _recv_exact(fd: int, size: int) -> Optional[bytes]:
+    data = b""
+    while len(data) < size:
+        chunk = os.read(fd, size - len(data))
+        if not chunk:
+            return None
+        data += chunk
+    return data
+
+
+def _recv(fd: int) -> Optional[Tuple[Any, ...]]:
+    header = _recv_exact(fd, _HEADER.size)
+    if header is None:
+        return None
+    payload = _recv_exact(fd, _HEADER.unpack(header)[0])
+    if payload is None:
+        return None
+    return cast(Tuple[Any, ...], pickle.loads(payload))
+
+
+def _launch(cmd: Sequence[str], cwd: str, env: Dict[str, str], stdout: int, stderr: int) -> int:
+    """Launch a child in its own session with its stdout/stderr redirected
+
+    Uses posix_spawn when available, the server heap is small so fork + exec is cheap otherwise
+    """
+    if hasattr(os, "posix_spawnp"):
+        actions = [(os.POSIX_SPAWN_DUP2, stdout, 1), (os.POSIX_SPAWN_DUP2, stderr, 2)]
+        # NOTE: posix_spawn cannot change the cwd, the server is single threaded so chdir is safe
+        previous = os.getcwd()
+        os.chdir(cwd)
+        try:
+            return os.posix_spawnp(
+                cmd[0], list(cmd), env, file_actions=actions, setsid=True, setsigdef=(signal.SIGINT,)
+            )
+        finally:
+            os.chdir(previous)
+
+    pid = os.fork()
+    if pid == 0:
+        try:
+            signal.signal(signal.SIGINT, signal.SIG_DFL)
+            os.setsid()
+            os.chdir(cwd)
+            os.dup2(stdout, 1)
+            os.dup2(stderr, 2)
+            os.execvpe(cmd[0], list(cmd), env)
+        finally:
+            os._exit(127)
+    return pid
+
+
+@dataclass
+class _Child(object):
+    """Child of a request being served"""
+
+    pid: int
+    # Pipes of the child still open, the exit is reported once both are closed and the child is reaped
+    streams: int = 2
+    # Raw wait status, user time, sys time and max rss once reaped
+    status: Optional[Tuple[int, float, float, int]] = None
+
+
+class _Server(object):
+    """Single threaded loop multiplexing the output and exit of every child in flight"""
+
+    def __init__(self, requests: int, responses: int):
+        self.requests = requests
+        self.responses = responses
+        self.children: Dict[int, _Child] = {}
+        # fd -> (request id, out|err)
+        self.streams: Dict[int, Tuple[int, str]] = {}
+
+    def spawn(self, rid: int, cmd: Sequence[str], cwd: str, env: Dict[str, str]):
+        out_r, out_w = os.pipe()
+        err_r, err_w = os.pipe()
+        try:
+            pid = _launch(cmd, cwd, env, out_w, err_w)
+        except OSError as e:
+            os.close(out_r)
+            os.close(err_r)
+            _send(self.responses, ("error", rid, e.errno, e.strerror, e.filename))
+            return
+        finally:
+            # The child holds its own copies, ours must be closed to get EOF once it exits
+            os.close(out_w)
+            os.close(err_w)
+
+        self.children[rid] = _Child(pid)
+        self.streams[out_r] = (rid, "out")
+        self.streams[err_r] = (rid, "err")
+        _send(self.responses, ("started", rid, pid))
+
+    def kill(self, rid: int, signum: int):
+        # NOTE: children that already reported their exit are gone, their pid may be reused
+        child = self.children.get(rid)
+        if child is None:
+            return
+        try:
+            os.killpg(child.pid, signum)
+        except ProcessLookupError:
+            pass
+
+    def read(self, fd: int):
+        rid, kind = self.streams[fd]
+        data = os.read(fd, 65536)
+        if data:
+            _send(self.responses, (kind, rid, data))
+            return
+        os.close(fd)
+        del self.streams[fd]
+        self.children[rid].streams -= 1
+
+    def reap(self):
+        for rid, child in list(self.children.items()):
+            if child.status is None:
+                try:
+                    pid, status, rusage = os.wait4(child.pid, os.WNOHANG)
+                except ChildProcessError:
+                    pid, status, rusage = child.pid, 0, None
+                if pid != 0:
+                    child.status = (status, 0.0, 0.0, 0)
+                    if rusage is not None:
+                        child.status = (status, rusage.ru_utime, rusage.ru_stime, rusage.ru_maxrss)
+            # The child may exit before its output is read, or its grandchildren may keep the pipes open
+            if child.status is not None and child.streams == 0:
+                _send(self.responses, ("exit", rid) + child.status)
+                del self.children[rid]
+
+    def shutdown(self):
+        # Parent is gone, do not leave orphans behind
+        for rid in list(self.children):
+            self.kill(rid, signal.SIGKILL)
+        os._exit(0)
+
+
+def _serve(requests: int, responses: int):
+    """Main loop of the spawn server, children are launched and reaped concurrently"""
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+    # SIGCHLD wakes up select through this pipe, children are reaped as soon as they exit
+    wakeup_r, wakeup_w = os.pipe()
+    os.set_blocking(wakeup_r, False)
+    os.set_blocking(wakeup_w, False)
+    signal.set_wakeup_fd(wakeup_w)
+    signal.signal(signal.SIGCHLD, lambda signum, frame: None)
+
+    server = _Server(requests, responses)
+    while True:
+        readable, _, _ = select.select([requests, wakeup_r] + list(server.streams), [], [])
+        for fd in readable:
+            if fd == requests:
+                message = _recv(requests)
+                if message is None:
+                    server.shutdown()
+                elif message[0] == "spawn":
+                    server.spawn(*message[1:])
+                elif message[0] == "kill":
+                    server.kill(*message[1:])
+            elif fd == wakeup_r:
+                try:
+                    while os.read(wakeup_r, 512):
+                        pass
+                except BlockingIOError:
+                    pass
+            else:
+                server.read(fd)
+        server.reap()
+
+
+class SpawnServer(object):
+    """Helper process that launches children on behalf of the main interpreter
+
+    The helper is forked when created, so it should be started early while the heap of the
+    main interpreter is still small and before any thread is created. Launching from the
+    helper avoids copying the page tables of a large parent on every fork. Requests from
+    many threads are served concurrently, the helper multiplexes the children in a select
+    loop and a reader thread routes its messages back to each request
+    """
+
+    def __init__(self):
+        if os.name == "nt":
+            raise Exception("Spawn server is only supported in POSIX systems")
+
+        req_r, req_w = os.pipe()
+        resp_r, resp_w = os.pipe()
+        self.pid = os.fork()
+        if self.pid == 0:
+            os.close(req_w)
+            os.close(resp_r)
+            try:
+                _serve(req_r, resp_w)
+            finally:
+                os._exit(0)
+
+        os.close(req_r)
+        os.close(resp_w)
+        self._requests = req_w
+        self._responses = resp_r
+        # NOTE: separate locks, the reader must route responses while a request is being written
+        self._send_lock = threading.Lock()
+        self._channels_lock = threading.Lock()
+        self._channels: Dict[int, "queue.Queue[Optional[Tuple[Any, ...]]]"] = {}
+        self._ids = itertools.count(1)
+        self._dead = False
+        self._reader = threading.Thread(target=self._read, name="SpawnReader", daemon=True)
+        self._reader.start()
+        _log.debug(f"Started spawn server {self.pid}")
+
+    def _read(self):
+        """Route the server messages to the channel of their request"""
+        while True:
+            message = _recv(self._responses)
+            if message is None:
+                break
+            with self._channels_lock:
+                channel = self._channels.get(message[1])
+            if channel is not None:
+                channel.put(message)
+
+        os.close(self._responses)
+        with self._channels_lock:
+            self._dead = True
+            for channel in self._channels.values():
+                channel.put(None)
+
+    def _send(self, message: Tuple[Any, ...]):
+        with self._send_lock:
+            _send(self._requests, message)
+
+    def run(
+        self,
+        cmd: Sequence[str],
+        cwd: str = ".",
+        on_stdout: Optional[Callable[[str], None]] = None,
+        on_stderr: Optional[Callable[[str], None]] = None,
+        on_start: Optional[Callable[[int], None]] = None,
+        deadline: Optional[float] = None,
+        stop: Optional[Callable[[], bool]] = None,
+        grace: float = 3.0,
+    ) -> SpawnResult:
+        """Launch a cmd through the server and stream its output, can be called from any thread
+
+        Args:
+            cmd (Sequence[str]): command with its arguments
+            cwd (str): path where the cmd is execute
+            on_stdout (Optional[Callable[[str], None]]): handler of each stdout line
+            on_stderr (Optional[Callable[[str], None]]): handler of each stderr line
+            on_start (Optional[Callable[[int], None]]): called with the pid of the child
+            deadline (Optional[float]): time.monotonic() limit before killing the child
+            stop (Optional[Callable[[], bool]]): kill the child as soon as this returns True
+            grace (float): seconds between SIGTERM and SIGKILL
+
+        Returns:
+            SpawnResult with the exit status and rusage of the child
+        """
+        handlers = {"out": on_stdout, "err": on_stderr}
+        pending = {"out": b"", "err": b""}
+
+        def emit(kind: str, lines: Sequence[bytes]):
+            handler = handlers[kind]
+            if handler is not None:
+                for line in lines:
+                    handler(line.decode(errors="replace"))
+
+        rid = next(self._ids)
+        channel: "queue.Queue[Optional[Tuple[Any, ...]]]" = queue.Queue()
+        with self._channels_lock:
+            if self._dead:
+                raise Exception("Spawn server died")
+            self._channels[rid] = channel
+        try:
+            self._send(("spawn", rid, list(cmd), os.path.abspath(cwd), dict(os.environ)))
+            pid = 0
+            interrupted = False
+            kill_at: Optional[float] = None
+            while True:
+                try:
+                    message = channel.get(timeout=_POLL_INTERVAL)
+                except queue.Empty:
+                    pass
+                else:
+                    if message is None:
+                        raise Exception("Spawn server died")
+                    kind = message[0]
+                    if kind == "error":
+                        raise OSError(message[2], message[3], message[4])
+                    if kind == "started":
+                        pid = message[2]
+                        if on_start is not None:
+                            on_start(pid)
+                    elif kind == "exit":
+                        break
+                    else:
+                        *lines, pending[kind] = (pending[kind] + message[2]).split(b"\n")
+                        emit(kind, lines)
+
+                # NOTE: the server honors kills until the child is reaped, even after its pipes are closed
+                now = time.monotonic()
+                expired = (deadline is not None and now >= deadline) or (stop is not None and stop())
+                if not interrupted and expired:
+                    interrupted = True
+                    kill_at = now + grace
+                    self._send(("kill", rid, signal.SIGTERM))
+                elif kill_at is not None and now >= kill_at:
+                    kill_at = None
+                    self._send(("kill", rid, signal.SIGKILL))
+        finally:
+            with self._channels_lock:
+                del self._channels[rid]
+
+        for kind, rest in pending.items():
+            if rest:
+                emit(kind, [rest])
+
+        return SpawnResult(pid, message[2], message[3], message[4], message[5], interrupted)
+
+    def close(self):
+        """Stop the server process, its running children are killed"""
+        with self._send_lock:
+            os.close(self._requests)
+        self._reader.join()
+        os.waitpid(self.pid, 0)
+        _log.debug(f"Stopped spawn server {self.pid}")
+
+
+def start_spawn_server() -> SpawnServer:
+    """Start the default spawn server used by Job.execute
+
+    Call it early, before the process starts threads or grows, so the server is forked from a small process
+
+    Returns:
+        The running server
+    """
+    global _default_server
+    with _default_server_lock:
+        if _default_server is None:
+            _default_server = SpawnServer()
+        return _default_server
+
+
+def stop_spawn_server():
+    """Stop the default spawn server, jobs go back to use subprocess directly"""
+    global _default_server
+    with _default_server_lock:
+        if _default_server is not None:
+            _default_server.close()
+            _default_server = None
+
+
+def get_spawn_server() -> Optional[SpawnServer]:
+    """Get the default spawn server, CLI_SPAWN_SERVER=1 starts it on first use if it was not started already
+
+    Returns:
+        The running server or None if jobs should use subprocess directly
+    """
+    if _default_server is None and os.environ.get(SPAWN_SERVER_ENV) == "1" and os.name != "nt":
+        return start_spawn_server()
+    return _default_server
+
+
+if __name__ == "__main__":
+    raise Exception("This library should not be run as a standalone script")
+else:
+    _log = get_logger("Main")
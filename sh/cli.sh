@@ -26,27 +26,34 @@ NOCOLOR=0
 NOLOG=0
 WARN_COUNT=0
 ERR_COUNT=0
+JOBS=''
+JOB_COUNT=0
+JOB_FAIL_COUNT=0
 # FROM_STDIN=()
 
 NAME="$0"
 NAME="${NAME##*/}"
 LOG="${NAME%%.*}.log"
+LOG_FD=''
 
-SCRIPT_PATH="$0"
-
-SCRIPT_PATH="${SCRIPT_PATH%/*}"
+# NOTE: The startup path only uses bash builtins, scripts built from this template run thousands of
+#       times, only the first run in a host forks to detect the platform and caches the result
+if [[ $0 == */* ]]; then
+    SCRIPT_PATH="${0%/*}"
+else
+    SCRIPT_PATH="."
+fi
 
 OS='unknown'
-ARCH="$(uname -m)"
+ARCH=''
+KERNEL=''
+PLATFORM_CACHE="${XDG_CACHE_HOME:-$HOME/.cache}/shell_platform"
 
 trap '{ exit_append; }' EXIT
 
-if hash realpath 2>/dev/null; then
-    SCRIPT_PATH=$(realpath "$SCRIPT_PATH")
-else
-    pushd "$SCRIPT_PATH" 1>/dev/null  || exit 1
-    SCRIPT_PATH="$(pwd -P)"
-    popd 1>/dev/null  || exit 1
+if builtin cd -P "$SCRIPT_PATH" 2>/dev/null; then
+    SCRIPT_PATH="$PWD"
+    builtin cd "$OLDPWD" || exit 1
 fi
 
 if [[ -n $ZSH_NAME ]]; then
@@ -60,47 +67,116 @@ else
     fi
 fi
 
-if [ -z "$SHELL_PLATFORM" ]; then
+if [[ -r /proc/sys/kernel/osrelease ]]; then
+    read -r KERNEL </proc/sys/kernel/osrelease
+fi
+
+function __detect_platform() {
     if [[ -n $TRAVIS_OS_NAME ]]; then
-        export SHELL_PLATFORM="$TRAVIS_OS_NAME"
+        SHELL_PLATFORM="$TRAVIS_OS_NAME"
     else
         case "$OSTYPE" in
-            *'linux'*)    export SHELL_PLATFORM='linux' ;;
-            *'darwin'*)   export SHELL_PLATFORM='osx' ;;
-            *'freebsd'*)  export SHELL_PLATFORM='bsd' ;;
-            *'cygwin'*)   export SHELL_PLATFORM='cygwin' ;;
-            *'msys'*)     export SHELL_PLATFORM='msys' ;;
-            *'windows'*)  export SHELL_PLATFORM='windows' ;;
-            *)            export SHELL_PLATFORM='unknown' ;;
+            *'linux'*)    SHELL_PLATFORM='linux' ;;
+            *'darwin'*)   SHELL_PLATFORM='osx' ;;
+            *'freebsd'*)  SHELL_PLATFORM='bsd' ;;
+            *'cygwin'*)   SHELL_PLATFORM='cygwin' ;;
+            *'msys'*)     SHELL_PLATFORM='msys' ;;
+            *'windows'*)  SHELL_PLATFORM='windows' ;;
+            *)            SHELL_PLATFORM='unknown' ;;
         esac
     fi
-fi
+}
+
+function __detect_os() {
+    local key
+    local value
+    local id=''
+
+    case "$SHELL_PLATFORM" in
+        # TODO: support more linux distros
+        linux)
+            if [[ -r /etc/os-release ]]; then
+                while IFS='=' read -r key value; do
+                    if [[ $key == 'ID' ]]; then
+                        value="${value#[\"\']}"
+                        id="${value%[\"\']}"
+                        break
+                    fi
+                done </etc/os-release
+            elif [[ -r /etc/issue ]]; then
+                read -r id _ </etc/issue
+            fi
 
-case "$SHELL_PLATFORM" in
-    # TODO: support more linux distros
-    linux)
-        if [[ -f /etc/arch-release ]]; then
-            OS='arch'
-        elif [[ "$(cat /etc/issue)" == Ubuntu* ]]; then
-            OS='ubuntu'
-        elif [[ -f /etc/debian_version ]] || [[ "$(cat /etc/issue)" == Debian* ]]; then
-            if [[ $ARCH == *\ armv7* ]]; then # Raspberry pi 3 uses armv7 cpu
+            if [[ -f /etc/arch-release ]] || [[ $id == 'arch' ]]; then
+                OS='arch'
+            elif [[ $id =~ ^[Uu]buntu$ ]]; then
+                OS='ubuntu'
+            elif [[ $id == 'raspbian' ]]; then
                 OS='raspbian'
-            else
-                OS='debian'
+            elif [[ -f /etc/debian_version ]] || [[ $id =~ ^[Dd]ebian$ ]]; then
+                if [[ $ARCH == armv7* ]]; then # Raspberry pi 3 uses armv7 cpu
+                    OS='raspbian'
+                else
+                    OS='debian'
+                fi
             fi
-        fi
-        ;;
-    cygwin | msys | windows)
-        OS='windows'
-        ;;
-    osx)
-        OS='macos'
-        ;;
-    bsd)
-        OS='bsd'
-        ;;
-esac
+            ;;
+        cygwin | msys | windows)
+            OS='windows'
+            ;;
+        osx)
+            OS='macos'
+            ;;
+        bsd)
+            OS='bsd'
+            ;;
+    esac
+}
+
+function __load_platform() {
+    local key
+    local value
+    local cache_key=''
+    local platform=''
+    local os=''
+    local arch=''
+
+    [[ -r $PLATFORM_CACHE ]] || return 1
+    while IFS='=' read -r key value; do
+        case "$key" in
+            CACHE_KEY)      cache_key="$value" ;;
+            SHELL_PLATFORM) platform="$value" ;;
+            OS)             os="$value" ;;
+            ARCH)           arch="$value" ;;
+        esac
+    done <"$PLATFORM_CACHE"
+
+    # The cache is dropped if the host, the kernel or bash changed, or if another run is still writing it
+    if [[ $cache_key != "${HOSTNAME}:${MACHTYPE}:${KERNEL}" ]] || [[ -z $platform ]] || [[ -z $os ]] || [[ -z $arch ]]; then
+        return 1
+    fi
+    if [[ -z $SHELL_PLATFORM ]] || [[ $SHELL_PLATFORM == "$platform" ]]; then
+        SHELL_PLATFORM="$platform"
+        OS="$os"
+        ARCH="$arch"
+        return 0
+    fi
+    return 1
+}
+
+function __save_platform() {
+    [[ -d ${PLATFORM_CACHE%/*} ]] || mkdir -p "${PLATFORM_CACHE%/*}" 2>/dev/null || return 1
+    printf "CACHE_KEY=%s\nSHELL_PLATFORM=%s\nOS=%s\nARCH=%s\n" \
+        "${HOSTNAME}:${MACHTYPE}:${KERNEL}" "$SHELL_PLATFORM" "$OS" "$ARCH" 2>/dev/null >"$PLATFORM_CACHE"
+}
+
+if ! __load_platform; then
+    [[ -z $SHELL_PLATFORM ]] && __detect_platform
+    ARCH="$(uname -m)"
+    __detect_os
+    __save_platform
+fi
+export SHELL_PLATFORM
 
 if ! hash is_windows 2>/dev/null; then
     function is_windows() {
@@ -113,7 +189,7 @@ fi
 
 if ! hash is_wls 2>/dev/null; then
     function is_wls() {
-        if [[ "$(uname -r)" =~ Microsoft ]]; then
+        if [[ $KERNEL =~ [Mm]icrosoft ]]; then
             return 0
         fi
         return 1
@@ -129,7 +205,7 @@ if ! hash is_osx 2>/dev/null; then
     }
 fi
 
-if hash is_root 2>/dev/null; then
+if ! hash is_root 2>/dev/null; then
     function is_root() {
         if ! is_windows && [[ $EUID -eq 0 ]]; then
             return 0
@@ -138,20 +214,32 @@ if hash is_root 2>/dev/null; then
     }
 fi
 
-if hash has_sudo 2>/dev/null; then
+if ! hash has_sudo 2>/dev/null; then
     function has_sudo() {
-        if ! is_windows && hash sudo 2>/dev/null && [[ "$(groups)" =~ sudo ]]; then
-            return 0
+        local name
+        local gid
+        local group
+
+        if is_windows || ! hash sudo 2>/dev/null || [[ ! -r /etc/group ]]; then
+            return 1
         fi
+        # Same as matching the output of groups, without forking
+        while IFS=':' read -r name _ gid _; do
+            if [[ $name =~ sudo ]]; then
+                for group in "${GROUPS[@]}"; do
+                    if [[ $group == "$gid" ]]; then
+                        return 0
+                    fi
+                done
+            fi
+        done </etc/group
         return 1
     }
 fi
 
 if ! hash is_64bits 2>/dev/null; then
     function is_64bits() {
-        local arch
-        arch="$(uname -m)"
-        if [[ $arch == 'x86_64' ]] || [[ $arch == 'arm64' ]]; then
+        if [[ $ARCH == 'x86_64' ]] || [[ $ARCH == 'arm64' ]] || [[ $ARCH == 'aarch64' ]]; then
             return 0
         fi
         return 1
@@ -200,6 +288,9 @@ Usage:
         -v, --verbose
             Enable debug messages
 
+        -j N, --jobs=N
+            Max number of parallel jobs, defaults to the number of CPUs
+
         -h, --help
             Display help, if you are seeing this, that means that you already know it (nice)
 EOF
@@ -213,8 +304,8 @@ function warn_msg() {
         printf "[!] Warning:\t %s\n" "$msg"
     fi
     WARN_COUNT=$((WARN_COUNT + 1))
-    if [[ $NOLOG -eq 0 ]]; then
-        printf "[!] Warning:\t %s\n" "$msg" >>"${LOG}"
+    if [[ $NOLOG -eq 0 ]] && [[ -n $LOG_FD ]]; then
+        printf "[!] Warning:\t %s\n" "$msg" >&"$LOG_FD"
     fi
     return 0
 }
@@ -227,8 +318,8 @@ function error_msg() {
         printf "[X] Error:\t %s\n" "$msg" 1>&2
     fi
     ERR_COUNT=$((ERR_COUNT + 1))
-    if [[ $NOLOG -eq 0 ]]; then
-        printf "[X] Error:\t %s\n" "$msg" >>"${LOG}"
+    if [[ $NOLOG -eq 0 ]] && [[ -n $LOG_FD ]]; then
+        printf "[X] Error:\t %s\n" "$msg" >&"$LOG_FD"
     fi
     return 0
 }
@@ -240,8 +331,8 @@ function status_msg() {
     else
         printf "[*] Info:\t %s\n" "$msg"
     fi
-    if [[ $NOLOG -eq 0 ]]; then
-        printf "[*] Info:\t\t %s\n" "$msg" >>"${LOG}"
+    if [[ $NOLOG -eq 0 ]] && [[ -n $LOG_FD ]]; then
+        printf "[*] Info:\t\t %s\n" "$msg" >&"$LOG_FD"
     fi
     return 0
 }
@@ -255,8 +346,8 @@ function verbose_msg() {
             printf "[+] Debug:\t %s\n" "$msg"
         fi
     fi
-    if [[ $NOLOG -eq 0 ]]; then
-        printf "[+] Debug:\t\t %s\n" "$msg" >>"${LOG}"
+    if [[ $NOLOG -eq 0 ]] && [[ -n $LOG_FD ]]; then
+        printf "[+] Debug:\t\t %s\n" "$msg" >&"$LOG_FD"
     fi
     return 0
 }
@@ -285,18 +376,26 @@ function __parse_args() {
 }
 
 function initlog() {
-    if [[ $NOLOG -eq 0 ]]; then
-        [[ -n $LOG ]] && rm -f "${LOG}" 2>/dev/null
-        if ! touch "${LOG}" &>/dev/null; then
+    local line
+
+    if [[ $NOLOG -eq 0 ]] && [[ -z $LOG_FD ]]; then
+        [[ $LOG == /* ]] || LOG="$PWD/$LOG"
+        # NOTE: The log is opened once and kept in LOG_FD, messages do not reopen the file,
+        #       named fds need bash 4.1+ and macOS still ships bash 3.2
+        if ((BASH_VERSINFO[0] > 4 || (BASH_VERSINFO[0] == 4 && BASH_VERSINFO[1] >= 1))); then
+            { exec {LOG_FD}>"${LOG}"; } 2>/dev/null
+        else
+            { exec 9>"${LOG}"; } 2>/dev/null && LOG_FD=9
+        fi
+        if [[ -z $LOG_FD ]]; then
             error_msg "Fail to init log file"
             NOLOG=1
             return 1
         fi
         if [[ -f "${SCRIPT_PATH}/shell/banner" ]]; then
-            cat "${SCRIPT_PATH}/shell/banner" >"${LOG}"
-        fi
-        if ! is_osx; then
-            LOG=$(readlink -e "${LOG}")
+            while IFS= read -r line || [[ -n $line ]]; do
+                printf "%s\n" "$line"
+            done <"${SCRIPT_PATH}/shell/banner" >&"$LOG_FD"
         fi
         verbose_msg "Using log at ${LOG}"
     fi
@@ -304,17 +403,169 @@ function initlog() {
 }
 
 function exit_append() {
-    if [[ $NOLOG -eq 0 ]]; then
-        if [[ $WARN_COUNT -gt 0 ]] || [[ $ERR_COUNT -gt 0 ]]; then
-            printf "\n\n" >>"${LOG}"
+    if [[ $NOLOG -eq 0 ]] && [[ -n $LOG_FD ]]; then
+        if [[ $WARN_COUNT -gt 0 ]] || [[ $ERR_COUNT -gt 0 ]] || [[ $JOB_COUNT -gt 0 ]]; then
+            printf "\n\n" >&"$LOG_FD"
+        fi
+
+        if [[ $JOB_COUNT -gt 0 ]]; then
+            printf "[*] Jobs:\t%s (%s failed)\n" "$JOB_COUNT" "$JOB_FAIL_COUNT" >&"$LOG_FD"
         fi
 
         if [[ $WARN_COUNT -gt 0 ]]; then
-            printf "[*] Warnings:\t%s\n" "$WARN_COUNT" >>"${LOG}"
+            printf "[*] Warnings:\t%s\n" "$WARN_COUNT" >&"$LOG_FD"
         fi
         if [[ $ERR_COUNT -gt 0 ]]; then
-            printf "[*] Errors:\t%s\n" "$ERR_COUNT" >>"${LOG}"
+            printf "[*] Errors:\t%s\n" "$ERR_COUNT" >&"$LOG_FD"
+        fi
+    fi
+    return 0
+}
+
+# Run commands concurrently, at most N at a time
+# Each command is a string evaluated in its own subshell, so functions of this script can be used.
+# The output of each job is kept apart and printed, prefixed with the job number, once the job ends.
+# Failed jobs are reported as errors (or warnings with -w) and counted in the exit summary
+#
+# Usage:
+#   run_parallel [-j N] [-w] [--] "cmd 1" "cmd 2" ...
+#   run_parallel [-j N] [-w] -f FILE    # one command per line, empty lines and # comments are skipped
+#   run_parallel [-j N] [-w] - < <(printf '%s\n' "cmd 1" "cmd 2")
+#
+# NOTE: Do not pipe the commands (cmds | run_parallel -), the pipe runs the function in a subshell and
+#       the warnings/errors counters would be lost
+#
+# Returns 0 if all jobs succeed, 1 otherwise
+function run_parallel() {
+    local jobs="$JOBS"
+    local as_warning=0
+    local file=''
+    local cmd
+    local tmp
+    local line
+    local rc
+    local i
+    local next=0
+    local failed=0
+    local -a cmds=()
+    local -a pids=()
+    local -a ids=()
+    local -a running_pids=()
+    local -a running_ids=()
+
+    while [[ $# -gt 0 ]]; do
+        case "$1" in
+            -j | --jobs)
+                jobs="$2"
+                shift
+                ;;
+            -j*)
+                jobs="${1#-j}"
+                ;;
+            --jobs=*)
+                jobs="${1#*=}"
+                ;;
+            -w | --warn)
+                as_warning=1
+                ;;
+            -f | --file)
+                file="$2"
+                shift
+                ;;
+            -)
+                file='/dev/stdin'
+                ;;
+            --)
+                shift
+                cmds+=("$@")
+                break
+                ;;
+            *)
+                cmds+=("$1")
+                ;;
+        esac
+        shift
+    done
+
+    if [[ -n $file ]]; then
+        while IFS= read -r cmd || [[ -n $cmd ]]; do
+            if [[ -n $cmd ]] && [[ $cmd != \#* ]]; then
+                cmds+=("$cmd")
+            fi
+        done <"$file"
+    fi
+
+    if [[ -z $jobs ]]; then
+        jobs="$(getconf _NPROCESSORS_ONLN 2>/dev/null)" || jobs=4
+    fi
+    if ! [[ $jobs =~ ^[1-9][0-9]*$ ]]; then
+        error_msg "Invalid number of parallel jobs: $jobs"
+        return 1
+    fi
+    if [[ ${#cmds[@]} -eq 0 ]]; then
+        return 0
+    fi
+
+    if ! tmp="$(mktemp -d "${TMPDIR:-/tmp}/${NAME%%.*}.XXXXXX")"; then
+        error_msg "Failed to create the jobs output directory"
+        return 1
+    fi
+
+    verbose_msg "Running ${#cmds[@]} jobs, ${jobs} at a time"
+    while [[ $next -lt ${#cmds[@]} ]] || [[ ${#pids[@]} -gt 0 ]]; do
+        while [[ ${#pids[@]} -lt $jobs ]] && [[ $next -lt ${#cmds[@]} ]]; do
+            (eval "${cmds[$next]}") </dev/null >"$tmp/$next" 2>&1 &
+            pids+=("$!")
+            ids+=("$next")
+            next=$((next + 1))
+        done
+
+        # NOTE: wait -n needs bash 4.3+, older versions wait for the oldest job
+        if ((BASH_VERSINFO[0] > 4 || (BASH_VERSINFO[0] == 4 && BASH_VERSINFO[1] >= 3))); then
+            wait -n 2>/dev/null
+        else
+            wait "${pids[0]}" 2>/dev/null
         fi
+
+        running_pids=()
+        running_ids=()
+        for i in "${!pids[@]}"; do
+            # Finished jobs are already reaped, wait returns their stored exit code
+            if kill -0 "${pids[$i]}" 2>/dev/null; then
+                running_pids+=("${pids[$i]}")
+                running_ids+=("${ids[$i]}")
+                continue
+            fi
+            wait "${pids[$i]}" 2>/dev/null
+            rc=$?
+
+            while IFS= read -r line || [[ -n $line ]]; do
+                printf "[%s] %s\n" "$((ids[i] + 1))" "$line"
+                if [[ $NOLOG -eq 0 ]] && [[ -n $LOG_FD ]]; then
+                    printf "[%s] %s\n" "$((ids[i] + 1))" "$line" >&"$LOG_FD"
+                fi
+            done <"$tmp/${ids[$i]}"
+
+            if [[ $rc -eq 0 ]]; then
+                verbose_msg "Job $((ids[i] + 1)) done: ${cmds[${ids[$i]}]}"
+            else
+                failed=$((failed + 1))
+                if [[ $as_warning -eq 1 ]]; then
+                    warn_msg "Job $((ids[i] + 1)) failed with exit code $rc: ${cmds[${ids[$i]}]}"
+                else
+                    error_msg "Job $((ids[i] + 1)) failed with exit code $rc: ${cmds[${ids[$i]}]}"
+                fi
+            fi
+        done
+        pids=("${running_pids[@]}")
+        ids=("${running_ids[@]}")
+    done
+
+    rm -rf "$tmp"
+    JOB_COUNT=$((JOB_COUNT + ${#cmds[@]}))
+    JOB_FAIL_COUNT=$((JOB_FAIL_COUNT + failed))
+    if [[ $failed -gt 0 ]]; then
+        return 1
     fi
     return 0
 }
@@ -331,6 +582,13 @@ while [[ $# -gt 0 ]]; do
         -v | --verbose)
             VERBOSE=1
             ;;
+        -j | --jobs)
+            JOBS="$2"
+            shift
+            ;;
+        --jobs=*)
+            JOBS="${key#*=}"
+            ;;
         -h | --help)
             help_user
             exit 0
@@ -362,6 +620,8 @@ verbose_msg "OS            : ${OS}"
 #                           CODE Goes Here                            #
 #######################################################################
 
+# run_parallel -j "$JOBS" "ssh host1 uptime" "ssh host2 uptime" "ssh host3 uptime"
+
 #######################################################################
 #                           CODE Goes Here                            #
 #######################################################################